@@ -6,10 +6,11 @@ This file contains the contents for the server-side queries that complement "msB
 is to perform many queries across multiple datasets and report all of the results back to the client.
 '''
 import json
-import numpy as np
 
+import binaryProtocol
 import msSharedUtil
-from MUSCython import MultiStringBWTCython as MSBWT
+import requestTiming
+import workerPool
 
 dirLabels = msSharedUtil.dirLabels
 MSBWTdirs = msSharedUtil.MSBWTdirs
@@ -29,25 +30,79 @@ def getBatchQueryResults(jsonDatasets, jsonQueries, forward, revComp):
     datasets = json.loads(jsonDatasets)
     kmerQueries = json.loads(jsonQueries)
     
+    #the datasets are spread across the worker processes, results come back as each dataset finishes
     messageContents = {}
-    for dataset in datasets:
-        pieces = dataset.split('-')
-        directory = MSBWTdirs[int(pieces[0])]+'/'+'-'.join(pieces[1:])
-        
-        #load the MSBWT
-        msbwt = MSBWT.loadBWT(directory)
-        if forward == "true":
-            forwardResults = [msbwt.countOccurrencesOfSeq(str(kmer)) for kmer in kmerQueries]
-        else:
-            forwardResults = []
-        if revComp == "true":
-            rcResults = [msbwt.countOccurrencesOfSeq(MSBWT.reverseComplement(str(kmer))) for kmer in kmerQueries]
-        else:
-            rcResults = []
-        
-        messageContents[dataset] = [forwardResults, rcResults]
+    for dataset, forwardResults, rcResults in workerPool.countDatasets(datasets, kmerQueries, forward == "true", revComp == "true"):
+        with requestTiming.span('serializeJSON', len(forwardResults)+len(rcResults)):
+            messageContents[dataset] = [forwardResults.tolist(), rcResults.tolist()]
         
     #messageContents = [forwardResults, rcResults]
-    message = json.dumps(messageContents)
+    with requestTiming.span('serializeJSON'):
+        message = json.dumps(messageContents)
     
     return message
+
+def streamBatchQueryResults(jsonDatasets, jsonQueries, forward, revComp):
+    '''
+    This function is the streaming version of getBatchQueryResults(...); each dataset is sent back as soon as it is counted
+    instead of waiting on all of them
+    @param jsonDatasets - JSON formatted, the datasets to query against
+    @param jsonQueries - JSON formatted, queries to perform
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - a generator of newline-terminated JSON records of the form {"dataset": <dataset>, "counts": [forward counts, reverse-complement counts]}
+    '''
+    datasets = json.loads(jsonDatasets)
+    kmerQueries = json.loads(jsonQueries)
+    
+    for dataset, forwardResults, rcResults in workerPool.countDatasets(datasets, kmerQueries, forward == "true", revComp == "true"):
+        with requestTiming.span('serializeJSON', len(forwardResults)+len(rcResults)):
+            record = json.dumps({"dataset":dataset, "counts":[forwardResults.tolist(), rcResults.tolist()]})+'\n'
+        yield record
+
+def streamBinaryBatchQueryResults(datasets, kmerQueries, forward, revComp):
+    '''
+    This function is the binary version of streamBatchQueryResults(...), see "binaryProtocol" for the format
+    @param datasets - the list of datasets to query against
+    @param kmerQueries - the list of k-mers from the binary request
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - a generator of the binary response, the header followed by one record per dataset as each one is counted
+    '''
+    yield binaryProtocol.encodeResponseHeader(len(datasets), len(kmerQueries), forward, revComp)
+    for dataset, forwardResults, rcResults in workerPool.countDatasets(datasets, kmerQueries, forward, revComp):
+        with requestTiming.span('serializeBinary', len(forwardResults)+len(rcResults)):
+            record = binaryProtocol.encodeCounts(dataset, forwardResults, rcResults)
+        yield record
+
+def getPanelBatchQueryResults(jsonDatasets, panelID, forward, revComp):
+    '''
+    This function is the same as getBatchQueryResults(...) for a registered panel instead of a list of queries
+    @param jsonDatasets - JSON formatted, the datasets to query against
+    @param panelID - the ID from queryPanels.registerPanel(...), only the ID is sent to the workers
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - (forward counts, reverse-complement counts)
+    '''
+    datasets = json.loads(jsonDatasets)
+    messageContents = {}
+    for dataset, forwardResults, rcResults in workerPool.countPanelDatasets(datasets, panelID, forward == "true", revComp == "true"):
+        with requestTiming.span('serializeJSON', len(forwardResults)+len(rcResults)):
+            messageContents[dataset] = [forwardResults.tolist(), rcResults.tolist()]
+    with requestTiming.span('serializeJSON'):
+        return json.dumps(messageContents)
+
+def streamPanelBatchQueryResults(jsonDatasets, panelID, forward, revComp):
+    '''
+    This function is the same as streamBatchQueryResults(...) for a registered panel instead of a list of queries
+    @param jsonDatasets - JSON formatted, the datasets to query against
+    @param panelID - the ID from queryPanels.registerPanel(...), only the ID is sent to the workers
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - a generator of newline-terminated JSON records of the form {"dataset": <dataset>, "counts": [forward counts, reverse-complement counts]}
+    '''
+    datasets = json.loads(jsonDatasets)
+    for dataset, forwardResults, rcResults in workerPool.countPanelDatasets(datasets, panelID, forward == "true", revComp == "true"):
+        with requestTiming.span('serializeJSON', len(forwardResults)+len(rcResults)):
+            record = json.dumps({"dataset":dataset, "counts":[forwardResults.tolist(), rcResults.tolist()]})+'\n'
+        yield record
@@ -0,0 +1,189 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the binary format that "/massQuery" and "/batchQuery" accept in place of the JSON form fields.  For large
+panels, parsing the JSON k-mers and writing every count as JSON took longer than the counting, so the binary format packs each
+k-mer into 2 bits per base and sends the counts back as little-endian integer arrays.  All values are little-endian.
+
+A request is sent with the content type REQUEST_TYPE and has this layout:
+    header - REQUEST_HEADER: magic 'MSBQ', version (1), flags (1 = forward, 2 = reverse-complement), number of datasets,
+        k-mer length, number of k-mers
+    datasets - for each dataset, the length of its ID (uint16) followed by the ID
+    k-mers - each k-mer takes (k-mer length+3)/4 bytes, the bases (A=0, C=1, G=2, T=3) are packed from the high bits of each byte
+        down and the unused bits of the last byte are 0
+
+The response has the content type RESPONSE_TYPE and this layout:
+    header - RESPONSE_HEADER: magic 'MSBC', version (1), flags (same as the request), number of datasets, number of k-mers
+    records - one per dataset in the order they finish: the length of the dataset ID (uint16), the ID, the size of each count in
+        bytes (uint8, 4 or 8), then the forward counts and the reverse-complement counts (each only if its flag is set)
+'''
+
+import struct
+
+import numpy as np
+
+#the content types of the binary request and response
+REQUEST_TYPE = 'application/x-msbwt-kmers'
+RESPONSE_TYPE = 'application/x-msbwt-counts'
+
+VERSION = 1
+REQUEST_MAGIC = 'MSBQ'
+RESPONSE_MAGIC = 'MSBC'
+REQUEST_HEADER = struct.Struct('<4sBBHII')
+RESPONSE_HEADER = struct.Struct('<4sBBHI')
+NAME_LENGTH = struct.Struct('<H')
+COUNT_BYTES = struct.Struct('<B')
+
+FLAG_FORWARD = 1
+FLAG_REVCOMP = 2
+
+#the bases in code order, and codeLookup[c] is the code for the ASCII base c (255 if it can't be packed)
+BASES = np.frombuffer('ACGT', dtype='<u1')
+codeLookup = np.empty(dtype='<u1', shape=(256, ))
+codeLookup[:] = 255
+for x, c in enumerate('ACGT'):
+    codeLookup[ord(c)] = x
+    codeLookup[ord(c.lower())] = x
+
+#where each of the 4 bases in a byte goes, from the high bits down
+SHIFTS = np.array([6, 4, 2, 0], dtype='<u1')
+
+def packKmers(kmers):
+    '''
+    @param kmers - a list of k-mers that all have the same length and only contain A, C, G, and T
+    @return - a tuple (k-mer length, packed bytes)
+    '''
+    if len(kmers) == 0:
+        return (0, '')
+    kmerLength = len(kmers[0])
+    joined = ''.join(kmers)
+    if kmerLength == 0 or len(joined) != kmerLength*len(kmers):
+        raise ValueError('Every k-mer must have the same non-zero length')
+    codes = codeLookup[np.frombuffer(joined, dtype='<u1')]
+    if np.any(codes == 255):
+        raise ValueError('Only A, C, G, and T can be packed')
+
+    bytesPerKmer = (kmerLength+3)/4
+    padded = np.zeros(dtype='<u1', shape=(len(kmers), bytesPerKmer*4))
+    padded[:, 0:kmerLength] = codes.reshape((len(kmers), kmerLength))
+    padded = padded.reshape((len(kmers), bytesPerKmer, 4)) << SHIFTS
+    packed = padded[:, :, 0] | padded[:, :, 1] | padded[:, :, 2] | padded[:, :, 3]
+    return (kmerLength, packed.tostring())
+
+def unpackKmers(data, offset, kmerLength, kmerCount):
+    '''
+    @param data - the request body
+    @param offset - where the packed k-mers start in "data"
+    @param kmerLength - the length of each k-mer
+    @param kmerCount - the number of k-mers
+    @return - a list of k-mer strings
+    '''
+    if kmerCount == 0:
+        return []
+    bytesPerKmer = (kmerLength+3)/4
+    packed = np.frombuffer(data, dtype='<u1', count=kmerCount*bytesPerKmer, offset=offset).reshape((kmerCount, bytesPerKmer))
+
+    #every byte holds 4 bases, the padding after the last base of each k-mer is dropped
+    codes = ((packed[:, :, np.newaxis] >> SHIFTS) & 3).reshape((kmerCount, bytesPerKmer*4))[:, 0:kmerLength]
+    return BASES[codes].view('S%d' % kmerLength).ravel().tolist()
+
+def encodeRequest(datasets, kmers, forward, revComp):
+    '''
+    Builds a binary request, this is for clients of the server
+    @param datasets - the list of dataset IDs to count in
+    @param kmers - a list of k-mers that all have the same length and only contain A, C, G, and T
+    @param forward - if True, the forward counts are requested
+    @param revComp - if True, the reverse-complement counts are requested
+    @return - the request body
+    '''
+    kmerLength, packed = packKmers(kmers)
+    flags = (FLAG_FORWARD if forward else 0) | (FLAG_REVCOMP if revComp else 0)
+    pieces = [REQUEST_HEADER.pack(REQUEST_MAGIC, VERSION, flags, len(datasets), kmerLength, len(kmers))]
+    for dataset in datasets:
+        pieces.append(NAME_LENGTH.pack(len(dataset)))
+        pieces.append(str(dataset))
+    pieces.append(packed)
+    return ''.join(pieces)
+
+def decodeRequest(data):
+    '''
+    Reads a binary request
+    @param data - the request body
+    @return - a tuple (datasets, k-mers, forward, revComp) where "forward" and "revComp" are booleans
+    '''
+    if len(data) < REQUEST_HEADER.size:
+        raise ValueError('The request is shorter than its header')
+    magic, version, flags, numDatasets, kmerLength, kmerCount = REQUEST_HEADER.unpack_from(data, 0)
+    if magic != REQUEST_MAGIC or version != VERSION:
+        raise ValueError('Unsupported request format')
+    if kmerLength == 0 and kmerCount > 0:
+        raise ValueError('The k-mer length must be greater than 0')
+
+    offset = REQUEST_HEADER.size
+    datasets = []
+    for x in xrange(0, numDatasets):
+        if offset+NAME_LENGTH.size > len(data):
+            raise ValueError('The request ends inside the dataset list')
+        nameLength = NAME_LENGTH.unpack_from(data, offset)[0]
+        offset += NAME_LENGTH.size
+        datasets.append(data[offset:offset+nameLength])
+        offset += nameLength
+
+    if len(data)-offset != kmerCount*((kmerLength+3)/4):
+        raise ValueError('Expected %d packed k-mers of length %d' % (kmerCount, kmerLength))
+    kmers = unpackKmers(data, offset, kmerLength, kmerCount)
+    return (datasets, kmers, (flags & FLAG_FORWARD) != 0, (flags & FLAG_REVCOMP) != 0)
+
+def encodeResponseHeader(numDatasets, kmerCount, forward, revComp):
+    '''
+    @param numDatasets - the number of dataset records that follow
+    @param kmerCount - the number of k-mers counted
+    @param forward - if True, each record has forward counts
+    @param revComp - if True, each record has reverse-complement counts
+    @return - the response header
+    '''
+    flags = (FLAG_FORWARD if forward else 0) | (FLAG_REVCOMP if revComp else 0)
+    return RESPONSE_HEADER.pack(RESPONSE_MAGIC, VERSION, flags, numDatasets, kmerCount)
+
+def encodeCounts(dataset, forwardResults, rcResults):
+    '''
+    @param dataset - the dataset ID
+    @param forwardResults - the forward counts, empty if they weren't requested
+    @param rcResults - the reverse-complement counts, empty if they weren't requested
+    @return - the response record for this dataset; the counts are 4 bytes each unless one of them needs 8
+    '''
+    maxCount = max([int(results.max()) for results in (forwardResults, rcResults) if len(results) > 0] or [0])
+    dtype = '<u4' if maxCount < 2**32 else '<u8'
+    return ''.join([NAME_LENGTH.pack(len(dataset)), str(dataset), COUNT_BYTES.pack(np.dtype(dtype).itemsize),
+                    np.asarray(forwardResults, dtype=dtype).tostring(), np.asarray(rcResults, dtype=dtype).tostring()])
+
+def decodeResponse(data):
+    '''
+    Reads a binary response, this is for clients of the server
+    @param data - the response body
+    @return - a dictionary where the key is a dataset ID and the value is a tuple (forward counts, reverse-complement counts) of
+        numpy uint64 arrays; a strand that wasn't requested is an empty array
+    '''
+    magic, version, flags, numDatasets, kmerCount = RESPONSE_HEADER.unpack_from(data, 0)
+    if magic != RESPONSE_MAGIC or version != VERSION:
+        raise ValueError('Unsupported response format')
+    forwardCount = kmerCount if (flags & FLAG_FORWARD) else 0
+    rcCount = kmerCount if (flags & FLAG_REVCOMP) else 0
+
+    offset = RESPONSE_HEADER.size
+    ret = {}
+    for x in xrange(0, numDatasets):
+        nameLength = NAME_LENGTH.unpack_from(data, offset)[0]
+        offset += NAME_LENGTH.size
+        dataset = data[offset:offset+nameLength]
+        offset += nameLength
+        countBytes = COUNT_BYTES.unpack_from(data, offset)[0]
+        offset += COUNT_BYTES.size
+        dtype = '<u%d' % countBytes
+
+        forwardResults = np.frombuffer(data, dtype=dtype, count=forwardCount, offset=offset).astype('<u8')
+        offset += forwardCount*countBytes
+        rcResults = np.frombuffer(data, dtype=dtype, count=rcCount, offset=offset).astype('<u8')
+        offset += rcCount*countBytes
+        ret[dataset] = (forwardResults, rcResults)
+    return ret
@@ -0,0 +1,202 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the memory report for the opened BWTs.  With "bwtMemoryMap" set in msSharedUtil, the BWT and its FM-index
+files are memory mapped, so the worker processes all share one copy of each file through the OS page cache instead of each
+holding their own.  The report reads "/proc/<pid>/smaps" in the web server process and in every worker to show, per dataset, how
+many bytes are mapped, how many are resident, and how much of that is really used once the shared pages are split between the
+processes ("proportional") or copied into a single process ("private").  Private copies (with "bwtMemoryMap" off) are not
+mapped files, so they don't show up in the report.  It is only available on Linux.
+'''
+
+import os
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+import bwtRegistry
+import datasetCatalog
+import jumpTable
+import msSharedUtil
+import workerPool
+
+#the files the "msbwt" package maps for a run-length encoded BWT, along with the jump table
+BWT_FILES = ['comp_msbwt.npy', 'comp_fmIndex.npy', 'comp_refIndex.npy', 'totalCounts.npy', 'lcps.npy', jumpTable.TABLE_FILENAME]
+
+#the files that "msbwt" writes the first time a BWT is loaded
+INDEX_FILES = ['comp_fmIndex.npy', 'comp_refIndex.npy', 'totalCounts.npy']
+
+#the smaps fields in the report, all of them in kB
+SMAPS_FIELDS = {'Size:':'mappedBytes', 'Rss:':'residentBytes', 'Pss:':'proportionalBytes', 'Private_Dirty:':'privateBytes'}
+
+#how long (in seconds) a report requested from "/bwtMemory" waits for the workers, which may be busy counting; the startup report
+#waits as long as the workers need to open every dataset
+REPORT_SECONDS = 5
+
+def prepareIndexes(directory):
+    '''
+    Builds the FM-index files for a BWT if any of them are missing.  This is done once before the workers start so that they only
+    map finished files instead of each building (and writing) their own.
+    @param directory - the BWT directory
+    @return - True if the files were built, False if they were already there
+    '''
+    if all([os.path.exists(directory+'/'+fn) for fn in INDEX_FILES]):
+        return False
+    bwt = MSBWT.loadBWT(directory)
+    del bwt
+    return True
+
+def warmDataset(directory, blockSize=16*1024**2):
+    '''
+    Reads every BWT file of a dataset once so its pages are in the OS page cache before the first query needs them
+    @param directory - the BWT directory
+    @param blockSize - the number of bytes read at a time
+    @return - the total number of bytes read
+    '''
+    ret = 0
+    for fn in BWT_FILES:
+        if not os.path.exists(directory+'/'+fn):
+            continue
+        with open(directory+'/'+fn, 'rb') as fp:
+            block = fp.read(blockSize)
+            while len(block) > 0:
+                ret += len(block)
+                block = fp.read(blockSize)
+    return ret
+
+def readMappings(pid='self'):
+    '''
+    Reads the memory mapped files of a process
+    @param pid - the process ID, or 'self' for this process
+    @return - a dictionary where the key is a file path and the value is a dictionary of the SMAPS_FIELDS values (in bytes)
+        summed over every mapping of that file; this is empty if "/proc" isn't available
+    '''
+    ret = {}
+    current = None
+    try:
+        fp = open('/proc/%s/smaps' % str(pid), 'r')
+    except IOError:
+        return ret
+
+    with fp:
+        for line in fp:
+            pieces = line.split()
+            if len(pieces) == 0:
+                continue
+            if pieces[0] in SMAPS_FIELDS:
+                if current != None:
+                    current[SMAPS_FIELDS[pieces[0]]] += int(pieces[1])*1024
+            elif not pieces[0].endswith(':'):
+                #a new mapping: "<start>-<end> <perms> <offset> <device> <inode> [path]"
+                if len(pieces) >= 6 and pieces[5].startswith('/'):
+                    current = ret.setdefault(pieces[5], dict([(v, 0) for v in SMAPS_FIELDS.itervalues()]))
+                else:
+                    current = None
+    return ret
+
+def getProcessReport(datasets, openDatasets):
+    '''
+    Measures the mapped and resident bytes of some datasets in this process
+    @param datasets - the list of dataset IDs
+    @param openDatasets - if True, each dataset is opened through the shared registry first
+    @return - a dictionary where the key is a dataset ID and the value is a dictionary of the SMAPS_FIELDS values (in bytes)
+    '''
+    if openDatasets:
+        for dataset in datasets:
+            bwtRegistry.getBWT(dataset)
+
+    mappings = readMappings()
+    ret = {}
+    for dataset in datasets:
+        directory = os.path.realpath(datasetCatalog.getDirectory(dataset))
+        values = dict([(v, 0) for v in SMAPS_FIELDS.itervalues()])
+        for fn in BWT_FILES:
+            for k, v in mappings.get(directory+'/'+fn, {}).iteritems():
+                values[k] += v
+        ret[dataset] = values
+    return ret
+
+def openAndReport(datasets):
+    '''
+    Opens some datasets in this process and measures them, this is what runs inside the workers at startup
+    @param datasets - the list of dataset IDs
+    @return - see getProcessReport(...)
+    '''
+    return getProcessReport(datasets, True)
+
+def reportOnly(datasets):
+    '''
+    Measures some datasets in this process without opening them, this is what runs inside the workers for getMemoryReport(...)
+    @param datasets - the list of dataset IDs
+    @return - see getProcessReport(...)
+    '''
+    return getProcessReport(datasets, False)
+
+def getMemoryReport(openDatasets=False):
+    '''
+    Measures every dataset in the web server process and in all of the workers
+    @param openDatasets - if True, each worker opens the datasets it owns before it is measured
+    @return - a dictionary where the key is a dataset ID and the value is a dictionary with the total 'mappedBytes',
+        'residentBytes', 'proportionalBytes', and 'privateBytes' over every process, the number of 'processes' that have it
+        mapped, the 'fileBytes' of its files on disk, and 'ownerAnswered' which is False if the worker that owns the dataset
+        didn't answer in time (so the totals leave that worker out)
+    '''
+    datasets = [entry['id'] for groupIndex, groupLabel, groupEntries in datasetCatalog.getGroups() for entry in groupEntries]
+    if openDatasets:
+        workerReports = workerPool.callOwners(openAndReport, datasets, msSharedUtil.pageDatasetSeconds*max(1, len(datasets)))
+    else:
+        workerReports = workerPool.callOwners(reportOnly, datasets, REPORT_SECONDS)
+    unanswered = set([x for x, workerReport in enumerate(workerReports) if workerReport == None])
+    processReports = [workerReport for workerReport in workerReports if workerReport != None]
+    if msSharedUtil.batchWorkers > 0:
+        #the web server process can have datasets open too
+        processReports.append(reportOnly(datasets))
+
+    ret = {}
+    for dataset in datasets:
+        directory = datasetCatalog.getDirectory(dataset)
+        total = dict([(v, 0) for v in SMAPS_FIELDS.itervalues()])
+        total['processes'] = 0
+        total['ownerAnswered'] = workerPool.getWorkerIndex(dataset, len(workerReports)) not in unanswered
+        total['fileBytes'] = sum([os.path.getsize(directory+'/'+fn) for fn in BWT_FILES if os.path.exists(directory+'/'+fn)])
+        for processReport in processReports:
+            values = processReport.get(dataset, None)
+            if values == None or values['mappedBytes'] == 0:
+                continue
+            for k, v in values.iteritems():
+                total[k] += v
+            total['processes'] += 1
+        ret[dataset] = total
+    return ret
+
+def formatReport(report):
+    '''
+    @param report - the dictionary from getMemoryReport(...)
+    @return - a list of lines for printing the report, one per dataset
+    '''
+    ret = ['%-30s %10s %12s %12s %12s %12s %10s' % ('dataset', 'processes', 'file', 'mapped', 'resident', 'proportional', 'private')]
+    for dataset in sorted(report.keys()):
+        values = report[dataset]
+        line = '%-30s %10d %12d %12d %12d %12d %10d' % (dataset, values['processes'], values['fileBytes'], values['mappedBytes'],
+                                                        values['residentBytes'], values['proportionalBytes'], values['privateBytes'])
+        if not values['ownerAnswered']:
+            line += ' (its worker did not answer)'
+        ret.append(line)
+    return ret
+
+def startup():
+    '''
+    Builds any missing FM-index files, opens every dataset on the worker that owns it, and prints the memory report; this does
+    nothing unless "bwtStartupReport" is set in msSharedUtil
+    '''
+    if not msSharedUtil.bwtStartupReport:
+        return
+
+    for groupIndex, groupLabel, groupEntries in datasetCatalog.getGroups():
+        for entry in groupEntries:
+            if prepareIndexes(entry['directory']):
+                print 'Built the FM-index for %s' % entry['id']
+
+    report = getMemoryReport(True)
+    print 'BWT memory (%s, in bytes):' % ('memory mapped' if msSharedUtil.bwtMemoryMap else 'private copies')
+    for line in formatReport(report):
+        print line
@@ -0,0 +1,124 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the process-wide registry of opened BWTs that is shared by all of the tools.  Instead of re-loading a BWT
+on every request, recently used BWTs are kept open up to a memory budget (see "bwtCacheBytes" in msSharedUtil) and the least
+recently used BWT is closed first when that budget is exceeded.  A BWT's jump table (see "jumpTable") is opened and kept with
+it, so a search never pairs a BWT with a table written for a different version of it.  Each process (every server process and batch worker) has its
+own registry, so the budget applies to each process separately.
+'''
+
+import collections
+import glob
+import os
+import threading
+import time
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+import datasetCatalog
+import datasetStats
+import jumpTable
+import msSharedUtil
+import requestTiming
+import serverMetrics
+
+#dataset ID -> (bwt, jump table or None, estimated bytes), ordered from least recently used to most recently used
+openBWTs = collections.OrderedDict()
+openBytes = 0
+registryLock = threading.Lock()
+
+#counters that operators can read through getStats()
+counters = {'hits':0, 'misses':0, 'evictions':0}
+
+def getBWT(dataset):
+    '''
+    Returns the opened BWT for a dataset, loading it from disk only if it is not currently in the registry
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - the BWT instance from the "msbwt" package
+    '''
+    return getSearchIndex(dataset)[0]
+
+def getSearchIndex(dataset):
+    '''
+    Returns the opened BWT for a dataset along with the jump table that was opened with it, loading both from disk only if they
+    are not currently in the registry
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - a tuple (bwt, table) where "bwt" is the BWT instance from the "msbwt" package and "table" is its jump table from
+        jumpTable.loadTable(...), or None if it doesn't have a current one or "useJumpTables" is off
+    '''
+    global openBytes
+    with registryLock:
+        if dataset in openBWTs:
+            #move it to the most recently used end
+            entry = openBWTs.pop(dataset)
+            openBWTs[dataset] = entry
+            counters['hits'] += 1
+            return getPair(entry)
+        counters['misses'] += 1
+
+    #load outside of the lock so one slow disk doesn't stall requests for other datasets
+    directory = datasetCatalog.getDirectory(dataset)
+    st = time.time()
+    with requestTiming.span('loadBWT', 1):
+        #the table has to match the BWT as it was before and after loading, otherwise "comp_msbwt.npy" changed in between and
+        #it's dropped rather than risk pairing it with the wrong BWT
+        bwtStamp = datasetStats.getBWTStamp(directory)
+        bwt = MSBWT.loadBWT(directory, msSharedUtil.bwtMemoryMap)
+        table = jumpTable.loadTable(directory, bwtStamp)
+        if table != None and datasetStats.getBWTStamp(directory) != bwtStamp:
+            table = None
+    serverMetrics.observe('msbwt_bwt_load_seconds', time.time()-st, dataset=dataset)
+    estimate = estimateBytes(directory)
+
+    with registryLock:
+        if dataset in openBWTs:
+            #another request finished loading it first, use that one
+            return getPair(openBWTs[dataset])
+        openBWTs[dataset] = (bwt, table, estimate)
+        openBytes += estimate
+
+        #evict until we fit, but always keep the one we just loaded
+        while openBytes > msSharedUtil.bwtCacheBytes and len(openBWTs) > 1:
+            oldDataset, (oldBWT, oldTable, oldEstimate) = openBWTs.popitem(last=False)
+            openBytes -= oldEstimate
+            counters['evictions'] += 1
+
+    return getPair((bwt, table, estimate))
+
+def getPair(entry):
+    '''
+    @param entry - a registry entry (bwt, table, estimated bytes)
+    @return - the tuple (bwt, table) returned by getSearchIndex(...), with no table if "useJumpTables" is off
+    '''
+    if not msSharedUtil.useJumpTables:
+        return (entry[0], None)
+    return (entry[0], entry[1])
+
+def estimateBytes(directory):
+    '''
+    Estimates the memory used by an opened BWT as the size of the ".npy" files it is built from
+    @param directory - the BWT directory
+    @return - the estimated number of bytes
+    '''
+    return sum([os.path.getsize(fn) for fn in glob.glob(directory+'/*.npy')])
+
+def clear():
+    '''
+    Closes every BWT in the registry; the counters are left alone
+    '''
+    global openBytes
+    with registryLock:
+        openBWTs.clear()
+        openBytes = 0
+
+def getStats():
+    '''
+    @return - a dictionary of the registry counters along with what is currently open
+    '''
+    with registryLock:
+        ret = dict(counters)
+        ret['openDatasets'] = list(openBWTs.keys())
+        ret['openBytes'] = openBytes
+        ret['budgetBytes'] = msSharedUtil.bwtCacheBytes
+    return ret
@@ -0,0 +1,100 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the consensus builder shared by "msCompare" and "msAllele".  Reads that have been lined up around a pattern
+are counted per column with NumPy, and the consensus is the symbol with the most votes in each column ('.' and '$' don't vote).
+The counts can be added to as more reads (or other sets of counts) come in, so a group doesn't need to be re-counted when it grows.
+'''
+
+import numpy as np
+
+#upperLookup[c] is the upper case version of the ASCII symbol c
+upperLookup = np.arange(0, 256, dtype='<u1')
+upperLookup[ord('a'):ord('z')+1] -= ord('a')-ord('A')
+
+def toMatrix(reads):
+    '''
+    @param reads - a list of strings that are all the same width, or a numpy uint8 matrix with one read per row
+    @return - a numpy uint8 matrix with one read per row
+    '''
+    if isinstance(reads, np.ndarray):
+        return reads
+    if len(reads) == 0:
+        return np.zeros(dtype='<u1', shape=(0, 0))
+    return np.frombuffer(''.join(reads), dtype='<u1').reshape((len(reads), len(reads[0])))
+
+class ConsensusCounts(object):
+    '''
+    The number of times each symbol occurs in each column for a set of reads that all have the same width
+    '''
+    def __init__(self, width=None):
+        '''
+        @param width - the width of the reads, if None it is taken from the first reads that are added
+        '''
+        self.counts = None
+        self.numReads = 0
+        if width != None:
+            self.counts = np.zeros(dtype='<u8', shape=(width, 256))
+
+    def addReads(self, reads):
+        '''
+        Adds reads to the counts
+        @param reads - a list of strings that are all the same width, or a numpy uint8 matrix with one read per row
+        '''
+        matrix = toMatrix(reads)
+        if matrix.shape[0] == 0:
+            return
+        width = matrix.shape[1]
+        if self.counts is None:
+            self.counts = np.zeros(dtype='<u8', shape=(width, 256))
+
+        #each (column, symbol) pair gets its own bin so every column is counted in one call
+        bins = (np.arange(0, width, dtype='<i8')*256)[np.newaxis, :]+matrix
+        self.counts += np.bincount(bins.ravel(), minlength=width*256).reshape((width, 256)).astype('<u8')
+        self.numReads += matrix.shape[0]
+
+    def merge(self, other):
+        '''
+        Adds the counts from another set of reads to this one
+        @param other - another ConsensusCounts for reads with the same width
+        '''
+        if other.counts is None:
+            return
+        if self.counts is None:
+            self.counts = np.zeros(dtype='<u8', shape=other.counts.shape)
+        self.counts += other.counts
+        self.numReads += other.numReads
+
+    def getConsensus(self, upperCase=False):
+        '''
+        @param upperCase - if True, the consensus is converted to upper case
+        @return - a tuple of the form (consensus, disagreements)
+            consensus - the symbol with the most votes in each column ('.' if nothing voted); ties go to the larger symbol
+            disagreements - a numpy uint64 array with the number of votes for other symbols in each column
+        '''
+        if self.counts is None:
+            return ('', np.zeros(dtype='<u8', shape=(0, )))
+        width = self.counts.shape[0]
+        votes = self.counts.copy()
+        votes[:, ord('.')] = 0
+        votes[:, ord('$')] = 0
+
+        #argmax picks the first maximum, so searching the symbols in reverse gives ties to the larger symbol
+        best = 255-np.argmax(votes[:, ::-1], axis=1)
+        bestVotes = votes[np.arange(0, width), best]
+        consensus = np.where(bestVotes > 0, best, ord('.')).astype('<u1')
+        if upperCase:
+            consensus = upperLookup[consensus]
+        disagreements = votes.sum(axis=1)-bestVotes
+        return (consensus.tostring(), disagreements)
+
+def buildConsensus(reads, upperCase=False):
+    '''
+    Builds the consensus for a set of reads in one pass
+    @param reads - a list of strings that are all the same width, or a numpy uint8 matrix with one read per row
+    @param upperCase - if True, the consensus is converted to upper case
+    @return - a tuple of the form (consensus, disagreements), see ConsensusCounts.getConsensus(...)
+    '''
+    counts = ConsensusCounts()
+    counts.addReads(reads)
+    return counts.getConsensus(upperCase)
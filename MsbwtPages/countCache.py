@@ -0,0 +1,537 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the persistent k-mer count cache shared by the query tools.  Counts are keyed by a fingerprint of the
+dataset (its directory along with the modification time and size of "comp_msbwt.npy") and the k-mer, so re-running the same
+panels doesn't touch the BWT and a rebuilt BWT never returns old counts.  The counts are kept in a fixed size hash table that
+every process memory maps from "counts.npy": a k-mer is hashed (with numpy, a whole list at once) to a bucket of COUNT_WAYS
+slots, and a new count replaces the least recently used slot of its bucket.  A file lock lets any number of processes look
+counts up while one adds to the table.  The paths found by "followPath" are larger and far fewer, so they are cached in a SQLite
+database instead, capped in msSharedUtil with the least recently used paths removed first.  The hit and miss counters are kept
+in memory and written to the database every STATS_FLUSH_SECONDS.
+'''
+
+import collections
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import bwtRegistry
+import datasetCatalog
+import kmerCounter
+import msSharedUtil
+import requestTiming
+import serverMetrics
+from MUSCython import MultiStringBWTCython as MSBWT
+
+#the number of slots in each bucket of the count table
+COUNT_WAYS = 4
+
+#the fields of each slot in the count table; a slot with a zero first key is empty
+KEY1 = 0
+KEY2 = 1
+COUNT = 2
+LAST_USED = 3
+
+#the multipliers of the two k-mer hashes, and the constants of the final mixing step (from splitmix64)
+HASH_MULTIPLIERS = np.array([0x100000001b3, 0x9e3779b97f4a7c15], dtype='<u8')
+MIX_MULTIPLIERS = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+
+#a hit only re-writes its "lastUsed" time if it is older than this, so repeated hits don't turn every lookup into a write
+TOUCH_SECONDS = 3600
+
+#when a table is over its cap, it is trimmed to this fraction of the cap so we aren't evicting on every insert
+EVICT_FRACTION = 0.9
+
+#how often (in seconds) each process adds its hit and miss counters to the stats table when it has nothing else to write
+STATS_FLUSH_SECONDS = 10
+
+#fingerprint -> dataset ID in the database
+datasetIDs = {}
+datasetIDsLock = threading.Lock()
+
+#the memory mapped count table and the open lock file for it, along with the process, directory and size they were opened for
+countTable = None
+countLockFile = None
+countTableKey = None
+
+#a file lock doesn't keep out the threads of the process holding it, so they also take this lock
+countTableLock = threading.Lock()
+
+#each thread's open connection, along with the process and database file it was opened for
+local = threading.local()
+
+#the process and database file the tables were last created for
+schemaKey = None
+schemaLock = threading.Lock()
+
+#the process the hit and miss counters belong to; a forked process starts over so its parent's counters aren't written twice
+ownerPid = None
+pendingStats = collections.Counter()
+lastFlush = 0.0
+ownerLock = threading.Lock()
+
+def isEnabled():
+    '''
+    @return - True if k-mer counts are cached (see "countCacheEntries" in msSharedUtil)
+    '''
+    return msSharedUtil.countCacheEntries > 0
+
+def isPathCacheEnabled():
+    '''
+    @return - True if followed paths are cached (see "countCachePaths" in msSharedUtil)
+    '''
+    return msSharedUtil.countCachePaths > 0
+
+def checkOwner():
+    '''
+    Resets the pending counters the first time this process records something; call with ownerLock held
+    '''
+    global ownerPid, lastFlush
+    if ownerPid == os.getpid():
+        return
+    ownerPid = os.getpid()
+    pendingStats.clear()
+    lastFlush = time.time()
+
+def getConnection():
+    '''
+    @return - this thread's connection to the cache database; it is opened the first time a thread (or a forked process) needs
+        it and then left open, and the tables are created once per process
+    '''
+    global schemaKey
+    key = (os.getpid(), msSharedUtil.countCacheDirectory)
+    conn = getattr(local, 'conn', None)
+    if conn != None and local.key == key:
+        return conn
+
+    if not os.path.exists(msSharedUtil.countCacheDirectory):
+        os.makedirs(msSharedUtil.countCacheDirectory)
+    conn = sqlite3.connect(msSharedUtil.countCacheDirectory+'/counts.db', timeout=60)
+    with schemaLock:
+        if schemaKey != key:
+            #WAL lets the worker processes read while another one is writing
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS datasets (datasetID INTEGER PRIMARY KEY, fingerprint TEXT UNIQUE)')
+            conn.execute('CREATE TABLE IF NOT EXISTS paths (datasetID INTEGER, kmer TEXT, threshold INTEGER, result TEXT, '+
+                         'lastUsed INTEGER, PRIMARY KEY (datasetID, kmer, threshold))')
+            conn.execute('CREATE INDEX IF NOT EXISTS pathsLastUsed ON paths (lastUsed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.commit()
+            schemaKey = key
+    local.conn = conn
+    local.key = key
+    return conn
+
+def getFingerprint(dataset):
+    '''
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - a string that changes whenever the BWT for this dataset is rebuilt
+    '''
+    directory = os.path.abspath(datasetCatalog.getDirectory(dataset))
+    filestat = os.stat(directory+'/comp_msbwt.npy')
+    return '%s:%d:%d' % (directory, int(filestat.st_mtime), filestat.st_size)
+
+def getDatasetID(conn, dataset):
+    '''
+    @param conn - an open connection to the cache database
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - the integer used for this dataset's current fingerprint in the database
+    '''
+    fingerprint = getFingerprint(dataset)
+    with datasetIDsLock:
+        if fingerprint in datasetIDs:
+            return datasetIDs[fingerprint]
+
+    #only a fingerprint that has never been seen is written
+    row = conn.execute('SELECT datasetID FROM datasets WHERE fingerprint=?', (fingerprint, )).fetchone()
+    if row == None:
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO datasets (fingerprint) VALUES (?)', (fingerprint, ))
+        row = conn.execute('SELECT datasetID FROM datasets WHERE fingerprint=?', (fingerprint, )).fetchone()
+    datasetID = row[0]
+    with datasetIDsLock:
+        datasetIDs[fingerprint] = datasetID
+    return datasetID
+
+def addStats(conn, changes):
+    '''
+    Adds to the counters in the stats table, these are shared by every process using the cache
+    @param conn - an open connection to the cache database, this should be called inside a transaction
+    @param changes - a dictionary from counter name to the amount to add
+    '''
+    for name, value in changes.iteritems():
+        if value != 0:
+            conn.execute('INSERT OR IGNORE INTO stats VALUES (?, 0)', (name, ))
+            conn.execute('UPDATE stats SET value=value+? WHERE name=?', (value, name))
+
+def countStats(changes):
+    '''
+    Adds to the hit and miss counters of this process, they are written to the stats table by takeStats(...)
+    @param changes - a dictionary from counter name to the amount to add
+    '''
+    with ownerLock:
+        checkOwner()
+        pendingStats.update(changes)
+
+def takeStats(force):
+    '''
+    @param force - if True, the counters are returned even if they were written less than STATS_FLUSH_SECONDS ago
+    @return - the counters of this process that should be added to the stats table now (see addStats(...)); they are cleared
+        here, so the caller has to write them
+    '''
+    global lastFlush
+    with ownerLock:
+        checkOwner()
+        if not force and time.time()-lastFlush < STATS_FLUSH_SECONDS:
+            return {}
+        ret = dict(pendingStats)
+        pendingStats.clear()
+        lastFlush = time.time()
+    return ret
+
+def flushStats(conn, force):
+    '''
+    Writes the counters of this process to the stats table if it is time to, for callers that have nothing else to write
+    @param conn - an open connection to the cache database
+    @param force - if True, the counters are written even if they were written less than STATS_FLUSH_SECONDS ago
+    '''
+    changes = takeStats(force)
+    if len(changes) > 0:
+        with conn:
+            addStats(conn, changes)
+
+def getStat(conn, name):
+    '''
+    @param conn - an open connection to the cache database
+    @param name - the counter to read
+    @return - the value of that counter, 0 if it has never been set
+    '''
+    row = conn.execute('SELECT value FROM stats WHERE name=?', (name, )).fetchone()
+    return 0 if row == None else row[0]
+
+def evict(conn, table, maxEntries):
+    '''
+    Removes the least recently used entries from a table if it is over its cap
+    @param conn - an open connection to the cache database, this should be called inside a transaction
+    @param table - the table to trim, "paths"
+    @param maxEntries - the cap for the table
+    '''
+    numEntries = getStat(conn, table+'Entries')
+    if numEntries > maxEntries:
+        before = conn.total_changes
+        conn.execute('DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s ORDER BY lastUsed LIMIT ?)' % (table, table),
+                     (numEntries-int(maxEntries*EVICT_FRACTION), ))
+        removed = conn.total_changes-before
+        addStats(conn, {table+'Entries':-removed, table+'Evictions':removed})
+
+def getCountTable():
+    '''
+    Opens the count table the first time this process needs it; the table is created (or re-created if "countCacheEntries" has
+    changed) while holding the file lock
+    @return - the table as a memory mapped uint64 array with the shape (buckets, COUNT_WAYS, 4); call with countTableLock held
+    '''
+    global countTable, countLockFile, countTableKey
+    key = (os.getpid(), msSharedUtil.countCacheDirectory, msSharedUtil.countCacheEntries)
+    if countTableKey == key:
+        return countTable
+
+    if not os.path.exists(msSharedUtil.countCacheDirectory):
+        os.makedirs(msSharedUtil.countCacheDirectory)
+    #a forked process opens its own lock file, since a file lock is shared by every process using the same open file
+    countLockFile = open(msSharedUtil.countCacheDirectory+'/counts.lock', 'a')
+    filename = msSharedUtil.countCacheDirectory+'/counts.npy'
+    shape = ((msSharedUtil.countCacheEntries+COUNT_WAYS-1)/COUNT_WAYS, COUNT_WAYS, 4)
+    fcntl.flock(countLockFile, fcntl.LOCK_EX)
+    try:
+        table = None
+        if os.path.exists(filename):
+            table = np.lib.format.open_memmap(filename, mode='r+')
+            if table.shape != shape or table.dtype != np.dtype('<u8'):
+                table = None
+        if table is None:
+            #the file is filled in as it is used, so it starts out sparse on disk
+            np.lib.format.open_memmap(filename+'.tmp', mode='w+', dtype='<u8', shape=shape).flush()
+            os.rename(filename+'.tmp', filename)
+            table = np.lib.format.open_memmap(filename, mode='r+')
+    finally:
+        fcntl.flock(countLockFile, fcntl.LOCK_UN)
+    countTable = table
+    countTableKey = key
+    return countTable
+
+def hashKmers(fingerprint, kmers):
+    '''
+    Hashes a list of k-mers for one dataset; the two 64-bit hashes are both stored with a count, so a different k-mer (or the
+    same k-mer in a rebuilt BWT) is never mistaken for a cached one
+    @param fingerprint - the dataset fingerprint from getFingerprint(...)
+    @param kmers - a list of strings to hash
+    @return - a numpy uint64 array with the shape (len(kmers), 2); the first hash is never 0
+    '''
+    keys = np.empty((len(kmers), 2), dtype='<u8')
+    if len(kmers) == 0:
+        return keys
+    seeds = np.frombuffer(hashlib.sha1(fingerprint).digest()[0:16], dtype='<u8')
+    kmerArray = np.array(kmers, dtype='S')
+    symbols = kmerArray.view(np.uint8).reshape(len(kmers), kmerArray.itemsize)
+    #the shorter k-mers are padded with zeros, which never appear in a k-mer
+    lengths = np.count_nonzero(symbols, axis=1)
+
+    #the k-mers of each length are hashed together, one column of symbols at a time
+    uniqueLengths = np.unique(lengths)
+    for length in uniqueLengths:
+        if len(uniqueLengths) == 1:
+            rows = slice(None)
+            columns = np.ascontiguousarray(symbols.T)
+        else:
+            rows = np.nonzero(lengths == length)[0]
+            columns = np.ascontiguousarray(symbols[rows].T)
+        hashes = np.empty((columns.shape[1], 2), dtype='<u8')
+        hashes[:] = seeds ^ np.uint64(length)
+        for column in xrange(0, length):
+            hashes ^= columns[column][:, None]
+            hashes *= HASH_MULTIPLIERS
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= MIX_MULTIPLIERS[0]
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= MIX_MULTIPLIERS[1]
+        hashes ^= hashes >> np.uint64(31)
+        keys[rows] = hashes
+
+    keys[:, KEY1] |= np.uint64(1)
+    return keys
+
+def findSlots(table, keys):
+    '''
+    @param table - the count table from getCountTable()
+    @param keys - the k-mer hashes from hashKmers(...)
+    @return - a tuple (buckets, slot contents, hits, hit slot) where "slot contents" is a copy of each k-mer's bucket with the
+        shape (len(keys), COUNT_WAYS, 4) and "hit slot" is only meaningful where "hits" is True
+    '''
+    buckets = (keys[:, KEY2] % np.uint64(table.shape[0])).astype(np.intp)
+    slots = table[buckets]
+    matches = (slots[:, :, KEY1] == keys[:, KEY1:KEY1+1]) & (slots[:, :, KEY2] == keys[:, KEY2:KEY2+1])
+    return (buckets, slots, matches.any(axis=1), matches.argmax(axis=1))
+
+def lookupCounts(keys, now):
+    '''
+    @param keys - the k-mer hashes from hashKmers(...)
+    @param now - the current time in seconds, saved with any hit that hasn't been used in the last TOUCH_SECONDS
+    @return - a tuple (counts, hits) of numpy arrays; a count is only meaningful where "hits" is True
+    '''
+    with countTableLock:
+        table = getCountTable()
+        fcntl.flock(countLockFile, fcntl.LOCK_SH)
+        try:
+            buckets, slots, hits, hitSlots = findSlots(table, keys)
+            rows = np.arange(0, len(keys))
+            counts = slots[rows, hitSlots, COUNT]
+
+            #the last use time is only a hint for replacing slots, so readers can update it side by side
+            stale = hits & (slots[rows, hitSlots, LAST_USED] < np.uint64(now-TOUCH_SECONDS))
+            table[buckets[stale], hitSlots[stale], LAST_USED] = now
+        finally:
+            fcntl.flock(countLockFile, fcntl.LOCK_UN)
+    return (counts, hits)
+
+def storeCounts(keys, counts, now):
+    '''
+    Adds counts to the table, each one replaces the least recently used (or an empty) slot of its bucket
+    @param keys - the k-mer hashes from hashKmers(...)
+    @param counts - the count for each key
+    @param now - the current time in seconds
+    @return - a tuple (added, evicted) with the number of counts saved and the number of older counts they replaced
+    '''
+    with countTableLock:
+        table = getCountTable()
+        fcntl.flock(countLockFile, fcntl.LOCK_EX)
+        try:
+            #another process may have added some of these since they were looked up, and a k-mer may be listed twice
+            buckets, slots, hits, hitSlots = findSlots(table, keys)
+            unique = np.zeros(len(keys), dtype='bool')
+            unique[np.unique(keys[:, KEY1], return_index=True)[1]] = True
+            selected = np.nonzero(~hits & unique)[0]
+
+            #new counts in the same bucket take its slots from the least recently used, and any past COUNT_WAYS are dropped
+            selected = selected[np.argsort(buckets[selected], kind='mergesort')]
+            sortedBuckets = buckets[selected]
+            groupStarts = np.r_[0, np.nonzero(sortedBuckets[1:] != sortedBuckets[:-1])[0]+1]
+            ranks = np.arange(0, len(selected))-np.repeat(groupStarts, np.diff(np.r_[groupStarts, len(selected)]))
+            selected, ranks = selected[ranks < COUNT_WAYS], ranks[ranks < COUNT_WAYS]
+            victims = np.argsort(slots[selected, :, LAST_USED], axis=1, kind='mergesort')[np.arange(0, len(selected)), ranks]
+            buckets = buckets[selected]
+            evicted = int(np.count_nonzero(slots[selected, victims, KEY1]))
+
+            table[buckets, victims, COUNT] = counts[selected]
+            table[buckets, victims, LAST_USED] = now
+            table[buckets, victims, KEY2] = keys[selected, KEY2]
+            table[buckets, victims, KEY1] = keys[selected, KEY1]
+        finally:
+            fcntl.flock(countLockFile, fcntl.LOCK_UN)
+    return (len(selected), evicted)
+
+def countKmers(dataset, kmers):
+    '''
+    Counts a list of k-mers in a dataset, only searching the BWT for the ones that aren't in the cache
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param kmers - a list of strings to count
+    @return - a numpy uint64 array of counts in the same order as the input
+    '''
+    kmers = [str(kmer) for kmer in kmers]
+    if not isEnabled():
+        serverMetrics.increment('msbwt_kmers_counted_total', len(kmers), dataset=dataset, source='bwt')
+        bwt, table = bwtRegistry.getSearchIndex(dataset)
+        with requestTiming.span('countKmers', len(kmers)):
+            return kmerCounter.countKmers(bwt, kmers, table)
+
+    return countCachedKmers(dataset, kmers, False)
+
+def countUniqueKmers(dataset, uniqueKmers, presorted):
+    '''
+    Counts a list of k-mers with no duplicates, only searching the BWT for the ones that aren't in the cache
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param uniqueKmers - a list of distinct strings to count
+    @param presorted - if True, "uniqueKmers" is already in the search order from kmerCounter.getSearchOrder(...)
+    @return - a numpy uint64 array of counts in the same order as the input
+    '''
+    if not isEnabled():
+        serverMetrics.increment('msbwt_kmers_counted_total', len(uniqueKmers), dataset=dataset, source='bwt')
+        bwt, table = bwtRegistry.getSearchIndex(dataset)
+        with requestTiming.span('countKmers', len(uniqueKmers)):
+            if presorted:
+                return kmerCounter.countSortedKmers(bwt, uniqueKmers, table)
+            return kmerCounter.countKmers(bwt, uniqueKmers, table)
+    return countCachedKmers(dataset, uniqueKmers, presorted)
+
+def countCachedKmers(dataset, kmers, presorted):
+    '''
+    Looks a list of k-mers up in the count table, and counts (and saves) the ones that aren't there
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param kmers - a list of strings to count, a k-mer can be listed more than once
+    @param presorted - if True, "kmers" is already in the search order from kmerCounter.getSearchOrder(...)
+    @return - a numpy uint64 array of counts in the same order as the input
+    '''
+    now = int(time.time())
+    with requestTiming.span('countCacheLookup', len(kmers)):
+        keys = hashKmers(getFingerprint(dataset), kmers)
+        counts, hits = lookupCounts(keys, now)
+
+    #everything else comes from the BWT, which is only opened if something is missing; filtering keeps any search order
+    missingIndices = np.nonzero(~hits)[0]
+    if len(missingIndices) > 0:
+        missing = [kmers[i] for i in missingIndices]
+        bwt, table = bwtRegistry.getSearchIndex(dataset)
+        with requestTiming.span('countKmers', len(missing)):
+            if presorted:
+                counts[missingIndices] = kmerCounter.countSortedKmers(bwt, missing, table)
+            else:
+                counts[missingIndices] = kmerCounter.countKmers(bwt, missing, table)
+        with requestTiming.span('countCacheStore', len(missing)):
+            added, evicted = storeCounts(keys[missingIndices], counts[missingIndices], now)
+        countStats({'countsEvictions':evicted})
+
+    countStats({'countHits':len(kmers)-len(missingIndices), 'countMisses':len(missingIndices)})
+    flushStats(getConnection(), False)
+    serverMetrics.increment('msbwt_kmers_counted_total', len(missingIndices), dataset=dataset, source='bwt')
+    serverMetrics.increment('msbwt_kmers_counted_total', len(kmers)-len(missingIndices), dataset=dataset, source='cache')
+    return counts
+
+def countKmerStrands(dataset, kmers, forward, revComp):
+    '''
+    The cached version of kmerCounter.countKmerStrands(...)
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param kmers - a list of strings to count
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - a tuple (forward counts, reverse-complement counts) of numpy uint64 arrays; a disabled strand is an empty array
+    '''
+    kmers = [str(kmer) for kmer in kmers]
+    queries = []
+    if forward:
+        queries += kmers
+    if revComp:
+        queries += [MSBWT.reverseComplement(kmer) for kmer in kmers]
+
+    counts = countKmers(dataset, queries)
+    numForward = len(kmers) if forward else 0
+    return (counts[0:numForward], counts[numForward:])
+
+def lookupPath(dataset, kmer, kmerThreshold):
+    '''
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param kmer - the k-mer the path starts from
+    @param kmerThreshold - the threshold the path was followed with
+    @return - the JSON string saved by storePath(...), or None if it isn't cached
+    '''
+    if not isPathCacheEnabled():
+        return None
+
+    conn = getConnection()
+    datasetID = getDatasetID(conn, dataset)
+    now = int(time.time())
+    row = conn.execute('SELECT result, lastUsed FROM paths WHERE datasetID=? AND kmer=? AND threshold=?',
+                       (datasetID, kmer, kmerThreshold)).fetchone()
+    countStats({'pathHits' if row != None else 'pathMisses':1})
+    if row != None and row[1] < now-TOUCH_SECONDS:
+        with conn:
+            conn.execute('UPDATE paths SET lastUsed=? WHERE datasetID=? AND kmer=? AND threshold=?',
+                         (now, datasetID, kmer, kmerThreshold))
+            addStats(conn, takeStats(True))
+    else:
+        flushStats(conn, False)
+
+    return None if row == None else row[0]
+
+def storePath(dataset, kmer, kmerThreshold, result):
+    '''
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param kmer - the k-mer the path starts from
+    @param kmerThreshold - the threshold the path was followed with
+    @param result - the JSON string to save for this path
+    '''
+    if not isPathCacheEnabled():
+        return
+
+    conn = getConnection()
+    datasetID = getDatasetID(conn, dataset)
+    with conn:
+        before = conn.total_changes
+        conn.execute('INSERT OR IGNORE INTO paths VALUES (?, ?, ?, ?, ?)', (datasetID, kmer, kmerThreshold, result, int(time.time())))
+        added = conn.total_changes-before
+        addStats(conn, takeStats(True))
+        addStats(conn, {'pathsEntries':added})
+        if added > 0:
+            evict(conn, 'paths', msSharedUtil.countCachePaths)
+
+def getStats():
+    '''
+    @return - a dictionary of the cache counters, the number of entries, and the hit rates; the hits and misses of other
+        processes may be up to STATS_FLUSH_SECONDS behind
+    '''
+    ret = {'enabled':isEnabled(),
+           'pathsEnabled':isPathCacheEnabled(),
+           'maxCounts':msSharedUtil.countCacheEntries,
+           'maxPaths':msSharedUtil.countCachePaths}
+    if not isEnabled() and not isPathCacheEnabled():
+        return ret
+
+    conn = getConnection()
+    flushStats(conn, True)
+    for name in ['countHits', 'countMisses', 'countsEvictions', 'pathHits', 'pathMisses', 'pathsEntries', 'pathsEvictions']:
+        ret[name] = getStat(conn, name)
+
+    #the used slots are counted directly, the table never shrinks or moves entries
+    ret['countsEntries'] = 0
+    if isEnabled():
+        with countTableLock:
+            ret['countsEntries'] = int(np.count_nonzero(getCountTable()[:, :, KEY1]))
+
+    for prefix in ['count', 'path']:
+        total = ret[prefix+'Hits']+ret[prefix+'Misses']
+        ret[prefix+'HitRate'] = float(ret[prefix+'Hits'])/total if total > 0 else 0.0
+    return ret
@@ -0,0 +1,181 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the catalog of available datasets.  The directories in msSharedUtil are scanned once at startup and the
+datasets along with their parsed "metadata.csv" and statistics sidecar are kept in memory.  A background thread re-scans a
+directory when its modification time (or that of any of its BWTs, metadata files, or statistics files) changes, and reload() can be called to force a full re-scan.
+'''
+
+import glob
+import os
+import threading
+import time
+
+import datasetStats
+import msSharedUtil
+
+#groups[j] is the sorted list of dataset entries found in MSBWTdirs[j]
+groups = []
+
+#dataset ID -> dataset entry
+datasetsByID = {}
+
+#group index -> the modification stamp that group was scanned with
+groupStamps = {}
+
+#catalogLock protects the above, refreshLock keeps two scans from running at once
+catalogLock = threading.Lock()
+refreshLock = threading.Lock()
+refreshThread = None
+loaded = False
+
+def start():
+    '''
+    Performs the initial scan and starts the background refresh thread (if enabled by "catalogRefreshSeconds")
+    '''
+    global refreshThread
+    refresh(True)
+    if msSharedUtil.catalogRefreshSeconds > 0 and refreshThread == None:
+        refreshThread = threading.Thread(target=refreshLoop, name="datasetCatalog")
+        refreshThread.daemon = True
+        refreshThread.start()
+
+def refreshLoop():
+    '''
+    The body of the background thread, re-scans any group that has changed since the last check
+    '''
+    while True:
+        time.sleep(msSharedUtil.catalogRefreshSeconds)
+        try:
+            refresh(False)
+        except Exception:
+            #a directory disappearing mid-scan shouldn't kill the thread; we'll try again next time
+            pass
+
+def reload():
+    '''
+    Forces a full re-scan of every directory, this is what the admin reload endpoint calls
+    @return - a summary of the catalog after reloading (see getSummary())
+    '''
+    refresh(True)
+    return getSummary()
+
+def refresh(force):
+    '''
+    Re-scans the groups that have changed since they were last scanned
+    @param force - if True, every group is re-scanned regardless of modification times
+    '''
+    global groups, datasetsByID, loaded
+    with refreshLock:
+        newGroups = list(groups)
+        newGroups += [[] for j in xrange(len(newGroups), len(msSharedUtil.MSBWTdirs))]
+        changed = False
+        for j, msdir in enumerate(msSharedUtil.MSBWTdirs):
+            stamp = getGroupStamp(msdir, groups[j] if j < len(groups) else [])
+            if force or groupStamps.get(j, None) != stamp:
+                newGroups[j] = scanGroup(j, msdir)
+                #the stamp has to include the datasets we just found so edits to their metadata are seen next time
+                groupStamps[j] = getGroupStamp(msdir, newGroups[j])
+                changed = True
+
+        if changed or not loaded:
+            newByID = {}
+            for entries in newGroups:
+                for entry in entries:
+                    newByID[entry['id']] = entry
+            with catalogLock:
+                groups = newGroups
+                datasetsByID = newByID
+                loaded = True
+
+def scanGroup(groupIndex, msdir):
+    '''
+    Finds every BWT in a directory and loads its metadata and statistics
+    @param groupIndex - the index of the directory in MSBWTdirs
+    @param msdir - the directory to scan
+    @return - a list of dataset entries sorted by their location on disk
+    '''
+    ret = []
+    for bwtFN in sorted(glob.glob("%s/*/comp_msbwt.npy" % msdir)):
+        directory = os.path.dirname(bwtFN)
+        label = os.path.basename(directory)
+        ret.append({'id':str(groupIndex)+'-'+label,
+                    'group':groupIndex,
+                    'label':label,
+                    'directory':directory,
+                    'metadata':msSharedUtil.loadMetadata(directory),
+                    'stats':datasetStats.loadStats(directory)})
+    return ret
+
+def getGroupStamp(msdir, entries):
+    '''
+    Builds a value that changes whenever a dataset is added to or removed from a directory, or a BWT, metadata file, or statistics
+    file is modified
+    @param msdir - the directory containing the BWTs
+    @param entries - the datasets currently known to be in the directory
+    @return - a tuple of modification times
+    '''
+    stamp = (getModTime(msdir), )
+    for entry in entries:
+        #the BWT itself is included because rebuilding it makes the old statistics invalid
+        stamp += (getModTime(entry['directory']+'/metadata.csv'),
+                  getModTime(entry['directory']+'/'+datasetStats.STATS_FILENAME),
+                  getModTime(entry['directory']+'/comp_msbwt.npy'))
+    return stamp
+
+def getModTime(fn):
+    '''
+    @param fn - the file or directory to check
+    @return - the modification time, or None if it doesn't exist
+    '''
+    try:
+        return os.stat(fn).st_mtime
+    except OSError:
+        return None
+
+def ensureLoaded():
+    '''
+    Scans the directories if start() has not been called yet (for example, when the pages are used outside of the server)
+    '''
+    if not loaded:
+        refresh(True)
+
+def getGroups():
+    '''
+    @return - a list of tuples (group index, group label, list of dataset entries), one per directory in MSBWTdirs
+    '''
+    ensureLoaded()
+    with catalogLock:
+        currGroups = groups
+    return [(j, msSharedUtil.dirLabels[j], entries) for j, entries in enumerate(currGroups)]
+
+def getDataset(dataset):
+    '''
+    Looks up a dataset by the ID used in the web pages; if it isn't found, the directories are checked for changes once
+    before giving up
+    @param dataset - the dataset ID with the format <directory index>-<dataset>; ex: 0-test indicates a bwt folder labeled
+        "test" in the first directory
+    @return - a dictionary with the keys 'id', 'group', 'label', 'directory', 'metadata', and 'stats' (None if the dataset has
+        no current statistics sidecar)
+    '''
+    ensureLoaded()
+    entry = datasetsByID.get(dataset, None)
+    if entry == None:
+        refresh(False)
+        entry = datasetsByID.get(dataset, None)
+        if entry == None:
+            raise KeyError('Unknown dataset: '+str(dataset))
+    return entry
+
+def getDirectory(dataset):
+    '''
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - the path to the BWT directory
+    '''
+    return getDataset(dataset)['directory']
+
+def getSummary():
+    '''
+    @return - a dictionary from group label to the number of datasets in that group
+    '''
+    return dict([(label, len(entries)) for j, label, entries in getGroups()])
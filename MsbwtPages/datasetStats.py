@@ -0,0 +1,119 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the per-dataset statistics sidecar.  The number of strings and bases, the index size, the total of each
+symbol, and a histogram of read lengths are computed once (see "buildStats.py") and saved next to "comp_msbwt.npy", so the pages
+can show them without opening the BWT.  The dataset catalog loads the sidecar with the rest of the dataset; a sidecar written for
+a different "comp_msbwt.npy" (by size or modification time) is ignored and the values are read from the BWT instead.
+'''
+
+import json
+import os
+import random
+
+import bwtRegistry
+import datasetCatalog
+
+#the name of the sidecar inside each BWT directory
+STATS_FILENAME = 'msbwtStats.json'
+
+#bumped whenever the contents of the sidecar change
+STATS_VERSION = 1
+
+#the symbols in the order the BWT stores them
+SYMBOLS = '$ACGNT'
+
+def getBWTStamp(directory):
+    '''
+    @param directory - the BWT directory
+    @return - a tuple (size, modification time) of "comp_msbwt.npy", used to tell if a sidecar is out of date
+    '''
+    filestat = os.stat(directory+'/comp_msbwt.npy')
+    return (filestat.st_size, int(filestat.st_mtime))
+
+def computeStats(bwt, directory, sampleReads=100000, seed=0):
+    '''
+    Computes the statistics for a BWT
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param directory - the BWT directory
+    @param sampleReads - the maximum number of reads used for the read length histogram; every read is used if there are fewer
+    @param seed - the seed used to pick the reads for the histogram
+    @return - a dictionary of statistics that can be saved with saveStats(...)
+    '''
+    fileSize, modTime = getBWTStamp(directory)
+    stringCount = int(bwt.getSymbolCount(0))
+    baseCount = int(bwt.getTotalSize())
+
+    #the first "stringCount" rows of the BWT each start with the '$' of one read
+    if stringCount <= sampleReads:
+        rows = xrange(0, stringCount)
+    else:
+        rows = sorted(random.Random(seed).sample(xrange(0, stringCount), sampleReads))
+    readLengths = {}
+    for i in rows:
+        readLen = len(bwt.recoverString(i))-1
+        readLengths[readLen] = readLengths.get(readLen, 0)+1
+
+    return {'version':STATS_VERSION,
+            'bwtSize':fileSize,
+            'bwtModified':modTime,
+            'stringCount':stringCount,
+            'baseCount':baseCount,
+            'fileSize':fileSize,
+            'bitsPerBase':(8.0*fileSize)/baseCount,
+            'symbolCounts':dict([(c, int(bwt.getSymbolCount(x))) for x, c in enumerate(SYMBOLS)]),
+            'readLengths':dict([(str(k), v) for k, v in readLengths.iteritems()]),
+            'readLengthsSampled':len(rows),
+            'maxReadLength':max(readLengths.keys()) if len(readLengths) > 0 else 0}
+
+def saveStats(directory, stats):
+    '''
+    Writes the sidecar for a BWT directory
+    @param directory - the BWT directory
+    @param stats - the dictionary from computeStats(...)
+    '''
+    #write to a temporary file first so the catalog never reads half of a sidecar
+    tempFN = directory+'/'+STATS_FILENAME+'.tmp'
+    with open(tempFN, 'w') as fp:
+        json.dump(stats, fp, indent=4, sort_keys=True)
+    os.rename(tempFN, directory+'/'+STATS_FILENAME)
+
+def loadStats(directory):
+    '''
+    Reads the sidecar for a BWT directory
+    @param directory - the BWT directory
+    @return - the dictionary from computeStats(...), or None if there is no sidecar or it doesn't match the current BWT
+    '''
+    statsFN = directory+'/'+STATS_FILENAME
+    if not os.path.exists(statsFN):
+        return None
+    try:
+        with open(statsFN, 'r') as fp:
+            stats = json.load(fp)
+        fileSize, modTime = getBWTStamp(directory)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if stats.get('version', None) != STATS_VERSION or stats.get('bwtSize', None) != fileSize or stats.get('bwtModified', None) != modTime:
+        return None
+    return stats
+
+def getStats(dataset):
+    '''
+    Gets the statistics shown in the page headers for a dataset; these come from the sidecar if there is a current one, otherwise
+    the BWT is opened (through the shared registry) the same way the pages used to
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @return - a dictionary with at least 'stringCount', 'baseCount', 'fileSize', 'bitsPerBase', and 'maxReadLength'
+    '''
+    entry = datasetCatalog.getDataset(dataset)
+    if entry.get('stats', None) != None:
+        return entry['stats']
+
+    filestat = os.stat(entry['directory']+'/comp_msbwt.npy')
+    bwt = bwtRegistry.getBWT(dataset)
+    baseCount = int(bwt.getTotalSize())
+    return {'stringCount':int(bwt.getSymbolCount(0)),
+            'baseCount':baseCount,
+            'fileSize':filestat.st_size,
+            'bitsPerBase':(8.0*filestat.st_size)/baseCount,
+            'maxReadLength':len(bwt.recoverString(0))-1}
@@ -8,6 +8,9 @@ there is no ambiguity in the next base.
 import json
 import numpy as np
 
+import bwtRegistry
+import countCache
+import jumpTable
 import msSharedUtil
 from MUSCython import MultiStringBWTCython as MSBWT
 
@@ -26,19 +29,104 @@ def getPath(dataset, kmer, kmerThreshold):
     message = ""
     
     #dataset has the format: <directory index>-<dataset>; ex: 0-test indicates a bwt folder labeled "test" in the first directory
-    #this masks the layout of directories on the client side while allowing us to know what is what server-side
-    pieces = dataset.split('-')
-    directory = MSBWTdirs[int(pieces[0])]+'/'+'-'.join(pieces[1:])
+    #this masks the layout of directories on the client side while allowing us to know what is what server-side; the shared
+    #registry handles the parsing and keeps the MSBWT open between requests
+    messageContents = getUnitig(dataset, kmer, kmerThreshold)
+    message = json.dumps(messageContents)
+    
+    return message
+
+def exploreGraph(dataset, kmer, kmerThreshold, maxNodes, maxDepth):
+    '''
+    This function explores the implicit de Bruijn graph breadth-first from a seed k-mer.  Each node is a path as returned by
+    getPath(...) and the children of a node are the extensions at the end of its path that pass the threshold; this is the same
+    graph that "msTarget" builds one click at a time.
+    @param dataset - the dataset we are going to explore, same format as getPath(...)
+    @param kmer - the seed pattern
+    @param kmerThreshold - the minimum allowed count for a path to be considered present
+    @param maxNodes - the maximum number of nodes to return (capped by "exploreMaxNodes" in msSharedUtil)
+    @param maxDepth - the maximum distance from the seed to explore (capped by "exploreMaxDepth" in msSharedUtil)
+    @return - a JSON formatted message with a list of nodes in the order they were found, a list of edges, and whether the
+        exploration stopped early because of the limits; nodes past the limits are included but not explored
+    '''
+    maxNodes = min(maxNodes, msSharedUtil.exploreMaxNodes)
+    maxDepth = min(maxDepth, msSharedUtil.exploreMaxDepth)
+    
+    validSymbols = ['A', 'C', 'G', 'T']
+    kmerLength = len(kmer)
     
-    #load the MSBWT
-    msbwt = MSBWT.loadBWT(directory)
+    nodes = [{'id':'n0', 'kmer':kmer, 'parent':'Seed', 'depth':0, 'explored':False}]
+    nodeIDs = {kmer:'n0'}
+    edges = []
+    truncated = False
     
+    #nodes are explored in the order they are created, which makes this breadth-first
+    x = 0
+    while x < len(nodes):
+        node = nodes[x]
+        x += 1
+        if node['depth'] >= maxDepth:
+            truncated = True
+            continue
+        
+        path, counts, revCounts, nextCounts, revNextCounts = getUnitig(dataset, node['kmer'], kmerThreshold)
+        node.update({'explored':True, 'path':path, 'counts':counts, 'revCounts':revCounts,
+                     'nextCounts':nextCounts, 'revNextCounts':revNextCounts})
+        
+        for c in xrange(0, 4):
+            edgeCount = nextCounts[c]+revNextCounts[c]
+            if edgeCount >= kmerThreshold:
+                childKmer = path[len(path)-kmerLength+1:]+validSymbols[c]
+                if childKmer not in nodeIDs:
+                    if len(nodes) >= maxNodes:
+                        truncated = True
+                        continue
+                    nodeIDs[childKmer] = 'n'+str(len(nodes))
+                    nodes.append({'id':nodeIDs[childKmer], 'kmer':childKmer, 'parent':node['id'],
+                                  'depth':node['depth']+1, 'explored':False})
+                edges.append({'source':node['id'], 'target':nodeIDs[childKmer], 'base':validSymbols[c], 'count':edgeCount})
+    
+    messageContents = {'nodes':nodes, 'edges':edges, 'truncated':truncated}
+    message = json.dumps(messageContents)
+    
+    return message
+
+def getUnitig(dataset, kmer, kmerThreshold):
+    '''
+    This function returns the result of followUnitig(...) for a dataset, using the count cache when the same path has been
+    followed before
+    @param dataset - the dataset we are going to follow, same format as getPath(...)
+    @param kmer - the pattern to follow
+    @param kmerThreshold - the minimum allowed count for a path to be considered present
+    @return - the same list that followUnitig(...) returns
+    '''
+    #k-mers taken from a cached path come back from JSON as unicode
+    kmer = str(kmer)
+    cached = countCache.lookupPath(dataset, kmer, kmerThreshold)
+    if cached != None:
+        return json.loads(cached)
+    
+    msbwt, table = bwtRegistry.getSearchIndex(dataset)
+    ret = followUnitig(msbwt, kmer, kmerThreshold, table)
+    countCache.storePath(dataset, kmer, kmerThreshold, json.dumps(ret))
+    return ret
+
+def followUnitig(msbwt, kmer, kmerThreshold, table=None):
+    '''
+    This function does the actual walk for getPath(...) on an already loaded BWT
+    @param msbwt - an instance of the BasicBWT class from the "msbwt" package
+    @param kmer - the pattern to follow
+    @param kmerThreshold - the minimum allowed count for a path to be considered present
+    @param table - the BWT's jump table from jumpTable.loadTable(...), or None
+    @return - a list of the form [path, forward counts, reverse-complement counts, next forward counts, next reverse-complement counts]
+        where the "next" counts are the counts of the four possible extensions at the end of the path
+    '''
     #build the stuff we care about counting
     totalPath = kmer
     currentKmer = kmer
     revKmer = MSBWT.reverseComplement(kmer)
-    counts = [msbwt.countOccurrencesOfSeq(kmer)]
-    revCounts = [msbwt.countOccurrencesOfSeq(revKmer)]
+    counts = [jumpTable.countOccurrencesOfSeq(msbwt, table, kmer)]
+    revCounts = [jumpTable.countOccurrencesOfSeq(msbwt, table, revKmer)]
     
     currentCounts = [0]*4
     revCurrentCounts = [0]*4
@@ -47,16 +135,33 @@ def getPath(dataset, kmer, kmerThreshold):
     validSymbols = ['A', 'C', 'G', 'T']
     revValidSymbols = ['T', 'G', 'C', 'A']
     
+    #indices of the symbols above in the FM-index arrays, which are ordered "$ACGNT"
+    fmIndices = [1, 2, 3, 5]
+    revFMIndices = [5, 3, 2, 1]
+    
     while counts[-1]+revCounts[-1] >= kmerThreshold:
-        #trim our current kmer
+        #trim our current kmer, "backIndex" is the symbol we just removed
+        backIndex = validSymbols.index(currentKmer[0]) if currentKmer[0] in validSymbols else -1
         currentKmer = currentKmer[1:]
         revKmer = revKmer[0:-1]
         
-        #now get the current counts
-        currentCounts = [msbwt.countOccurrencesOfSeq(currentKmer+c) for c in validSymbols]
-        revCurrentCounts = [msbwt.countOccurrencesOfSeq(c+revKmer) for c in revValidSymbols]
-        backCounts = [(msbwt.countOccurrencesOfSeq(validSymbols[x]+currentKmer)+
-                       msbwt.countOccurrencesOfSeq(revKmer+revValidSymbols[x])) for x in xrange(0, 4)]
+        #every query that puts a symbol in front of one of the (k-1)-mers is a single LF step from the (k-1)-mer's range, so
+        #search each (k-1)-mer once and get all four of those counts from the FM-index at the ends of its range
+        lo, hi = jumpTable.findIndicesOfStr(msbwt, table, currentKmer)
+        loFM = msbwt.getFullFMAtIndex(lo)
+        hiFM = msbwt.getFullFMAtIndex(hi)
+        frontCounts = [int(hiFM[i]-loFM[i]) for i in fmIndices]
+        
+        lo, hi = jumpTable.findIndicesOfStr(msbwt, table, revKmer)
+        loFM = msbwt.getFullFMAtIndex(lo)
+        hiFM = msbwt.getFullFMAtIndex(hi)
+        revCurrentCounts = [int(hiFM[i]-loFM[i]) for i in revFMIndices]
+        
+        #appending a symbol still needs a full search, but mismatches stop after a few symbols; the k-mer we came from
+        #was counted on the last step
+        currentCounts = [jumpTable.countOccurrencesOfSeq(msbwt, table, currentKmer+c) for c in validSymbols]
+        backCounts = [(frontCounts[x]+jumpTable.countOccurrencesOfSeq(msbwt, table, revKmer+revValidSymbols[x])) if x != backIndex
+                      else (counts[-1]+revCounts[-1]) for x in xrange(0, 4)]
     
         #now analyze the counts to see if 1 or more values meets our criteria
         passedThreshold = sum([(currentCounts[x]+revCurrentCounts[x] >= kmerThreshold) for x in xrange(0, 4)])
@@ -77,7 +182,4 @@ def getPath(dataset, kmer, kmerThreshold):
             #if two or more meet the criteria, we should break out
             break
     
-    messageContents = [totalPath, counts, revCounts, currentCounts, revCurrentCounts]
-    message = json.dumps(messageContents)
-    
-    return message
\ No newline at end of file
+    return [totalPath, counts, revCounts, currentCounts, revCurrentCounts]
@@ -0,0 +1,312 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the job queue for large batch queries.  A submitted job is stored in a local SQLite database and executed
+by background threads, one chunk of k-mers at a time.  Every finished chunk is written to the database right away, so a job
+that is interrupted (or re-submitted after a failure) only counts the chunks that are missing.  The job ID is derived from
+the job contents, which means submitting the same query twice returns the same job.  Each waiting or running job is owned by
+one server process, which keeps a heartbeat on it; if that process dies, any live process takes the job over.
+'''
+
+import errno
+import hashlib
+import json
+import os
+import Queue
+import sqlite3
+import threading
+import time
+import traceback
+
+import msSharedUtil
+import workerPool
+
+#job states
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+jobIDs = Queue.Queue()
+runningThreads = []
+startLock = threading.Lock()
+
+#if False, start() doesn't re-queue the unfinished jobs; "serve.py" only lets its first server process resume them, the
+#other processes (including restarted ones) pick up jobs from dead processes through the heartbeat
+resumeJobs = True
+
+#identifies this process as the owner of its jobs, set by start(); the process ID is included so a dead owner is noticed
+#right away, and the random part keeps a re-used process ID from looking like the old owner
+ownerToken = None
+
+def getConnection():
+    '''
+    @return - a new connection to the job database, creating the tables if this is the first use
+    '''
+    if not os.path.exists(msSharedUtil.jobDirectory):
+        os.makedirs(msSharedUtil.jobDirectory)
+    conn = sqlite3.connect(msSharedUtil.jobDirectory+'/jobs.db', timeout=60)
+    conn.execute('CREATE TABLE IF NOT EXISTS jobs (jobID TEXT PRIMARY KEY, state TEXT, datasets TEXT, kmers TEXT, '+
+                 'forward INTEGER, revComp INTEGER, chunkSize INTEGER, submitted REAL, error TEXT, numKmers INTEGER, '+
+                 'owner TEXT, heartbeat REAL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS chunks (jobID TEXT, dataset TEXT, start INTEGER, forwardCounts TEXT, '+
+                 'rcCounts TEXT, PRIMARY KEY (jobID, dataset, start))')
+
+    #databases from before "numKmers" was saved get the column, filled in once from each job's k-mer list
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+    if 'numKmers' not in columns:
+        with conn:
+            conn.execute('ALTER TABLE jobs ADD COLUMN numKmers INTEGER')
+            for jobID, kmers in conn.execute('SELECT jobID, kmers FROM jobs').fetchall():
+                conn.execute('UPDATE jobs SET numKmers=? WHERE jobID=?', (len(json.loads(kmers)), jobID))
+
+    #databases from before jobs had owners get empty columns, so their unfinished jobs look orphaned
+    for column, columnType in [('owner', 'TEXT'), ('heartbeat', 'REAL')]:
+        if column not in columns:
+            with conn:
+                conn.execute('ALTER TABLE jobs ADD COLUMN %s %s' % (column, columnType))
+    return conn
+
+def start():
+    '''
+    Starts the job threads and the heartbeat thread, and takes over any job that was waiting or running when the server
+    last stopped
+    '''
+    global ownerToken
+    with startLock:
+        if len(runningThreads) > 0:
+            return
+        ownerToken = '%d:%s' % (os.getpid(), os.urandom(8).encode('hex'))
+        if resumeJobs:
+            #nothing else is running yet, so every unfinished job is taken over without waiting for it to look orphaned
+            conn = getConnection()
+            unfinished = conn.execute('SELECT jobID, owner, heartbeat FROM jobs WHERE state IN (?, ?) ORDER BY submitted',
+                                      (STATE_QUEUED, STATE_RUNNING)).fetchall()
+            for jobID in claimJobs(conn, unfinished):
+                jobIDs.put(jobID)
+            conn.close()
+
+        for x in xrange(0, msSharedUtil.jobThreads):
+            t = threading.Thread(target=jobLoop, name="jobQueue-%d" % x)
+            t.daemon = True
+            t.start()
+            runningThreads.append(t)
+
+        t = threading.Thread(target=heartbeatLoop, name="jobQueue-heartbeat")
+        t.daemon = True
+        t.start()
+        runningThreads.append(t)
+
+def isOwnerAlive(owner):
+    '''
+    @param owner - the owner token of a job
+    @return - False if the process in the token no longer exists (or there is no owner), True otherwise
+    '''
+    if owner == None:
+        return False
+    try:
+        os.kill(int(owner.split(':')[0]), 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    except ValueError:
+        return False
+    return True
+
+def findOrphans(conn, jobID=None):
+    '''
+    @param conn - a job database connection
+    @param jobID - if set, only this job is checked; otherwise every waiting or running job is
+    @return - a list of (jobID, owner, heartbeat) for each job whose owner is dead or hasn't updated its heartbeat recently
+    '''
+    staleTime = time.time()-msSharedUtil.jobOrphanSeconds
+    query = 'SELECT jobID, owner, heartbeat FROM jobs WHERE state IN (?, ?) AND (owner IS NULL OR owner != ?)'
+    args = (STATE_QUEUED, STATE_RUNNING, ownerToken)
+    if jobID != None:
+        query += ' AND jobID=?'
+        args += (jobID, )
+    return [(orphanID, owner, heartbeat) for orphanID, owner, heartbeat in conn.execute(query+' ORDER BY submitted', args)
+            if heartbeat == None or heartbeat < staleTime or not isOwnerAlive(owner)]
+
+def claimJobs(conn, rows):
+    '''
+    Makes this process the owner of some jobs; a job is only taken if its owner and heartbeat haven't changed since they
+    were read, so two processes never take over the same job
+    @param conn - a job database connection
+    @param rows - a list of (jobID, owner, heartbeat) as read from the database
+    @return - the job IDs that now belong to this process
+    '''
+    claimed = []
+    with conn:
+        for jobID, owner, heartbeat in rows:
+            cursor = conn.execute('UPDATE jobs SET owner=?, heartbeat=? WHERE jobID=? AND owner IS ? AND heartbeat IS ?',
+                                  (ownerToken, time.time(), jobID, owner, heartbeat))
+            if cursor.rowcount == 1:
+                claimed.append(jobID)
+    return claimed
+
+def heartbeatLoop():
+    '''
+    The body of the heartbeat thread, it keeps this process's jobs marked as alive and takes over jobs from dead processes
+    '''
+    while True:
+        time.sleep(msSharedUtil.jobHeartbeatSeconds)
+        try:
+            conn = getConnection()
+            with conn:
+                conn.execute('UPDATE jobs SET heartbeat=? WHERE owner=? AND state IN (?, ?)',
+                             (time.time(), ownerToken, STATE_QUEUED, STATE_RUNNING))
+            for jobID in claimJobs(conn, findOrphans(conn)):
+                jobIDs.put(jobID)
+            conn.close()
+        except Exception:
+            #a busy or missing database is retried on the next heartbeat
+            traceback.print_exc()
+
+def submitJob(jsonDatasets, jsonQueries, forward, revComp):
+    '''
+    Adds a batch query to the queue; if the same query was already submitted, that job is re-used and, if it failed or its
+    owner died, resumed by this process
+    @param jsonDatasets - JSON formatted, the datasets to query against
+    @param jsonQueries - JSON formatted, queries to perform
+    @param forward - "true" if the forward counts should be calculated
+    @param revComp - "true" if the reverse-complement counts should be calculated
+    @return - the job ID
+    '''
+    start()
+    datasets = [str(dataset) for dataset in json.loads(jsonDatasets)]
+    kmers = [str(kmer) for kmer in json.loads(jsonQueries)]
+    forward = (forward == "true")
+    revComp = (revComp == "true")
+
+    jobContents = json.dumps([datasets, kmers, forward, revComp])
+    jobID = hashlib.sha1(jobContents).hexdigest()
+
+    conn = getConnection()
+    with conn:
+        row = conn.execute('SELECT state FROM jobs WHERE jobID=?', (jobID, )).fetchone()
+        if row == None:
+            conn.execute('INSERT INTO jobs (jobID, state, datasets, kmers, forward, revComp, chunkSize, submitted, error, numKmers, '+
+                         'owner, heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (jobID, STATE_QUEUED, json.dumps(datasets), json.dumps(kmers), forward, revComp,
+                          msSharedUtil.jobChunkSize, time.time(), None, len(kmers), ownerToken, time.time()))
+            requeue = True
+        elif row[0] == STATE_FAILED:
+            #resume from whatever chunks were already saved
+            conn.execute('UPDATE jobs SET state=?, error=NULL, owner=?, heartbeat=? WHERE jobID=?',
+                         (STATE_QUEUED, ownerToken, time.time(), jobID))
+            requeue = True
+        else:
+            requeue = False
+
+    #a waiting or running job whose owner died is taken over here instead of waiting for the next heartbeat
+    if not requeue:
+        requeue = (len(claimJobs(conn, findOrphans(conn, jobID))) > 0)
+    conn.close()
+
+    if requeue:
+        jobIDs.put(jobID)
+    return jobID
+
+def jobLoop():
+    '''
+    The body of each job thread, runs jobs from the queue forever
+    '''
+    while True:
+        jobID = jobIDs.get()
+        try:
+            runJob(jobID)
+        except Exception:
+            #a job that another process took over is left to its new owner
+            conn = getConnection()
+            with conn:
+                conn.execute('UPDATE jobs SET state=?, error=? WHERE jobID=? AND owner=?',
+                             (STATE_FAILED, traceback.format_exc(), jobID, ownerToken))
+            conn.close()
+
+def runJob(jobID):
+    '''
+    Counts every chunk of a job that isn't already in the database
+    @param jobID - the job to run
+    '''
+    conn = getConnection()
+    row = conn.execute('SELECT state, datasets, kmers, forward, revComp, chunkSize, owner FROM jobs WHERE jobID=?',
+                       (jobID, )).fetchone()
+    if row == None or row[0] not in (STATE_QUEUED, STATE_RUNNING) or row[6] != ownerToken:
+        conn.close()
+        return
+    datasets = json.loads(row[1])
+    kmers = json.loads(row[2])
+    forward = bool(row[3])
+    revComp = bool(row[4])
+    chunkSize = row[5]
+
+    with conn:
+        conn.execute('UPDATE jobs SET state=? WHERE jobID=? AND owner=?', (STATE_RUNNING, jobID, ownerToken))
+
+    #the chunk size is saved with the job so a resumed job lines up with the chunks it already has
+    for start in xrange(0, len(kmers), chunkSize):
+        #another process only takes the job if this one looked dead (e.g. stuck), in which case this copy stops
+        if conn.execute('SELECT owner FROM jobs WHERE jobID=?', (jobID, )).fetchone()[0] != ownerToken:
+            conn.close()
+            return
+        finished = set([dataset for (dataset, ) in
+                        conn.execute('SELECT dataset FROM chunks WHERE jobID=? AND start=?', (jobID, start))])
+        missing = [dataset for dataset in datasets if dataset not in finished]
+
+        #the datasets for this chunk are counted in parallel and saved as each one finishes
+        for dataset, forwardResults, rcResults in workerPool.countDatasets(missing, kmers[start:start+chunkSize], forward, revComp):
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)',
+                             (jobID, dataset, start, json.dumps(forwardResults.tolist()), json.dumps(rcResults.tolist())))
+
+    with conn:
+        conn.execute('UPDATE jobs SET state=? WHERE jobID=? AND owner=?', (STATE_DONE, jobID, ownerToken))
+    conn.close()
+
+def getStatus(jobID):
+    '''
+    @param jobID - the job to check
+    @return - None if the job doesn't exist; otherwise a dictionary with the job state, any error message, and the progress
+        of each dataset as the number of k-mers counted so far
+    '''
+    conn = getConnection()
+    #the k-mer list isn't read here, its length is saved with the job
+    row = conn.execute('SELECT state, datasets, numKmers, chunkSize, error FROM jobs WHERE jobID=?', (jobID, )).fetchone()
+    if row == None:
+        conn.close()
+        return None
+    state, datasets, numKmers, chunkSize, error = row
+    datasets = json.loads(datasets)
+
+    progress = dict([(dataset, 0) for dataset in datasets])
+    for dataset, start in conn.execute('SELECT dataset, start FROM chunks WHERE jobID=?', (jobID, )):
+        progress[dataset] += min(chunkSize, numKmers-start)
+    conn.close()
+
+    return {'jobID':jobID,
+            'state':state,
+            'error':error,
+            'totalKmers':numKmers,
+            'datasets':progress,
+            'kmersDone':sum(progress.values()),
+            'kmersTotal':numKmers*len(datasets)}
+
+def getResult(jobID):
+    '''
+    @param jobID - the job to get results for
+    @return - None if the job isn't done; otherwise a JSON string in the same format that "batchQuery" returns
+    '''
+    conn = getConnection()
+    row = conn.execute('SELECT state, datasets FROM jobs WHERE jobID=?', (jobID, )).fetchone()
+    if row == None or row[0] != STATE_DONE:
+        conn.close()
+        return None
+
+    messageContents = dict([(dataset, [[], []]) for dataset in json.loads(row[1])])
+    for dataset, forwardCounts, rcCounts in conn.execute('SELECT dataset, forwardCounts, rcCounts FROM chunks '+
+                                                         'WHERE jobID=? ORDER BY start', (jobID, )):
+        messageContents[dataset][0] += json.loads(forwardCounts)
+        messageContents[dataset][1] += json.loads(rcCounts)
+    conn.close()
+
+    return json.dumps(messageContents)
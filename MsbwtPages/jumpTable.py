@@ -0,0 +1,155 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the per-dataset jump table sidecar.  Backward search consumes a query from its last symbol, so the first q
+steps of every search only depend on the query's last q bases.  The jump table holds the BWT range of every string of q bases
+(4^q entries, computed once by "buildJumpTable.py") and is saved next to "comp_msbwt.npy" as a NumPy file that is memory mapped
+like the BWT.  A search then starts from the table entry for the last q bases and only searches the rest of the query.  The
+ranges are exactly the ones backward search finds, so results don't change.  The BWT registry opens the table at the same time
+as its BWT and keeps the two together (see bwtRegistry.getSearchIndex(...)); a table built for a different "comp_msbwt.npy" is
+ignored.
+'''
+
+import json
+import os
+import string
+
+import numpy as np
+
+import datasetStats
+
+#the names of the table and its description inside each BWT directory
+TABLE_FILENAME = 'msbwtJumpTable.npy'
+INFO_FILENAME = 'msbwtJumpTable.json'
+
+#bumped whenever the layout of the table changes
+TABLE_VERSION = 1
+
+#the bases in code order, an entry's index is its string of bases read as a base-4 number (A=0, C=1, G=2, T=3)
+BASES = 'ACGT'
+CODE_DIGITS = string.maketrans(BASES, '0123')
+
+def getCode(qmer):
+    '''
+    @param qmer - a string of bases
+    @return - the index of "qmer" in a jump table, or None if it has a symbol other than A, C, G, or T
+    '''
+    digits = qmer.translate(CODE_DIGITS)
+    if len(digits) == 0 or digits.translate(None, '0123') != '':
+        return None
+    return int(digits, 4)
+
+def computeTable(bwt, q):
+    '''
+    Computes the BWT range of every string of q bases, one symbol at a time from the end like backward search
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param q - the length of the strings in the table
+    @return - a numpy matrix with a row (lo, hi) for each string, in the order of getCode(...); the values are 32 bits if the
+        BWT is small enough
+    '''
+    dtype = '<u4' if bwt.getTotalSize() < 2**32 else '<u8'
+    los = np.zeros(dtype=dtype, shape=(1, ))
+    his = np.array([bwt.getTotalSize()], dtype=dtype)
+    for d in xrange(0, q):
+        #putting base c in front of a string of length d adds c*4^d to its code
+        newLos = np.empty(dtype=dtype, shape=(4*len(los), ))
+        newHis = np.empty(dtype=dtype, shape=(4*len(los), ))
+        for c, base in enumerate(BASES):
+            offset = c*len(los)
+            for x in xrange(0, len(los)):
+                newLos[offset+x], newHis[offset+x] = bwt.findIndicesOfStr(base, (int(los[x]), int(his[x])))
+        los = newLos
+        his = newHis
+    return np.column_stack((los, his))
+
+def saveTable(directory, table, q):
+    '''
+    Writes the jump table sidecar for a BWT directory
+    @param directory - the BWT directory
+    @param table - the matrix from computeTable(...)
+    @param q - the length of the strings in the table
+    '''
+    fileSize, modTime = datasetStats.getBWTStamp(directory)
+    info = {'version':TABLE_VERSION, 'q':q, 'bwtSize':fileSize, 'bwtModified':modTime}
+
+    #the description is removed first and written last, so a half written table is never used
+    if os.path.exists(directory+'/'+INFO_FILENAME):
+        os.remove(directory+'/'+INFO_FILENAME)
+    tempFN = directory+'/'+TABLE_FILENAME+'.tmp'
+    with open(tempFN, 'wb') as fp:
+        np.save(fp, table)
+    os.rename(tempFN, directory+'/'+TABLE_FILENAME)
+    with open(directory+'/'+INFO_FILENAME+'.tmp', 'w') as fp:
+        json.dump(info, fp, indent=4, sort_keys=True)
+    os.rename(directory+'/'+INFO_FILENAME+'.tmp', directory+'/'+INFO_FILENAME)
+
+def loadTable(directory, bwtStamp=None):
+    '''
+    Opens the jump table sidecar for a BWT directory
+    @param directory - the BWT directory
+    @param bwtStamp - the datasetStats.getBWTStamp(...) of the BWT the table has to match; if None, the current one is read
+    @return - a dictionary with the string length ('q') and the memory mapped matrix of ranges ('ranges'), or None if there is
+        no table or it doesn't match the current BWT
+    '''
+    infoFN = directory+'/'+INFO_FILENAME
+    if not os.path.exists(infoFN):
+        return None
+    try:
+        with open(infoFN, 'r') as fp:
+            info = json.load(fp)
+        if bwtStamp == None:
+            bwtStamp = datasetStats.getBWTStamp(directory)
+        fileSize, modTime = bwtStamp
+        if info.get('version', None) != TABLE_VERSION or info.get('bwtSize', None) != fileSize or info.get('bwtModified', None) != modTime:
+            return None
+        ranges = np.load(directory+'/'+TABLE_FILENAME, mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+
+    if ranges.shape != (4**info['q'], 2):
+        return None
+    return {'q':info['q'], 'ranges':ranges}
+
+def getRange(table, seq):
+    '''
+    @param table - a jump table from loadTable(...), or None
+    @param seq - the query
+    @return - the BWT range (lo, hi) of the last q bases of "seq", or None if the table can't be used for it
+    '''
+    if table == None or len(seq) < table['q']:
+        return None
+    code = getCode(seq[len(seq)-table['q']:])
+    if code == None:
+        return None
+    lo, hi = table['ranges'][code]
+    return (int(lo), int(hi))
+
+def findIndicesOfStr(bwt, table, seq):
+    '''
+    The same as bwt.findIndicesOfStr(seq), but the search starts from the jump table when it can
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param table - the BWT's jump table from loadTable(...), or None to always do the full search
+    @param seq - the sequence to search for
+    @return - a tuple (lo, hi) of the BWT range of "seq"
+    '''
+    startRange = getRange(table, seq)
+    if startRange == None:
+        return bwt.findIndicesOfStr(seq)
+    if len(seq) == table['q']:
+        return startRange
+    return bwt.findIndicesOfStr(seq[0:len(seq)-table['q']], startRange)
+
+def countOccurrencesOfSeq(bwt, table, seq):
+    '''
+    The same as bwt.countOccurrencesOfSeq(seq), but the search starts from the jump table when it can
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param table - the BWT's jump table from loadTable(...), or None to always do the full search
+    @param seq - the sequence to count
+    @return - the number of times "seq" occurs
+    '''
+    startRange = getRange(table, seq)
+    if startRange == None:
+        return bwt.countOccurrencesOfSeq(seq)
+    if len(seq) == table['q']:
+        return startRange[1]-startRange[0]
+    return bwt.countOccurrencesOfSeq(seq[0:len(seq)-table['q']], startRange)
@@ -0,0 +1,125 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the batch k-mer counting used by the mass and batch query tools.  Instead of running a full backward search
+for every k-mer, the k-mers are sorted by their reversed sequence so that k-mers sharing a suffix are next to each other.  The
+search range for each shared suffix is then computed once (like walking down a trie) and re-used by every k-mer below it.  With
+a jump table (see "jumpTable"), a k-mer that shares fewer than q symbols with the previous one starts from the table's range for
+its last q bases instead.
+'''
+
+import numpy as np
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+import jumpTable
+
+def countKmers(bwt, kmers, table=None):
+    '''
+    Counts the occurrences of every k-mer in a list
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param kmers - a list of strings to count, they do not need to be the same length
+    @param table - the BWT's jump table from jumpTable.loadTable(...), or None
+    @return - a numpy uint64 array of counts in the same order as the input
+    '''
+    #backward search consumes a k-mer from its last symbol, so sorting the reversed k-mers groups shared suffixes together
+    revKmers = [str(kmer)[::-1] for kmer in kmers]
+    order = sorted(xrange(0, len(kmers)), key=revKmers.__getitem__)
+    return countInOrder(bwt, revKmers, order, table)
+
+def countSortedKmers(bwt, kmers, table=None):
+    '''
+    Counts a list of k-mers that is already in search order (see getSearchOrder(...)), skipping the sort in countKmers(...)
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param kmers - a list of strings to count, sorted by their reversed sequence
+    @param table - the BWT's jump table from jumpTable.loadTable(...), or None
+    @return - a numpy uint64 array of counts in the same order as the input
+    '''
+    return countInOrder(bwt, [str(kmer)[::-1] for kmer in kmers], xrange(0, len(kmers)), table)
+
+def getSearchOrder(kmers):
+    '''
+    @param kmers - a list of strings
+    @return - the indices of "kmers" in the order countKmers(...) searches them
+    '''
+    return sorted(xrange(0, len(kmers)), key=lambda i: kmers[i][::-1])
+
+def countInOrder(bwt, revKmers, order, table=None):
+    '''
+    The search shared by countKmers(...) and countSortedKmers(...)
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param revKmers - the reversed k-mers
+    @param order - the indices of "revKmers" sorted by their reversed k-mer
+    @param table - the BWT's jump table from jumpTable.loadTable(...), or None
+    @return - a numpy uint64 array of counts in the same order as "revKmers"
+    '''
+    numKmers = len(revKmers)
+    ret = np.zeros(dtype='<u8', shape=(numKmers, ))
+    if numKmers == 0:
+        return ret
+
+    #rangeStack[d] is the BWT range after searching the first d symbols of the previous reversed k-mer; it is None for the
+    #depths skipped by the jump table
+    rangeStack = [(0, bwt.getTotalSize())]
+    prevKmer = ''
+    prevCount = bwt.getTotalSize()
+    q = table['q'] if table != None else 0
+
+    for i in order:
+        revKmer = revKmers[i]
+        if revKmer == prevKmer:
+            #duplicate query, no work to do
+            ret[i] = prevCount
+            continue
+
+        #figure out how much of the previous search we can keep; the stack is short if the previous search ended early
+        shared = 0
+        maxShared = min(len(revKmer), len(prevKmer), len(rangeStack)-1)
+        while shared < maxShared and revKmer[shared] == prevKmer[shared]:
+            shared += 1
+        del rangeStack[shared+1:]
+
+        #if less than the table's worth of symbols is shared, the table gives the range after the first q symbols directly
+        if shared < q:
+            startRange = jumpTable.getRange(table, revKmer[q-1::-1])
+            if startRange != None:
+                del rangeStack[1:]
+                rangeStack += [None]*(q-1)
+                rangeStack.append(startRange)
+        while rangeStack[-1] == None:
+            rangeStack.pop()
+
+        #extend one symbol at a time from the shared suffix, stopping early once nothing matches
+        lo, hi = rangeStack[-1]
+        d = len(rangeStack)-1
+        while d < len(revKmer) and lo < hi:
+            lo, hi = bwt.findIndicesOfStr(revKmer[d], (lo, hi))
+            rangeStack.append((lo, hi))
+            d += 1
+
+        prevKmer = revKmer
+        prevCount = hi-lo if d == len(revKmer) else 0
+        ret[i] = prevCount
+
+    return ret
+
+def countKmerStrands(bwt, kmers, forward, revComp, table=None):
+    '''
+    Counts a list of k-mers and/or their reverse-complements in a single batch so both strands share the same search work
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param kmers - a list of strings to count
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @param table - the BWT's jump table from jumpTable.loadTable(...), or None
+    @return - a tuple (forward counts, reverse-complement counts) of numpy uint64 arrays; a disabled strand is an empty array
+    '''
+    kmers = [str(kmer) for kmer in kmers]
+    queries = []
+    if forward:
+        queries += kmers
+    if revComp:
+        queries += [MSBWT.reverseComplement(kmer) for kmer in kmers]
+
+    counts = countKmers(bwt, queries, table)
+    numForward = len(kmers) if forward else 0
+    return (counts[0:numForward], counts[numForward:])
@@ -7,10 +7,11 @@ on the same dataset and report all of the results back to the client.  This is d
 each individual batch.
 '''
 import json
-import numpy as np
 
+import binaryProtocol
+import countCache
 import msSharedUtil
-from MUSCython import MultiStringBWTCython as MSBWT
+import queryPanels
 
 dirLabels = msSharedUtil.dirLabels
 MSBWTdirs = msSharedUtil.MSBWTdirs
@@ -29,21 +30,68 @@ def getMassQueryResults(dataset, jsonQueries, forward, revComp):
     #de-JSON these
     kmerQueries = json.loads(jsonQueries)
     
-    pieces = dataset.split('-')
-    directory = MSBWTdirs[int(pieces[0])]+'/'+'-'.join(pieces[1:])
+    #the count cache only opens the MSBWT (from the shared registry) for queries it hasn't seen before
+    forwardResults, rcResults = countCache.countKmerStrands(dataset, kmerQueries, forward == "true", revComp == "true")
     
-    #load the MSBWT
-    msbwt = MSBWT.loadBWT(directory)
-    if forward == "true":
-        forwardResults = [msbwt.countOccurrencesOfSeq(str(kmer)) for kmer in kmerQueries]
-    else:
-        forwardResults = []
-    if revComp == "true":
-        rcResults = [msbwt.countOccurrencesOfSeq(MSBWT.reverseComplement(str(kmer))) for kmer in kmerQueries]
-    else:
-        rcResults = []
-    
-    messageContents = [forwardResults, rcResults]
+    messageContents = [forwardResults.tolist(), rcResults.tolist()]
     message = json.dumps(messageContents)
     
     return message
+
+def streamMassQueryResults(dataset, jsonQueries, forward, revComp):
+    '''
+    This function is the streaming version of getMassQueryResults(...); the queries are counted in chunks and each chunk is
+    sent back as soon as it is done
+    @param dataset - the dataset to query against
+    @param jsonQueries - JSON formatted queries to perform
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - a generator of newline-terminated JSON records of the form {"start": <index of first query>, "counts": [forward counts, reverse-complement counts]}
+    '''
+    kmerQueries = json.loads(jsonQueries)
+    chunkSize = msSharedUtil.streamChunkSize
+    
+    for start in xrange(0, len(kmerQueries), chunkSize):
+        forwardResults, rcResults = countCache.countKmerStrands(dataset, kmerQueries[start:start+chunkSize], forward == "true", revComp == "true")
+        yield json.dumps({"start":start, "counts":[forwardResults.tolist(), rcResults.tolist()]})+'\n'
+
+def getBinaryMassQueryResults(dataset, kmerQueries, forward, revComp):
+    '''
+    This function is the binary version of getMassQueryResults(...), see "binaryProtocol" for the format
+    @param dataset - the dataset to query against
+    @param kmerQueries - the list of k-mers from the binary request
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - the binary response with a single dataset record
+    '''
+    forwardResults, rcResults = countCache.countKmerStrands(dataset, kmerQueries, forward, revComp)
+    return (binaryProtocol.encodeResponseHeader(1, len(kmerQueries), forward, revComp)+
+            binaryProtocol.encodeCounts(dataset, forwardResults, rcResults))
+
+def getPanelMassQueryResults(dataset, panel, forward, revComp):
+    '''
+    This function is the same as getMassQueryResults(...) for a registered panel instead of a list of queries
+    @param dataset - the dataset to query against
+    @param panel - the compiled panel from queryPanels.getPanel(...)
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - (forward counts, reverse-complement counts)
+    '''
+    forwardResults, rcResults = queryPanels.countPanel(dataset, panel, forward == "true", revComp == "true")
+    return json.dumps([forwardResults.tolist(), rcResults.tolist()])
+
+def streamPanelMassQueryResults(dataset, panel, start, forward, revComp):
+    '''
+    This function is the same as streamMassQueryResults(...) for a registered panel instead of a list of queries
+    @param dataset - the dataset to query against
+    @param panel - the compiled panel from queryPanels.getPanel(...)
+    @param start - the first k-mer of the panel to count, so a client can pick up where an interrupted stream stopped
+    @param forward - if True, then it will return the forward counts in an array, else it will return [] for these counts
+    @param revComp - if True, then it will return the reverse-complement counts in an array, else it will return [] for these counts
+    @return - a generator of newline-terminated JSON records of the form {"start": <index of first query after "start">, "counts": [forward counts, reverse-complement counts]}
+    '''
+    chunkSize = msSharedUtil.streamChunkSize
+    
+    for chunkStart in xrange(start, panel['numKmers'], chunkSize):
+        forwardResults, rcResults = queryPanels.countPanel(dataset, panel, forward == "true", revComp == "true", chunkStart, chunkStart+chunkSize)
+        yield json.dumps({"start":chunkStart-start, "counts":[forwardResults.tolist(), rcResults.tolist()]})+'\n'
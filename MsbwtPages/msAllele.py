@@ -7,19 +7,33 @@ difference between this and "msCompare" is that it calculates a follow up step w
 These "alleles" are displayed as separate units in the output.
 '''
 
+import heapq
+import itertools
 import locale
 import markup
 import numpy as np
-import os
 
 from MUSCython import MultiStringBWTCython as MSBWT
 
+import bwtRegistry
+import consensusBuilder
+import datasetCatalog
+import datasetStats
+import jumpTable
 import msSharedUtil
+import pileupRenderer
+import readRecovery
+import requestTiming
+import workerPool
 
 dirLabels = msSharedUtil.dirLabels
 MSBWTdirs = msSharedUtil.MSBWTdirs
 uniformLengths = msSharedUtil.uniformLengths
 
+#careLookup[c] is True if the ASCII symbol c is one of the bases used when comparing reads
+careLookup = np.zeros(dtype='bool', shape=(256, ))
+careLookup[np.frombuffer('acgtACGT', dtype='<u1')] = True
+
 def GET():
     '''
     This function returns a markup page for the contents of the "msAllele" query page
@@ -54,12 +68,26 @@ def GET():
     panel.div.close()
     return panel
 
-def POST(datasets, pattern):
+def POST(datasets, pattern, page=None, sample=False):
+    '''
+    This function returns the contents of the "msAllele" response page
+    @param datasets - a list of datasets (aka BWTs) to be queried in this response
+    @param pattern - the pattern to search for (a k-mer)
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown; this is the default when there are too many reads
+    @return - a string containing the results of the query
+    '''
+    return '\n'.join(streamPOST(datasets, pattern, page, sample))
+
+def streamPOST(datasets, pattern, page=None, sample=False):
     '''
-    This function returns a markup page for the contents of the "msAllele" response page
+    This function generates the contents of the "msAllele" response page a piece at a time, so the read pileups are streamed
+    to the client instead of being held in memory as one page
     @param datasets - a list of datasets (aka BWTs) to be queried in this response
     @param pattern - the pattern to search for (a k-mer)
-    @return - the markup page containing the results of the query
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown; this is the default when there are too many reads
+    @return - a generator of HTML strings that make up the results of the query
     '''
     panel = markup.page()
 
@@ -88,7 +116,8 @@ def POST(datasets, pattern):
         panel.input(type="button", value="New Search", onClick='self.location="./msAllele"')
         panel.div.close()
         panel.div.close()
-        return panel
+        yield str(panel)
+        return
     
     if (pattern == None):
         panel.h3("ERROR: No search pattern specified")
@@ -96,7 +125,8 @@ def POST(datasets, pattern):
         panel.input(type="button", value="New Search", onClick='self.location="./msAllele"')
         panel.div.close()
         panel.div.close()
-        return panel
+        yield str(panel)
+        return
     pattern = str(pattern).upper()
 
     for c in pattern:
@@ -106,265 +136,247 @@ def POST(datasets, pattern):
             panel.input(type="button", value="New Search", onClick='self.location="./msAllele"')
             panel.div.close()
             panel.div.close()
-            return panel
+            yield str(panel)
+            return
 
+    #the datasets are evaluated at the same time by the workers, but each section is sent in the original order
+    yield str(panel)
+    panel = markup.page()
+    for dataset, section in workerPool.mapDatasets(searchDataset, datasets, (pattern, page, sample), msSharedUtil.pageDatasetSeconds):
+        if section == None:
+            msSharedUtil.buildDatasetTimeout(panel, dataset, msSharedUtil.pageDatasetSeconds)
+            yield str(panel)
+            panel = markup.page()
+        else:
+            #the worker only sends the reads back, the pileups are rendered here as they are sent
+            headerHtml, pileups = section
+            yield headerHtml
+            if pileups != None:
+                for readlist, consensus, margin, breaks in pileups:
+                    for chunk in pileupRenderer.streamPileup(readlist, consensus, margin, pattern):
+                        yield chunk
+                    yield '\n'.join(['<br />']*breaks)
+                yield '</div>'
+    panel.form(action="", name="SearchSelected", method="POST", enctype="multipart/form-data", onsubmit='return getSelectedText()')
+    panel.div(align="center", style="padding: 30px 30px;")
+    panel.input(type="submit", name="submit", value="Search Selected")
+    panel.input(type="button", value="New Search", onClick='self.location="./msAllele"')
     for dataset in datasets:
-        dashIndex = dataset.find('-')
-        groupIndex = int(dataset[0:dashIndex])
-        datasetLabel = dataset[dashIndex+1:]
-        
-        groupLabel = dirLabels[groupIndex]
-        readLen = uniformLengths[groupIndex]
-        MSBWTdir = MSBWTdirs[groupIndex]
-        bwtDirName = "%s/%s" % (MSBWTdir, datasetLabel)
-        
-        metadata = msSharedUtil.loadMetadata(bwtDirName)
+        panel.input(type="hidden", name="dataset", value=dataset)
+    panel.input(type="hidden", name="pattern", value=pattern)
+    panel.div.close()
+    panel.form.close()
+    panel.div.close()
+    yield str(panel)
+
+def searchDataset(dataset, pattern, page, sample):
+    '''
+    This function does the work for the section of the "msAllele" response page for a single dataset, it runs in the worker
+    that owns the dataset when workers are enabled
+    @param dataset - the dataset ID to query
+    @param pattern - the pattern to search for (already validated and in upper case)
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown
+    @return - a tuple (HTML for the top of the section, pileups) where the pileups are None if the pattern wasn't found,
+        otherwise they are a list of tuples (sorted reads, consensus, margin, line breaks after it) for
+        pileupRenderer.streamPileup(...) and the section ends with a "div" that has to be closed after them
+    '''
+    panel = markup.page()
+    entry = datasetCatalog.getDataset(dataset)
+    groupIndex = entry['group']
+    datasetLabel = entry['label']
+    
+    groupLabel = dirLabels[groupIndex]
+    readLen = uniformLengths[groupIndex]
+    metadata = entry['metadata']
+    
+    panel.h3(groupLabel+': '+metadata.get('Name', datasetLabel))
+    
+    #the header comes from the statistics sidecar when there is one, so the BWT isn't needed for it
+    stats = datasetStats.getStats(dataset)
+    if readLen == 0:
+        readLen = stats['maxReadLength']+1
+    filesize = locale.format("%d", stats['fileSize'], grouping=True)
+    stringCount = locale.format("%d", stats['stringCount'], grouping=True)
+    baseCount = locale.format("%d", stats['baseCount'], grouping=True)
+    bitsPerBase = stats['bitsPerBase']
+    panel.strong("%s strings with %s bases and index size of %s bytes (%3.2f bits per base)<br />" % (stringCount, baseCount, filesize, bitsPerBase))
+    panel.strong("Target: %s<br />" % (pattern))
+    
+    bwt, table = bwtRegistry.getSearchIndex(dataset)
+    with requestTiming.span('findIndicesOfStr', 2):
+        lo1, hi1 = jumpTable.findIndicesOfStr(bwt, table, pattern)
+        lo2, hi2 = jumpTable.findIndicesOfStr(bwt, table, revComp(pattern))
+    count = hi1 - lo1 + hi2 - lo2
+    workerPool.checkSectionTime()
+    if count > 0:
+        #large results only recover a page or a sample of the reads, so the work per request is bounded
+        forwardIndices, reverseIndices, description = readRecovery.selectReads((lo1, hi1), (lo2, hi2), page, sample)
         
-        panel.h3(groupLabel+': '+metadata.get('Name', datasetLabel))
-        filestat = os.stat(bwtDirName+"/comp_msbwt.npy")
-        filesize = locale.format("%d", filestat.st_size, grouping=True)
-        bwt = MSBWT.loadBWT(bwtDirName)
-        if readLen == 0:
-            readLen = len(bwt.recoverString(0))
-        stringCount = locale.format("%d", bwt.getSymbolCount(0), grouping=True)
-        baseCount = locale.format("%d", bwt.getTotalSize(), grouping=True)
-        bitsPerBase = (8.0*filestat.st_size)/bwt.getTotalSize()
-        panel.strong("%s strings with %s bases and index size of %s bytes (%3.2f bits per base)<br />" % (stringCount, baseCount, filesize, bitsPerBase))
-        panel.strong("Target: %s<br />" % (pattern))
+        panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
+        if description != '':
+            panel.strong(description+'<br />')
+            msSharedUtil.buildReadViewForm(panel, "./msAllele", dataset, pattern, count, page)
+            panel.br()
+        panel.div(style="font-size:10px; font-family: monospace;")
+        l = len(pattern)
+        bufferLen = readLen
+        margin = bufferLen - l
         
-        lo1, hi1 = bwt.findIndicesOfStr(pattern)
-        lo2, hi2 = bwt.findIndicesOfStr(revComp(pattern))
-        count = hi1 - lo1 + hi2 - lo2
-        if (count > 10000):
-            panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
-            panel.span("Too much data!", style="font-size: 180%;")
-        elif count > 0:
-            panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
-            panel.div(style="font-size:10px; font-family: monospace;")
-            l = len(pattern)
-            bufferLen = readLen
-            margin = bufferLen - l
-            
-            haps = extractHaplotypes(bwt, pattern, readLen)
-            if len(haps) > 0:
-                consensusMain = haps[0][0]
-
-            panel.table(border='1')
-            panel.tr()
-            panel.th('Consensus')
-            panel.th('Exact matches')
-            panel.tr.close()
-            extrasList = []
-            
-            for consensus, readlist in haps:
-                if len(readlist) >= 5:
-                    panel.tr()
-                    panel.td()
-                    panel.strong()
-                    output = ""
-                    for i, base in enumerate(consensus):
-                        if i == margin:
-                            output += '<span style="color: green;">'
-                        elif i == margin+l:
-                            output += '</span>'
+        haps = extractHaplotypes(bwt, pattern, readLen, forwardIndices, reverseIndices)
+        workerPool.checkSectionTime()
+        if len(haps) > 0:
+            consensusMain = haps[0][0]
 
-                        if(base != '$') and (base != '.') and (consensus[i] != '.') and (base.upper() != consensusMain[i].upper()):
-                            output += '<span style="background-color:yellow;">%s</span>' % base.upper()
-                        else:
-                            output += base.upper()
-                    panel.add(output)
-                    panel.strong.close()
-                    panel.td.close()
-                    panel.td(str(len(readlist)))
-                    panel.tr.close()
-                else:
-                    for read in readlist:
-                        extrasList.append(read)
-            
-            if len(extrasList) > 0:
-                panel.tr()
-                panel.th('Remainder Consensus')
-                panel.th('Inexact matches')
-                panel.tr.close()
-                consensus, dummyVar = conSeq(extrasList)
+        panel.table(border='1')
+        panel.tr()
+        panel.th('Consensus')
+        panel.th('Exact matches')
+        panel.tr.close()
+        extrasList = []
+        extrasCounts = consensusBuilder.ConsensusCounts()
+        
+        for consensus, readlist in haps:
+            if len(readlist) >= 5:
                 panel.tr()
                 panel.td()
                 panel.strong()
-                output = ""
-                for i, base in enumerate(consensus):
-                    if i == margin:
-                        output += '<span style="color: green;">'
-                    elif i == margin+l:
-                        output += '</span>'
-                    
-                    if(base != '$') and (base != '.') and (consensus[i] != '.') and (base.upper() != consensusMain[i].upper()):
-                        output += '<span style="background-color:yellow;">%s</span>' % base.upper()
-                    else:
-                        output += base.upper()
-                panel.add(output)
+                panel.add(''.join(pileupRenderer.renderRows([consensus], consensusMain, margin, l, ['green'], True, '', True)))
                 panel.strong.close()
                 panel.td.close()
-                panel.td(str(len(extrasList)))
+                panel.td(str(len(readlist)))
                 panel.tr.close()
-            panel.table.close()
-
-            for consensus, readlist in haps:
-                if len(readlist) >= 5:
-                    read = "."*margin + "*"*l + '.'*margin
-                    panel.add(read)
-                    panel.br()
-                    for read in sorted(readlist):
-                        color = "red" if (read.find('$') > read.find(pattern)) else "blue"
-                        output = ""
-                        for i, base in enumerate(read):
-                            if (i == margin):
-                                output += '<span style="color: %s;">' % color
-                            elif (i == margin+l):
-                                output += '</span>'
-                            if (base != '$') and (base != '.') and (consensus[i] != '.') and (base.upper() != consensus[i].upper()):
-                                output += '<span style="background-color:yellow;">%s</span>' % base
-                            else:
-                                output += base
-                        output += '<br />'
-                        panel.add(output)
-                    panel.strong('%s<span style="color: green;">%s</span>%s<br />' % (consensus[:margin], consensus[margin:margin+l], consensus[margin+l:]))
-                    panel.br()
-                    panel.br()
+            else:
+                #the remainder consensus is counted as the small groups are collected
+                extrasList += readlist
+                with requestTiming.span('consensus', len(readlist)):
+                    extrasCounts.addReads(readlist)
         
-            if len(extrasList) > 0:
-                consensus, dummyVar = conSeq(extrasList)
-                extrasList.sort(cmp=readCmp)
-                read = "."*margin + "*"*l + '.'*margin
-                panel.add(read)
-                panel.br()
-                for read in extrasList:
-                    color = "red" if (read.find('$') > read.find(pattern)) else "blue"
-                    output = ""
-                    for i, base in enumerate(read):
-                        if (i == margin):
-                            output += '<span style="color: %s;">' % color
-                        elif (i == margin+l):
-                            output += '</span>'
-                        if (base != '$') and (base != '.') and (consensus[i] != '.') and (base.upper() != consensus[i].upper()):
-                            output += '<span style="background-color:yellow;">%s</span>' % base
-                        else:
-                            output += base
-                    output += '<br />'
-                    panel.add(output)
-                panel.strong('%s<span style="color: green;">%s</span>%s<br />' % (consensus[:margin], consensus[margin:margin+l], consensus[margin+l:]))
-                panel.br()
+        if len(extrasList) > 0:
+            panel.tr()
+            panel.th('Remainder Consensus')
+            panel.th('Inexact matches')
+            panel.tr.close()
+            with requestTiming.span('consensus'):
+                consensus, dummyVar = extrasCounts.getConsensus()
+            panel.tr()
+            panel.td()
+            panel.strong()
+            panel.add(''.join(pileupRenderer.renderRows([consensus], consensusMain, margin, l, ['green'], True, '', True)))
+            panel.strong.close()
+            panel.td.close()
+            panel.td(str(len(extrasList)))
+            panel.tr.close()
+        panel.table.close()
 
-            panel.div.close()
-        else:
-            panel.add("Pattern not found<br /><br />")
-    panel.form(action="", name="SearchSelected", method="POST", enctype="multipart/form-data", onsubmit='return getSelectedText()')
-    panel.div(align="center", style="padding: 30px 30px;")
-    panel.input(type="submit", name="submit", value="Search Selected")
-    panel.input(type="button", value="New Search", onClick='self.location="./msAllele"')
-    for dataset in datasets:
-        panel.input(type="hidden", name="dataset", value=dataset)
-    panel.input(type="hidden", name="pattern", value=pattern)
-    panel.div.close()
-    panel.form.close()
-    panel.div.close()
-    return panel
+        pileups = []
+        for consensus, readlist in haps:
+            if len(readlist) >= 5:
+                pileups.append((sorted(readlist), consensus, margin, 2))
+    
+        if len(extrasList) > 0:
+            with requestTiming.span('consensus'):
+                consensus, dummyVar = extrasCounts.getConsensus()
+            extrasList.sort(cmp=readCmp)
+            pileups.append((extrasList, consensus, margin, 1))
+    else:
+        panel.add("Pattern not found<br /><br />")
+        pileups = None
+    
+    return (str(panel), pileups)
 
-def extractHaplotypes(bwt, kmer, readLen):
+def extractHaplotypes(bwt, kmer, readLen, forwardIndices=None, reverseIndices=None):
     '''
     A subroutine for calculating haplotypes present in a particular BWT based on a kmer query
     @param bwt - an instance of the BasicBWT class from the "msbwt" package
     @param kmer - the pattern to search for (string)
     @param readLen - the length of reads in the BWT
+    @param forwardIndices - the BWT indices of the reads with the pattern to use, if None every one is used
+    @param reverseIndices - the BWT indices of the reads with the reverse-complement to use, if None every one is used
     @return - a list of tuples where each tuple is of the form (consensus sequence, list of reads that match)
     '''
-    forwardIndices = bwt.findIndicesOfStr(kmer)
-    revComp = MSBWT.reverseComplement(kmer)
-    reverseIndices = bwt.findIndicesOfStr(revComp)
-    
-    bufferLen = readLen
-    patternLen = len(kmer)
-    fixedSize = 2*bufferLen-patternLen
-    totalBuffLen = 2*readLen-patternLen
+    if forwardIndices == None:
+        forwardIndices = xrange(*bwt.findIndicesOfStr(kmer))
+    if reverseIndices == None:
+        reverseIndices = xrange(*bwt.findIndicesOfStr(MSBWT.reverseComplement(kmer)))
     
-    modifiedSeqs = []
-    for i in xrange(forwardIndices[0], forwardIndices[1]):
-        readSeq = bwt.recoverString(i)
-        dollarPos = readSeq.find('$')
-        suffLen = len(readSeq)
-        
-        #calculate how many tailing '.' we need first, then construct the string from that info
-        beforePattern = suffLen-dollarPos-1
-        modSeq = ('.'*(bufferLen-patternLen-beforePattern)+
-                  readSeq[dollarPos+1:].lower()+
-                  readSeq[:patternLen]+
-                  readSeq[patternLen:dollarPos+1].lower())
-        modSeq += '.'*(fixedSize-len(modSeq))
-        
-        modifiedSeqs.append(modSeq)
-    
-    for i in xrange(reverseIndices[0], reverseIndices[1]):
-        revCompSeq = bwt.recoverString(i)
-        readSeq = MSBWT.reverseComplement(revCompSeq)
-        suffLen = len(readSeq)
-        dollarPos = readSeq.find('$')
-        
-        beforePattern = suffLen-dollarPos-patternLen
-        modSeq = ('.'*(bufferLen-patternLen-beforePattern)+
-                  readSeq[dollarPos:-patternLen].lower()+
-                  readSeq[-patternLen:]+
-                  readSeq[0:dollarPos].lower())
-        modSeq += '.'*(fixedSize-len(modSeq))
-        modifiedSeqs.append(modSeq)
+    #every read is recovered and lined up around the pattern in one matrix
+    readMatrix = readRecovery.extractAlignedReads(bwt, forwardIndices, reverseIndices, len(kmer), readLen)
+    modifiedSeqs = [row.tostring() for row in readMatrix]
     
     #jump out if we find nothing
     if len(modifiedSeqs) == 0:
         return []
     
-    #now we begin searching for haplotypes
-    groupID = 0
+    with requestTiming.span('clusterHaplotypes', len(modifiedSeqs)):
+        return clusterHaplotypes(modifiedSeqs)
+
+def clusterHaplotypes(modifiedSeqs):
+    '''
+    Groups "shifted" reads into haplotypes.  Identical reads are grouped first, then the pair of groups with the largest weight
+    (the number of shared symbols times the number of reads) that doesn't conflict at any position is merged over and over until
+    no compatible pairs remain.
+    @param modifiedSeqs - a list of reads that have been offset so they share the pattern in the middle (see extractHaplotypes(...))
+    @return - a list of tuples where each tuple is of the form (consensus sequence, list of reads that match)
+    '''
+    #group identical reads, group IDs are assigned in the order each read first appears
+    groupIDs = {}
+    groupReads = []
+    for seq in modifiedSeqs:
+        if seq not in groupIDs:
+            groupIDs[seq] = len(groupReads)
+            groupReads.append([])
+        groupReads[groupIDs[seq]].append(seq)
+    
+    #the consensus of a group is the read with everything but the bases in "careLookup" replaced by '.'
+    consensusMatrix = np.array([np.frombuffer(reads[0], dtype='<u1') for reads in groupReads])
+    consensusMatrix[~isCareSymbol(consensusMatrix)] = ord('.')
+    
+    #the dictionaries and sets below see exactly the same sequence of changes as the original pair-by-pair version of this
+    #function; that keeps their iteration order (which decides ties) and therefore the final haplotypes the same
     allGroups = {}
     pairedSets = {}
-    while len(modifiedSeqs) > 0:
-        currSeq = modifiedSeqs[0]
-        currSet = []
-        x = 0
-        while x < len(modifiedSeqs):
-            if modifiedSeqs[x] == currSeq:
-                #same seq
-                currSet.append(modifiedSeqs.pop(x))
-            else:
-                x += 1
-        
-        allGroups[groupID] = (combineShiftedSeqs(currSet[0], currSet[0]), currSet)
+    for groupID, reads in enumerate(groupReads):
+        allGroups[groupID] = (consensusMatrix[groupID], reads)
         pairedSets[groupID] = set([])
-        groupID += 1
+    groupID = len(groupReads)
     
     edges = {}
-    for x in xrange(0, len(allGroups)):
-        for y in xrange(x+1, len(allGroups)):
-            #first, check if they're compatible
-            con1 = allGroups[x][0]
-            con2 = allGroups[y][0]
-            
-            diff, shared = getDeltaOverlaps(con1, con2)
-            if diff == 0:
-                edges[(x, y)] = shared*(len(allGroups[x][1])+len(allGroups[y][1]))
-                pairedSets[x].add(y)
-                pairedSets[y].add(x)
-            else:
-                #don't add an edge because they conflict for one reason or another
-                pass
+    for x, y, shared in findCompatiblePairs(consensusMatrix):
+        edges[(x, y)] = shared*(len(groupReads[x])+len(groupReads[y]))
+        pairedSets[x].add(y)
+        pairedSets[y].add(x)
+    
+    #a max-heap of the edges; deleted edges are skipped when they reach the top instead of being removed
+    edgeHeap = [(-weight, edge) for edge, weight in edges.iteritems()]
+    heapq.heapify(edgeHeap)
     
     while len(edges) > 0:
-        #get the maximum weighted edge
-        maxEdge, maxValue = max(edges.iteritems(), key=lambda x: x[1])
+        #get the maximum weighted edge; if several are tied, use the one the original "max(edges.iteritems())" would find
+        while edgeHeap[0][1] not in edges:
+            heapq.heappop(edgeHeap)
+        maxValue = -edgeHeap[0][0]
+        tiedEdges = []
+        while len(edgeHeap) > 0 and edgeHeap[0][0] == -maxValue:
+            maxEdge = heapq.heappop(edgeHeap)[1]
+            if maxEdge in edges:
+                tiedEdges.append(maxEdge)
+        if len(tiedEdges) > 1:
+            tiedSet = set(tiedEdges)
+            maxEdge = next(itertools.ifilter(tiedSet.__contains__, edges))
+            for edge in tiedEdges:
+                if edge != maxEdge:
+                    heapq.heappush(edgeHeap, (-maxValue, edge))
+        else:
+            maxEdge = tiedEdges[0]
         
         #pull out the groupIDs
         mergeID1 = maxEdge[0]
         mergeID2 = maxEdge[1]
         
-        #write out the new group
-        newConsensus = combineShiftedSeqs(allGroups[mergeID1][0], allGroups[mergeID2][0])
+        #write out the new group, the consensus keeps the first group's symbol wherever it has one
+        con1 = allGroups[mergeID1][0]
+        newConsensus = np.where(con1 != ord('.'), con1, allGroups[mergeID2][0])
         newReadSet = allGroups[mergeID1][1]+allGroups[mergeID2][1]
         allGroups[groupID] = (newConsensus, newReadSet)
         
@@ -379,6 +391,7 @@ def extractHaplotypes(bwt, kmer, readLen):
             weight2 = edges[(mergeID2, v) if mergeID2 < v else (v, mergeID2)]
             combinedWeight = weight1+weight2
             edges[(v, groupID)] = combinedWeight
+            heapq.heappush(edgeHeap, (-combinedWeight, (v, groupID)))
             
             #add the new group ID to the set for the new edge
             pairedSets[v].add(groupID)
@@ -403,49 +416,49 @@ def extractHaplotypes(bwt, kmer, readLen):
         #we added a new group, so increment
         groupID += 1
     
-    allGroups = sorted(allGroups.values(), key=lambda x: len(x[1]), reverse=True)
+    allGroups = sorted([(consensus.tostring(), reads) for consensus, reads in allGroups.itervalues()], key=lambda x: len(x[1]), reverse=True)
 
     return allGroups
 
-def combineShiftedSeqs(seq1, seq2):
+def isCareSymbol(symbols):
     '''
-    This subroutine combines two sequences that have an exact overlap into one longer sequence
-    @param seq1 - the first sequence, offsetting is already done
-    @param seq2 - the second sequence, offsetting is already done
-    @return - a single string combining the two inputs
+    @param symbols - a numpy uint8 array of ASCII symbols
+    @return - a boolean array that is True wherever the symbol is one of 'acgtACGT'
     '''
-    careSymbols = 'acgtACGT'
-    l = len(seq1)
-    ret = ''
-    for x in xrange(0, l):
-        if (seq1[x] in careSymbols):
-            ret += seq1[x]
-        elif (seq2[x] in careSymbols):
-            ret += seq2[x]
-        else:
-            ret += '.'
-    return ret
+    return careLookup[symbols]
 
-def getDeltaOverlaps(seq1, seq2):
+def findCompatiblePairs(consensusMatrix, blockSize=1024):
     '''
-    compares two "shifted" sequences which have been offset such that they share a pattern in the middle GUARANTEED
-    and returns a count of the number of different symbols and the number of shared symbols
-    @param seq1 - the first sequence, offsetting is already done
-    @param seq2 - the second sequence, offsetting is already done
-    @return - a tuple of the form (number of different symbols, number of shared symbols)
+    Compares every pair of consensus sequences at once.  Each (position, symbol) that occurs is a column in a 0/1 matrix, so a
+    matrix product counts the shared symbols for all pairs and another one counts the positions where both have a symbol; two
+    consensus sequences conflict if those counts differ.
+    @param consensusMatrix - a numpy uint8 matrix with one consensus per row, where '.' is a position with no symbol
+    @param blockSize - the number of rows compared at once, this bounds the memory used
+    @return - a list of tuples (x, y, number of shared symbols) for every pair x < y without a conflict, in the order of a nested
+        loop over x then y
     '''
-    careSymbols = 'acgtACGT'
-    l = len(seq1)
-    diff = 0
-    shared = 0
-    for x in xrange(0, l):
-        if ((seq1[x] in careSymbols) and
-            (seq2[x] in careSymbols)):
-            if seq1[x] != seq2[x]:
-                diff += 1
-            else:
-                shared += 1
-    return (diff, shared)
+    numGroups, seqLen = consensusMatrix.shape
+    hasSymbol = consensusMatrix != ord('.')
+    
+    #one column for every (position, symbol) that occurs; the counts are exact in float32 since they can't exceed the length
+    rows, positions = np.nonzero(hasSymbol)
+    codes = positions*256+consensusMatrix[rows, positions]
+    uniqueCodes, columns = np.unique(codes, return_inverse=True)
+    symbolMatrix = np.zeros(dtype='<f4', shape=(numGroups, len(uniqueCodes)))
+    symbolMatrix[rows, columns] = 1
+    positionMatrix = hasSymbol.astype('<f4')
+    
+    ret = []
+    for start in xrange(0, numGroups, blockSize):
+        end = min(start+blockSize, numGroups)
+        shared = np.dot(symbolMatrix[start:end], symbolMatrix.T)
+        overlap = np.dot(positionMatrix[start:end], positionMatrix.T)
+        
+        #only keep y > x
+        compatible = (shared == overlap) & (np.arange(0, numGroups)[np.newaxis, :] > np.arange(start, end)[:, np.newaxis])
+        xs, ys = np.nonzero(compatible)
+        ret += zip((xs+start).tolist(), ys.tolist(), shared[xs, ys].astype('<i8').tolist())
+    return ret
 
 WatsonComp = { 'A':'T', 'C':'G', 'G':'C', 'T':'A', 'N':'N', '$':'$' }
 def revComp(pat):
@@ -462,26 +475,11 @@ def conSeq(seqList):
     @param seqList - the list of sequences to build a consensus from
     @return - a tuple of the form (consensus, counter)
         consensus - the series of bases that has the most votes
-        counter - the "votes" at each position
+        counter - the "votes" against the consensus at each position
     '''
     if len(seqList) == 0:
         return '', []
-    N = len(seqList[0])
-    counter = np.zeros(dtype='<u8', shape=(N, ))
-    posCount = [dict() for i in xrange(N)]
-    for seq in seqList:
-        for i, c in enumerate(seq):
-            posCount[i][c] = posCount[i].get(c, 0) + 1
-    result = ''
-    for i in xrange(N):
-        pairs = [(posCount[i][c], c) for c in posCount[i].iterkeys() if (c != '.' and c != '$')]
-        count, base = (N, '.') if (len(pairs) == 0) else max(pairs)
-        for c, b in pairs:
-            if b != base:
-                counter[i] += c
-        result += base
-    
-    return (result, counter)
+    return consensusBuilder.buildConsensus(seqList)
 
 def readCmp(read1, read2):
     '''
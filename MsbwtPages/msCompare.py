@@ -7,11 +7,18 @@ It returns the counts for each BWT and extracts the reads for a visual display (
 
 import locale
 import markup
-import os
-
-from MUSCython import MultiStringBWTCython as MSBWT
 
+import bwtRegistry
+import consensusBuilder
+import countCache
+import datasetCatalog
+import datasetStats
+import jumpTable
 import msSharedUtil
+import pileupRenderer
+import readRecovery
+import requestTiming
+import workerPool
 
 dirLabels = msSharedUtil.dirLabels
 MSBWTdirs = msSharedUtil.MSBWTdirs
@@ -49,12 +56,26 @@ def GET():
     panel.div.close()
     return panel
 
-def POST(datasets, pattern):
+def POST(datasets, pattern, page=None, sample=False):
     '''
-    This function returns a markup page for the contents of the "msCompare" response page
+    This function returns the contents of the "msCompare" response page
     @param datasets - a list of datasets (aka BWTs) to be queried in this response
     @param pattern - the pattern to search for (a k-mer)
-    @return - the markup page containing the results of the query
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown; this is the default when there are too many reads
+    @return - a string containing the results of the query
+    '''
+    return '\n'.join(streamPOST(datasets, pattern, page, sample))
+
+def streamPOST(datasets, pattern, page=None, sample=False):
+    '''
+    This function generates the contents of the "msCompare" response page a piece at a time, so the read pileups are streamed
+    to the client instead of being held in memory as one page
+    @param datasets - a list of datasets (aka BWTs) to be queried in this response
+    @param pattern - the pattern to search for (a k-mer)
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown; this is the default when there are too many reads
+    @return - a generator of HTML strings that make up the results of the query
     '''
     panel = markup.page()
 
@@ -83,7 +104,8 @@ def POST(datasets, pattern):
         panel.input(type="button", value="New Search", onClick='self.location="./msCompare"')
         panel.div.close()
         panel.div.close()
-        return panel
+        yield str(panel)
+        return
     
     if pattern == None:
         panel.h3("ERROR: No search pattern specified")
@@ -91,7 +113,8 @@ def POST(datasets, pattern):
         panel.input(type="button", value="New Search", onClick='self.location="./msCompare"')
         panel.div.close()
         panel.div.close()
-        return panel
+        yield str(panel)
+        return
     pattern = str(pattern).upper()
     
     for c in pattern:
@@ -101,7 +124,8 @@ def POST(datasets, pattern):
             panel.input(type="button", value="New Search", onClick='self.location="./msCompare"')
             panel.div.close()
             panel.div.close()
-            return panel
+            yield str(panel)
+            return
     
     #panel.input(type="textarea")
     panel.h3('Summary of Query:')
@@ -111,103 +135,24 @@ def POST(datasets, pattern):
     
     blobData = "Data_group,Dataset,Total_reads,Total_bases,fwQuery_"+pattern+",rcQuery_"+revComp(pattern)+"\\n"
     
-    for dataset in datasets:
-        dashIndex = dataset.find('-')
-        groupIndex = int(dataset[0:dashIndex])
-        datasetLabel = dataset[dashIndex+1:]
-        
-        groupLabel = dirLabels[groupIndex]
-        readLen = uniformLengths[groupIndex]
-        MSBWTdir = MSBWTdirs[groupIndex]
-        bwtDirName = "%s/%s" % (MSBWTdir, datasetLabel)
-        
-        metadata = msSharedUtil.loadMetadata(bwtDirName)
-        
-        panel.h3(groupLabel+': '+metadata.get('Name', datasetLabel))
-        filestat = os.stat(bwtDirName+"/comp_msbwt.npy")
-        filesize = locale.format("%d", filestat.st_size, grouping=True)
-        #wipe the old BWT away first to assist memory performance a little bit
-        bwt = None
-        bwt = MSBWT.loadBWT(bwtDirName)
-        if readLen == 0:
-            readLen = len(bwt.recoverString(0))
-        stringCount = locale.format("%d", bwt.getSymbolCount(0), grouping=True)
-        baseCount = locale.format("%d", bwt.getTotalSize(), grouping=True)
-        bitsPerBase = (8.0*filestat.st_size)/bwt.getTotalSize()
-        panel.strong("%s strings with %s bases and index size of %s bytes (%3.2f bits per base)<br />" % (stringCount, baseCount, filesize, bitsPerBase))
-        panel.strong("Target: %s<br />" % (pattern))
-
-        lo1, hi1 = bwt.findIndicesOfStr(pattern)
-        lo2, hi2 = bwt.findIndicesOfStr(revComp(pattern))
-        
-        blobData += ','.join([groupLabel.replace(' ', '_').replace('\'', ''),
-                               metadata.get('Name', datasetLabel),
-                              str(bwt.getSymbolCount(0)),
-                              str(bwt.getTotalSize()),
-                              str(hi1-lo1),
-                              str(hi2-lo2)])+'\\n'
-        
-        count = hi1 - lo1 + hi2 - lo2
-        if (count > 10000):
-            panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
-            panel.span("Too much data!", style="font-size: 180%;")
-        elif count > 0:
-            l = len(pattern)
-            bufferLen = readLen
-            fixedSize = 2*bufferLen-l
-            readlist = []
-            
-            for i in xrange(lo1, hi1):
-                suffix = bwt.recoverString(i)
-                suffLen = len(suffix)
-                end = suffix.find('$')
-                beforePattern = suffLen-end-1
-                read = ('.'*(bufferLen-l-beforePattern)+
-                        suffix[end+1:].lower()+
-                        suffix[:l]+
-                        suffix[l:end+1].lower())
-                read += '.'*(fixedSize-len(read))
-                readlist.append(read)
-            
-            for i in xrange(lo2, hi2):
-                suffix = revComp(bwt.recoverString(i))
-                suffLen = len(suffix)
-                end = suffix.find('$')
-                beforePattern = suffLen-end-l
-                read = ('.'*(bufferLen-l-beforePattern)+
-                        suffix[end:-l].lower()+
-                        suffix[-l:]+
-                        suffix[:end].lower())
-                read += '.'*(fixedSize-len(read))
-                readlist.append(read)
-                
-            panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
-            panel.div(style="font-size:10px; font-family: monospace;")
-            margin = bufferLen-l
-            
-            consensus = conSeq(readlist)
-            readlist.sort(cmp=readCmp)
-            read = "."*margin + "*"*l + '.'*margin
-            panel.add(read)
-            panel.br()
-            for read in readlist:
-                color = "red" if (read.find('$') > read.find(pattern)) else "blue"
-                output = ""
-                for i, base in enumerate(read):
-                    if (i == margin):
-                        output += '<span style="color: %s;">' % color
-                    elif (i == margin+l):
-                        output += '</span>'
-                    if (base != '$') and (base != '.') and (consensus[i] != '.') and (base.upper() != consensus[i]):
-                        output += '<span style="background-color:yellow;">%s</span>' % base
-                    else:
-                        output += base
-                output += '<br />'
-                panel.add(output)
-            panel.strong('%s<span style="color: green;">%s</span>%s<br />' % (consensus[:margin], consensus[margin:margin+l], consensus[margin+l:]))
-            panel.div.close()
+    #the datasets are evaluated at the same time by the workers, but each section is sent in the original order
+    yield str(panel)
+    panel = markup.page()
+    for dataset, section in workerPool.mapDatasets(searchDataset, datasets, (pattern, page, sample), msSharedUtil.pageDatasetSeconds):
+        if section == None:
+            msSharedUtil.buildDatasetTimeout(panel, dataset, msSharedUtil.pageDatasetSeconds)
+            yield str(panel)
+            panel = markup.page()
         else:
-            panel.add("Pattern not found<br /><br />")
+            #the worker only sends the reads back, the pileup is rendered here as it is sent
+            headerHtml, summaryLine, pileup = section
+            yield headerHtml
+            if pileup != None:
+                readlist, consensus, margin = pileup
+                for chunk in pileupRenderer.streamPileup(readlist, consensus, margin, pattern):
+                    yield chunk
+                yield '</div>'
+            blobData += summaryLine
     
     #this has to be at the end after we have set up everything in the blob data; remember that newlines ('\n') have to be escaped to '\\n' for the js
     panel.add('''
@@ -234,7 +179,85 @@ def POST(datasets, pattern):
     panel.div.close()
     panel.form.close()
     panel.div.close()
-    return panel
+    yield str(panel)
+
+def searchDataset(dataset, pattern, page, sample):
+    '''
+    This function does the work for the section of the "msCompare" response page for a single dataset, it runs in the worker
+    that owns the dataset when workers are enabled
+    @param dataset - the dataset ID to query
+    @param pattern - the pattern to search for (already validated and in upper case)
+    @param page - if set, only this page of the reads is shown (starting from 0)
+    @param sample - if True, only a uniform sample of the reads is shown
+    @return - a tuple (HTML for the top of the section, line for the downloadable summary, pileup) where the pileup is None if
+        the pattern wasn't found, otherwise it is a tuple (sorted reads, consensus, margin) for pileupRenderer.streamPileup(...)
+        and the section ends with a "div" that has to be closed after it
+    '''
+    panel = markup.page()
+    entry = datasetCatalog.getDataset(dataset)
+    groupIndex = entry['group']
+    datasetLabel = entry['label']
+    
+    groupLabel = dirLabels[groupIndex]
+    readLen = uniformLengths[groupIndex]
+    metadata = entry['metadata']
+    
+    panel.h3(groupLabel+': '+metadata.get('Name', datasetLabel))
+    
+    #the header comes from the statistics sidecar when there is one, so the BWT isn't needed for it
+    stats = datasetStats.getStats(dataset)
+    if readLen == 0:
+        readLen = stats['maxReadLength']+1
+    filesize = locale.format("%d", stats['fileSize'], grouping=True)
+    stringCount = locale.format("%d", stats['stringCount'], grouping=True)
+    baseCount = locale.format("%d", stats['baseCount'], grouping=True)
+    bitsPerBase = stats['bitsPerBase']
+    panel.strong("%s strings with %s bases and index size of %s bytes (%3.2f bits per base)<br />" % (stringCount, baseCount, filesize, bitsPerBase))
+    panel.strong("Target: %s<br />" % (pattern))
+
+    #the counts may already be cached, the ranges are only needed if we're going to show the reads
+    forwardCount, rcCount = [int(c) for c in countCache.countKmers(dataset, [pattern, revComp(pattern)])]
+    workerPool.checkSectionTime()
+    
+    summaryLine = ','.join([groupLabel.replace(' ', '_').replace('\'', ''),
+                            metadata.get('Name', datasetLabel),
+                            str(stats['stringCount']),
+                            str(stats['baseCount']),
+                            str(forwardCount),
+                            str(rcCount)])+'\\n'
+    
+    count = forwardCount + rcCount
+    if count > 0:
+        bwt, table = bwtRegistry.getSearchIndex(dataset)
+        with requestTiming.span('findIndicesOfStr', 2):
+            lo1, hi1 = jumpTable.findIndicesOfStr(bwt, table, pattern)
+            lo2, hi2 = jumpTable.findIndicesOfStr(bwt, table, revComp(pattern))
+        l = len(pattern)
+        bufferLen = readLen
+        
+        #large results only recover a page or a sample of the reads, so the work per request is bounded
+        forwardIndices, reverseIndices, description = readRecovery.selectReads((lo1, hi1), (lo2, hi2), page, sample)
+        readMatrix = readRecovery.extractAlignedReads(bwt, forwardIndices, reverseIndices, l, bufferLen)
+        readlist = [row.tostring() for row in readMatrix]
+        workerPool.checkSectionTime()
+        
+        panel.add("Found %d times (%d forward, %d reverse-complemented)<br /><br />" % (count, hi1-lo1, hi2-lo2))
+        if description != '':
+            panel.strong(description+'<br />')
+            msSharedUtil.buildReadViewForm(panel, "./msCompare", dataset, pattern, count, page)
+            panel.br()
+        panel.div(style="font-size:10px; font-family: monospace;")
+        margin = bufferLen-l
+        
+        with requestTiming.span('consensus', len(readlist)):
+            consensus = conSeq(readlist)
+        readlist.sort(cmp=readCmp)
+        pileup = (readlist, consensus, margin)
+    else:
+        panel.add("Pattern not found<br /><br />")
+        pileup = None
+    
+    return (str(panel), summaryLine, pileup)
 
 WatsonComp = { 'A':'T', 'C':'G', 'G':'C', 'T':'A', 'N':'N', '$':'$' }
 def revComp(pat):
@@ -251,17 +274,7 @@ def conSeq(seqList):
     @param seqList - the list of sequences to build a consensus from
     @return - the consensus, or the series of bases that has the most votes
     '''
-    N = len(seqList[0])
-    posCount = [dict() for i in xrange(N)]
-    for seq in seqList:
-        for i, c in enumerate(seq):
-            posCount[i][c] = posCount[i].get(c, 0) + 1
-    result = ''
-    for i in xrange(N):
-        pairs = [(posCount[i][c], c) for c in posCount[i].iterkeys() if (c != '.' and c != '$')]
-        count, base = (N, '.') if (len(pairs) == 0) else max(pairs)
-        result += base.upper()
-    return result
+    return consensusBuilder.buildConsensus(seqList, True)[0]
 
 def readCmp(read1, read2):
     '''
@@ -4,9 +4,10 @@ Contact: holtjma@cs.unc.edu
 This file contains the primary layout of datasets for ALL of the linked tools.  
 '''
 
-import glob
 import os
 
+import datasetCatalog
+
 ##########################################
 #SPECIFY DATA DIRECTORIES HERE!
 ##########################################
@@ -23,6 +24,113 @@ uniformLengths = [21, 101]
 #END SPECIFICATION
 ##########################################
 
+##########################################
+#SERVER TUNING
+##########################################
+#the total size (in bytes) of BWT files that may stay open in the shared registry; least recently used BWTs are closed first
+#this is a limit for each process, every server process and batch worker has its own registry
+bwtCacheBytes = 8*1024**3
+
+#how often (in seconds) the dataset catalog checks the directories above for changes; 0 disables the background checks
+catalogRefreshSeconds = 30
+
+#the number of worker processes used to count k-mers across datasets for batch queries; 0 counts in the request thread
+batchWorkers = 4
+
+#the maximum number of datasets a single batch query can have in flight across the workers at once
+batchRequestConcurrency = 4
+
+#the number of k-mers counted per record when Mass Query streams its results
+streamChunkSize = 1000
+
+#where batch query jobs and their partial results are stored
+jobDirectory = './jobs'
+
+#the number of batch query jobs that run at the same time (each one still spreads its datasets across the batch workers)
+jobThreads = 1
+
+#the number of k-mers per saved chunk of a job; an interrupted job only recounts the chunks that were not saved
+jobChunkSize = 10000
+
+#how often each server process marks its waiting and running jobs as alive and looks for jobs left by dead processes
+jobHeartbeatSeconds = 5
+
+#a job whose owner hasn't marked it as alive for this long is taken over by another process (a job whose owner has exited
+#is taken over at the next heartbeat)
+jobOrphanSeconds = 60
+
+#where the persistent k-mer count cache is stored, and the maximum number of k-mer counts and followed paths it keeps (the least
+#recently used are removed first); 0 disables caching counts or paths
+#the count table takes 32 bytes per entry on disk (and in the page cache once used), so the default is at most 128MB
+countCacheDirectory = './countCache'
+countCacheEntries = 4000000
+countCachePaths = 200000
+
+#upper limits on the number of nodes and the depth of a single Targeted Assembly exploration request
+exploreMaxNodes = 500
+exploreMaxDepth = 100
+
+#"msCompare" and "msAllele" show every read when a pattern matches at most "maxDisplayReads" reads; above that they show a
+#uniform sample of "readSampleSize" reads by default, and the reads can also be viewed one page of "readPageSize" reads at a time
+maxDisplayReads = 10000
+readSampleSize = 2000
+readPageSize = 1000
+
+#"msCompare" and "msAllele" search their datasets at the same time using the batch workers; this is the maximum number of datasets
+#a single page can have in flight, and the number of seconds each dataset has once a worker starts on it before it is stopped
+#and its section is skipped (a dataset that no worker has started within this many seconds is skipped too); with no batch
+#workers, the datasets are searched in the request thread and one that goes over stops at the next step of its search
+pageRequestConcurrency = 4
+pageDatasetSeconds = 120
+
+#if True, opened BWTs (and their FM-index files) are memory mapped so every worker process shares the same pages through the OS
+#page cache; if False, each process reads its own private copy into memory
+bwtMemoryMap = True
+
+#if True, the server builds any missing FM-index files, opens each dataset on the worker that owns it, and prints the mapped
+#and resident bytes of every dataset when it starts; this opens every dataset in the catalog, so with more data than
+#"bwtCacheBytes" the first ones are closed again (and reported as 0 bytes) before the report is printed
+bwtStartupReport = False
+
+#the number of web server processes that "serve.py" starts, and the datasets it opens and reads into the page cache before
+#starting them so that they all share those pages and the first query on a hot dataset doesn't wait for it to load
+serverProcesses = 4
+hotDatasets = []
+
+#where registered query panels are saved, the number of compiled panels each process keeps loaded, the most k-mers a single
+#panel may have, and the most disk space the saved panels may take (the least recently used are removed first)
+panelDirectory = './panels'
+panelCacheEntries = 16
+panelMaxKmers = 10000000
+panelMaxBytes = 4*1024**3
+
+#if True, searches start from a dataset's jump table (see "buildJumpTable.py") when it has a current one
+useJumpTables = True
+
+#each process writes its metrics (see "/metrics") to this directory every "metricsFlushSeconds" so they can be added up across
+#the server processes and batch workers; if None, "/metrics" only shows the process that answers it
+metricsDirectory = './metrics'
+metricsFlushSeconds = 5
+
+#if True, the time spent in each phase of a request (opening BWTs, finding patterns, recovering reads, rendering, ...) is sent in a
+#"Server-Timing" header and written as one JSON line per request to "timingLogFile" (standard error if None); only requests that
+#take at least "timingLogSeconds" are written
+requestTiming = True
+timingLogFile = None
+timingLogSeconds = 0.0
+
+#admin requests with an "X-Profile" header are profiled and the profile is saved in this directory under the request ID; the
+#stack of the request is sampled every "profileSampleSeconds"; if None, profiling is turned off
+profileDirectory = './profiles'
+profileSampleSeconds = 0.005
+
+#if set, admin endpoints (such as reloading the catalog) require this token; if None, they only accept local requests
+adminToken = None
+
+##########################################
+#END TUNING
+##########################################
+
 def buildRadioSelect(panel, includeFormStart):
     '''
     This builds a radio selection for the above datasets; only allows one dataset to be selected
@@ -67,10 +175,9 @@ def buildRadioSelect(panel, includeFormStart):
     if includeFormStart:
         panel.form(action="", method="POST", enctype="multipart/form-data")
     panel.ul(id='mainList')
-    for j, msdir in enumerate(MSBWTdirs):
-        available = sorted(glob.glob("%s/*/comp_msbwt.npy" % msdir))
+    for j, groupLabel, available in datasetCatalog.getGroups():
         panel.li()
-        panel.add(dirLabels[j])
+        panel.add(groupLabel)
         panel.ul()
         panel.table(class_="datatable", border='1')
         panel.tr()
@@ -80,17 +187,15 @@ def buildRadioSelect(panel, includeFormStart):
             panel.th(l)
         panel.tr.close()
         for i, dataset in enumerate(available):
-            end = dataset.rfind('/')
-            start = dataset.rfind('/', 0, end-1) + 1
-            shorten = dataset[start:end]
-            metadata = loadMetadata(dataset[0:end])
+            shorten = dataset['label']
+            metadata = dataset['metadata']
             
             panel.tr()
             panel.td()
             if i == 0 and j == 0:
-                panel.input(type="radio", name="dataset", value=str(j)+'-'+shorten, checked="Y")
+                panel.input(type="radio", name="dataset", value=dataset['id'], checked="Y")
             else:
-                panel.input(type="radio", name="dataset", value=str(j)+'-'+shorten)
+                panel.input(type="radio", name="dataset", value=dataset['id'])
             panel.td.close()
             panel.td()
             panel.add(metadata.get("Name", shorten))
@@ -168,11 +273,10 @@ def buildCheckboxSelect(panel, includeFormStart=True):
     if includeFormStart:
         panel.form(action="", method="POST", enctype="multipart/form-data")
     panel.ul(id='mainList')
-    for j, msdir in enumerate(MSBWTdirs):
-        available = sorted(glob.glob("%s/*/comp_msbwt.npy" % msdir))
+    for j, groupLabel, available in datasetCatalog.getGroups():
         panel.li()
         panel.input(type="checkbox", name="", value="")
-        panel.add(dirLabels[j])
+        panel.add(groupLabel)
         panel.ul()
         panel.table(class_="datatable", border='1')
         panel.tr()
@@ -182,15 +286,13 @@ def buildCheckboxSelect(panel, includeFormStart=True):
             panel.th(l)
         panel.tr.close()
         for i, dataset in enumerate(available):
-            end = dataset.rfind('/')
-            start = dataset.rfind('/', 0, end-1) + 1
-            shorten = dataset[start:end]
-            metadata = loadMetadata(dataset[0:end])
+            shorten = dataset['label']
+            metadata = dataset['metadata']
             
             panel.tr()
             panel.td()
-            panel.input(type="checkbox", name="dataset", value=str(j)+'-'+shorten)
-            panel.input(type="hidden", id=str(j)+'-'+shorten, value=metadata.get("Name", shorten))
+            panel.input(type="checkbox", name="dataset", value=dataset['id'])
+            panel.input(type="hidden", id=dataset['id'], value=metadata.get("Name", shorten))
             panel.td.close()
             panel.td()
             panel.add(metadata.get("Name", shorten))
@@ -224,10 +326,59 @@ def buildCheckboxSelect(panel, includeFormStart=True):
     
     panel.ul.close()#this one closes the mainList
     return citOrder, citationDict
+
+def buildReadViewForm(panel, action, dataset, pattern, count, page):
+    '''
+    This builds the controls for viewing the reads of a single dataset a page at a time or as a uniform sample
+    @param panel - the panel to build into
+    @param action - the page the forms submit to, such as "./msCompare"
+    @param dataset - the dataset ID the controls are for
+    @param pattern - the pattern that was searched for
+    @param count - the number of reads that matched the pattern
+    @param page - the page currently shown (starting from 0), or None if it isn't a paged view
+    '''
+    numPages = max(1, (count+readPageSize-1)//readPageSize)
+    if page != None:
+        page = min(max(page, 0), numPages-1)
+    buttons = []
+    if page != None and page > 0:
+        buttons.append(('Previous Page', 'page', str(page)))
+    if page == None or page < numPages-1:
+        buttons.append(('Next Page' if page != None else 'View Pages', 'page', str(page+2 if page != None else 1)))
+    buttons.append(('View Sample', 'sample', 'true'))
+
+    for label, name, value in buttons:
+        panel.form(action=action, method="POST", enctype="multipart/form-data", style="display:inline;")
+        panel.input(type="hidden", name="dataset", value=dataset)
+        panel.input(type="hidden", name="pattern", value=pattern)
+        panel.input(type="hidden", name=name, value=value)
+        panel.input(type="submit", name="submit", value=label)
+        panel.form.close()
+
+    panel.form(action=action, method="POST", enctype="multipart/form-data", style="display:inline;")
+    panel.input(type="hidden", name="dataset", value=dataset)
+    panel.input(type="hidden", name="pattern", value=pattern)
+    panel.label("Page (1-%d):" % numPages)
+    panel.input(type="number", name="page", min="1", max=str(numPages), value=str(page+1 if page != None else 1), style="width:80px;")
+    panel.input(type="submit", name="submit", value="Go")
+    panel.form.close()
+    panel.br()
+    
+def buildDatasetTimeout(panel, dataset, seconds):
+    '''
+    This builds the section shown in place of a dataset that took too long to search
+    @param panel - the panel to build into
+    @param dataset - the dataset ID
+    @param seconds - the time limit the dataset went over
+    '''
+    entry = datasetCatalog.getDataset(dataset)
+    panel.h3(dirLabels[entry['group']]+': '+entry['metadata'].get('Name', entry['label']))
+    panel.add("ERROR: this dataset was not searched within %d seconds and was skipped<br /><br />" % seconds)
     
 def loadMetadata(msbwtDir):
     '''
-    Return a dictionary of values extracted from a metadata CSV file
+    Return a dictionary of values extracted from a metadata CSV file; the pages should use the copy already parsed by the
+    dataset catalog instead of calling this directly
     @param msbwtDir - the directory to search for a metadata.csv file
     @return - a key, value dictionary corresponding to the metadata.csv file
     '''
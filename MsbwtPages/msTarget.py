@@ -81,6 +81,11 @@ def GET():
     panel.input(id="thresholdInput", type="text", name="threshold", size="20", value="10")
     panel.br()
     panel.button("Begin new graph", onclick="addNodeOnClick()")
+    panel.br()
+    panel.label("Maximum nodes to explore:")
+    panel.input(id="exploreNodesInput", type="text", name="exploreNodes", size="20", value="100")
+    panel.br()
+    panel.button("Explore from seed", onclick="exploreFromSeed()")
     
     panel.br()
     
@@ -89,6 +94,7 @@ def GET():
     panel.li('Select a dataset to access.')
     panel.li('Enter a k-mer seed to start a node in the de Bruijn graph.')
     panel.li('Click on unexplored nodes (grey) in the graph to explore them.  Additional information about each node is stored in a table below the graph.')
+    panel.li('Optionally, click "Explore from seed" to expand many nodes at once (breadth-first from the seed, up to the maximum number of nodes).')
     panel.ol.close()
     
     panel.h4('Citations:')
@@ -0,0 +1,114 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the HTML renderer for the read pileups in "msCompare" and "msAllele".  The bases that differ from the consensus
+are found for every read at once with NumPy, and each read is then written as a few runs of bases (one span per run of
+mismatches) instead of one piece of markup per base.  The rows are returned as a generator so the pages can stream them.  The
+workers only send the reads and consensus of each pileup back to the web server, which renders them while it streams the page.
+'''
+
+import numpy as np
+
+import requestTiming
+
+#the number of rendered rows joined into each string returned by renderRows(...)
+ROWS_PER_CHUNK = 100
+
+#upperLookup[c] is the upper case version of the ASCII symbol c
+upperLookup = np.arange(0, 256, dtype='<u1')
+upperLookup[ord('a'):ord('z')+1] -= ord('a')-ord('A')
+
+def getMismatches(rows, reference, compareToGaps=False):
+    '''
+    Finds the bases that differ from a reference (ignoring case), '$' and '.' are never counted as mismatches
+    @param rows - a numpy uint8 matrix with one row per read
+    @param reference - the string to compare against, such as the consensus
+    @param compareToGaps - if True, a base is also a mismatch where the reference has no base ('.')
+    @return - a numpy bool matrix that is True for each mismatched base
+    '''
+    width = rows.shape[1]
+    ref = np.empty(dtype='<u1', shape=(width, ))
+    ref[:] = ord('.')
+    refBytes = np.frombuffer(reference[0:width], dtype='<u1')
+    ref[0:refBytes.shape[0]] = refBytes
+    ref = upperLookup[ref]
+
+    mismatches = (rows != ord('$')) & (rows != ord('.')) & (upperLookup[rows] != ref[np.newaxis, :])
+    if not compareToGaps:
+        mismatches &= (ref != ord('.'))[np.newaxis, :]
+    return mismatches
+
+def renderRows(rows, reference, margin, patternLen, colors, upperCase=False, lineEnd='<br />', compareToGaps=False):
+    '''
+    Renders rows of a pileup; the pattern columns are wrapped in a colored span and every run of bases that differ from the
+    reference is wrapped in a highlighted span
+    @param rows - a list of strings that are all the same width (one per read)
+    @param reference - the string to compare against, such as the consensus
+    @param margin - the column where the pattern starts
+    @param patternLen - the length of the pattern
+    @param colors - the color for the pattern in each row
+    @param upperCase - if True, the bases are written in upper case
+    @param lineEnd - added to the end of each row
+    @param compareToGaps - if True, a base is also a mismatch where the reference has no base ('.')
+    @return - a generator of HTML strings, each one holding up to ROWS_PER_CHUNK rows separated by newlines
+    '''
+    if len(rows) == 0:
+        return
+    width = len(rows[0])
+    matrix = np.frombuffer(''.join(rows), dtype='<u1').reshape((len(rows), width))
+    mismatches = getMismatches(matrix, reference, compareToGaps)
+
+    #every place where a row switches between matching and mismatching, grouped by row
+    changeRows, changeColumns = np.nonzero(mismatches[:, 1:] != mismatches[:, :-1])
+    changeColumns = (changeColumns+1).tolist()
+    rowStarts = np.searchsorted(changeRows, np.arange(0, len(rows)+1)).tolist()
+
+    #the pattern span opens at "margin" and closes at "margin+patternLen"
+    fixedCuts = set([x for x in [0, margin, margin+patternLen] if x < width])
+
+    lines = []
+    for r, read in enumerate(rows):
+        if upperCase:
+            read = read.upper()
+        rowMismatches = mismatches[r]
+        cuts = sorted(fixedCuts.union(changeColumns[rowStarts[r]:rowStarts[r+1]]))
+        cuts.append(width)
+
+        output = []
+        for x in xrange(0, len(cuts)-1):
+            start = cuts[x]
+            if start == margin:
+                output.append('<span style="color: %s;">' % colors[r])
+            elif start == margin+patternLen:
+                output.append('</span>')
+            if rowMismatches[start]:
+                output.append('<span style="background-color:yellow;">%s</span>' % read[start:cuts[x+1]])
+            else:
+                output.append(read[start:cuts[x+1]])
+        output.append(lineEnd)
+        lines.append(''.join(output))
+
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines)
+            lines = []
+
+    if len(lines) > 0:
+        yield '\n'.join(lines)
+
+def streamPileup(reads, consensus, margin, pattern):
+    '''
+    Renders a whole read pileup as "msCompare" and "msAllele" show it: a row marking the pattern columns, the reads, and the
+    consensus
+    @param reads - a list of strings that are all the same width (one per read), already in display order
+    @param consensus - the consensus of the reads
+    @param margin - the column where the pattern starts
+    @param pattern - the pattern that was searched for
+    @return - a generator of HTML strings
+    '''
+    l = len(pattern)
+    yield "."*margin + "*"*l + '.'*margin + '\n<br />'
+
+    colors = ["red" if (read.find('$') > read.find(pattern)) else "blue" for read in reads]
+    for chunk in requestTiming.timeChunks('renderHTML', renderRows(reads, consensus, margin, l, colors), len(reads)):
+        yield chunk
+    yield '<strong>%s<span style="color: green;">%s</span>%s<br /></strong>' % (consensus[:margin], consensus[margin:margin+l], consensus[margin+l:])
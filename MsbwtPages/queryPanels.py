@@ -0,0 +1,268 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the registry of query panels for Mass Query and Batch Query.  A panel is a list of k-mers that is uploaded
+once (as plain text, a column of a delimited file, or FASTA) and then referred to by its panel ID, so the same k-mers aren't sent
+and parsed again for every request and dataset.  When a panel is registered, it is validated and compiled: the k-mers are upper
+cased, their reverse-complements are computed, the forward and reverse-complement queries are de-duplicated into one list, and
+that list is put in the order the batch counter searches it (see kmerCounter.getSearchOrder(...)).  Compiled panels are saved
+in "panelDirectory" (see msSharedUtil) under an ID derived from the k-mers, so every server process and worker can load them
+and registering the same k-mers twice returns the same panel.  The modification time of a saved panel is updated whenever it is
+used, and once the saved panels take more than "panelMaxBytes" the least recently used ones are removed.
+'''
+
+import collections
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+import countCache
+import kmerCounter
+import msSharedUtil
+from MUSCython import MultiStringBWTCython as MSBWT
+
+#the formats a panel can be uploaded in
+PANEL_FORMATS = ['text', 'csv', 'fasta']
+
+#the symbols a k-mer may contain
+VALID_SYMBOLS = set('$ACGNT')
+
+#a saved panel's modification time is only updated if it is older than this, so a panel in constant use isn't touched on every count
+TOUCH_SECONDS = 60
+
+#panel ID -> compiled panel, ordered from least recently used to most recently used
+loadedPanels = collections.OrderedDict()
+panelsLock = threading.Lock()
+
+def parsePanel(text, panelFormat, column=1, headerPresent=False, delimiter=','):
+    '''
+    Pulls the k-mers out of an uploaded panel
+    @param text - the uploaded panel
+    @param panelFormat - one of PANEL_FORMATS: "text" is one k-mer per line (or separated by any whitespace), "csv" is one column of a
+        delimited file, and "fasta" is one k-mer per FASTA record
+    @param column - for "csv", the 1-based column holding the k-mers
+    @param headerPresent - for "csv", if True the first line is skipped
+    @param delimiter - for "csv", the symbol between columns
+    @return - the list of k-mers in upper case
+    '''
+    if panelFormat == 'text':
+        kmers = text.split()
+    elif panelFormat == 'csv':
+        lines = [line.rstrip('\r') for line in text.split('\n')]
+        if headerPresent:
+            lines = lines[1:]
+        kmers = []
+        for lineNumber, line in enumerate(lines):
+            if line.strip() == '':
+                continue
+            pieces = line.split(delimiter)
+            if column < 1 or column > len(pieces):
+                raise ValueError('Line %d does not have column %d' % (lineNumber+1, column))
+            kmers.append(pieces[column-1].strip())
+    elif panelFormat == 'fasta':
+        kmers = []
+        current = None
+        for line in text.split('\n'):
+            line = line.strip()
+            if line.startswith('>'):
+                if current != None:
+                    kmers.append(''.join(current))
+                current = []
+            elif line != '':
+                if current == None:
+                    raise ValueError('FASTA panels must start with a ">" header line')
+                current.append(line)
+        if current != None:
+            kmers.append(''.join(current))
+    else:
+        raise ValueError('Unknown panel format: '+str(panelFormat))
+    return [str(kmer).upper() for kmer in kmers]
+
+def compilePanel(kmers):
+    '''
+    Validates a list of k-mers and builds the compiled panel
+    @param kmers - the list of k-mers in upper case
+    @return - the compiled panel, a dictionary with the keys:
+        panelID - the ID for this list of k-mers
+        numKmers - the number of k-mers in the panel
+        queries - the distinct forward and reverse-complement k-mers in search order
+        forwardIndex - a numpy array with the position in "queries" of each k-mer
+        rcIndex - a numpy array with the position in "queries" of the reverse-complement of each k-mer
+    '''
+    if len(kmers) == 0:
+        raise ValueError('The panel does not have any k-mers')
+    if len(kmers) > msSharedUtil.panelMaxKmers:
+        raise ValueError('The panel has %d k-mers, the limit is %d' % (len(kmers), msSharedUtil.panelMaxKmers))
+    for kmer in kmers:
+        if kmer == '' or not VALID_SYMBOLS.issuperset(kmer):
+            raise ValueError('Invalid k-mer: "%s" (valid symbols are "$ACGNT")' % kmer)
+
+    rcKmers = [MSBWT.reverseComplement(kmer) for kmer in kmers]
+    uniqueQueries = list(set(kmers).union(rcKmers))
+    queries = [uniqueQueries[i] for i in kmerCounter.getSearchOrder(uniqueQueries)]
+    positions = dict([(query, i) for i, query in enumerate(queries)])
+
+    return {'panelID':hashlib.sha1('\n'.join(kmers)).hexdigest(),
+            'numKmers':len(kmers),
+            'queries':queries,
+            'forwardIndex':np.array([positions[kmer] for kmer in kmers], dtype='<u4'),
+            'rcIndex':np.array([positions[kmer] for kmer in rcKmers], dtype='<u4')}
+
+def getPanelFilename(panelID):
+    '''
+    @param panelID - the panel ID
+    @return - where the compiled panel is saved
+    '''
+    return msSharedUtil.panelDirectory+'/'+panelID+'.npz'
+
+def registerPanel(kmers):
+    '''
+    Compiles a panel and saves it, if it isn't already saved
+    @param kmers - the list of k-mers in upper case
+    @return - a summary of the panel (see getSummary(...))
+    '''
+    panel = compilePanel(kmers)
+    panelFN = getPanelFilename(panel['panelID'])
+    if not os.path.exists(panelFN):
+        if not os.path.exists(msSharedUtil.panelDirectory):
+            os.makedirs(msSharedUtil.panelDirectory)
+
+        #write to a temporary file first so other processes never load half of a panel
+        tempFN = panelFN+'.tmp.%d' % os.getpid()
+        with open(tempFN, 'wb') as fp:
+            np.savez(fp, queries=np.array(panel['queries']), forwardIndex=panel['forwardIndex'], rcIndex=panel['rcIndex'])
+        os.rename(tempFN, panelFN)
+        panel['touched'] = time.time()
+    else:
+        touchPanel(panel)
+
+    addLoadedPanel(panel)
+    prunePanels(panel['panelID'])
+    return getSummary(panel)
+
+def touchPanel(panel):
+    '''
+    Marks a saved panel as used, so prunePanels(...) removes it last; this only writes if it hasn't been done in TOUCH_SECONDS
+    @param panel - the compiled panel
+    '''
+    now = time.time()
+    if now-panel.get('touched', 0) < TOUCH_SECONDS:
+        return
+    panel['touched'] = now
+    try:
+        os.utime(getPanelFilename(panel['panelID']), None)
+    except OSError:
+        #another process removed it, it is saved again the next time it is registered
+        pass
+
+def prunePanels(keepID):
+    '''
+    Removes the least recently used saved panels until they take at most "panelMaxBytes" on disk
+    @param keepID - a panel ID that is never removed, the one that was just registered
+    '''
+    saved = []
+    for panelFN in glob.glob(msSharedUtil.panelDirectory+'/*.npz'):
+        try:
+            filestat = os.stat(panelFN)
+        except OSError:
+            continue
+        saved.append((filestat.st_mtime, filestat.st_size, panelFN))
+
+    totalBytes = sum([size for mtime, size, panelFN in saved])
+    for mtime, size, panelFN in sorted(saved):
+        if totalBytes <= msSharedUtil.panelMaxBytes:
+            break
+        if panelFN == getPanelFilename(keepID):
+            continue
+        try:
+            os.remove(panelFN)
+        except OSError:
+            pass
+        totalBytes -= size
+
+def addLoadedPanel(panel):
+    '''
+    Keeps a compiled panel in this process, closing the least recently used panel if there are more than "panelCacheEntries"
+    @param panel - the compiled panel
+    '''
+    with panelsLock:
+        loadedPanels.pop(panel['panelID'], None)
+        loadedPanels[panel['panelID']] = panel
+        while len(loadedPanels) > max(1, msSharedUtil.panelCacheEntries):
+            loadedPanels.popitem(last=False)
+
+def getPanel(panelID):
+    '''
+    @param panelID - the panel ID
+    @return - the compiled panel (see compilePanel(...)), or None if there is no panel with that ID
+    '''
+    with panelsLock:
+        if panelID in loadedPanels:
+            panel = loadedPanels.pop(panelID)
+            loadedPanels[panelID] = panel
+        else:
+            panel = None
+    if panel != None:
+        touchPanel(panel)
+        return panel
+
+    #IDs are hex digests, so anything else can't be a saved panel
+    panelID = str(panelID)
+    if len(panelID) != 40 or not all([c in '0123456789abcdef' for c in panelID]):
+        return None
+    panelFN = getPanelFilename(panelID)
+    if not os.path.exists(panelFN):
+        return None
+
+    saved = np.load(panelFN)
+    panel = {'panelID':panelID,
+             'numKmers':saved['forwardIndex'].shape[0],
+             'queries':saved['queries'].tolist(),
+             'forwardIndex':saved['forwardIndex'],
+             'rcIndex':saved['rcIndex']}
+    saved.close()
+    touchPanel(panel)
+    addLoadedPanel(panel)
+    return panel
+
+def getSummary(panel):
+    '''
+    @param panel - the compiled panel
+    @return - a dictionary with the 'panelID', the number of k-mers ('numKmers'), and the number of distinct forward and
+        reverse-complement k-mers that are searched ('numQueries')
+    '''
+    return {'panelID':panel['panelID'], 'numKmers':panel['numKmers'], 'numQueries':len(panel['queries'])}
+
+def countPanel(dataset, panel, forward, revComp, start=0, end=None):
+    '''
+    Counts some or all of a panel's k-mers in a dataset; only the queries needed for the requested strands are searched
+    @param dataset - the dataset ID with the format <directory index>-<dataset>
+    @param panel - the compiled panel
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @param start - the first k-mer of the panel to count
+    @param end - one past the last k-mer of the panel to count, None for the rest of the panel
+    @return - a tuple (forward counts, reverse-complement counts) of numpy uint64 arrays; a disabled strand is an empty array
+    '''
+    forwardIndex = panel['forwardIndex'][start:end]
+    rcIndex = panel['rcIndex'][start:end]
+    used = []
+    if forward:
+        used.append(forwardIndex)
+    if revComp:
+        used.append(rcIndex)
+    if len(used) == 0:
+        return (np.zeros(dtype='<u8', shape=(0, )), np.zeros(dtype='<u8', shape=(0, )))
+
+    #np.unique sorts the positions, which keeps the needed queries in search order
+    needed = np.unique(np.concatenate(used))
+    counts = np.zeros(dtype='<u8', shape=(len(panel['queries']), ))
+    counts[needed] = countCache.countUniqueKmers(dataset, [panel['queries'][i] for i in needed], True)
+
+    forwardResults = counts[forwardIndex] if forward else np.zeros(dtype='<u8', shape=(0, ))
+    rcResults = counts[rcIndex] if revComp else np.zeros(dtype='<u8', shape=(0, ))
+    return (forwardResults, rcResults)
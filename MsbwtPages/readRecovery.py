@@ -0,0 +1,194 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the bulk read extraction shared by the tools that display reads ("msCompare" and "msAllele").  Every read in a
+range of the BWT is recovered into a single NumPy character matrix, and all of the reads are lined up around the query with array
+operations instead of slicing, reverse-complementing, and padding each read as its own string.  When a pattern matches too many
+reads to show at once, a page of the reads or a uniform sample of them is recovered instead.
+'''
+
+import numpy as np
+import random
+
+import msSharedUtil
+import requestTiming
+import serverMetrics
+
+#complementLookup[c] is the complement of the ASCII symbol c, anything that isn't a base maps to itself
+complementLookup = np.arange(0, 256, dtype='<u1')
+complementLookup[np.frombuffer('ACGTacgt', dtype='<u1')] = np.frombuffer('TGCAtgca', dtype='<u1')
+
+#lowerLookup[c] is the lower case version of the ASCII symbol c
+lowerLookup = np.arange(0, 256, dtype='<u1')
+lowerLookup[ord('A'):ord('Z')+1] += ord('a')-ord('A')
+
+def recoverRows(bwt, indices):
+    '''
+    Recovers the string starting at each BWT index, this is the same as calling bwt.recoverString(i) for each index
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param indices - a range or list of BWT indices
+    @return - a tuple (rows, lengths) where rows is a numpy uint8 matrix with one string per row (padded with '.' when the strings
+        have different lengths) and lengths is a numpy array with the length of each string
+    '''
+    strings = [bwt.recoverString(i) for i in indices]
+    lengths = np.array([len(s) for s in strings], dtype='<i8')
+    if len(strings) == 0:
+        return (np.zeros(dtype='<u1', shape=(0, 0)), lengths)
+
+    width = int(lengths.max())
+    if lengths.min() == width:
+        #the usual case, every read is the same length so the bytes can be used as-is
+        rows = np.frombuffer(''.join(strings), dtype='<u1').reshape((len(strings), width)).copy()
+    else:
+        rows = np.empty(dtype='<u1', shape=(len(strings), width))
+        rows[:] = ord('.')
+        for x, s in enumerate(strings):
+            rows[x, 0:len(s)] = np.frombuffer(s, dtype='<u1')
+    return (rows, lengths)
+
+def alignRows(rows, lengths, patternLen, bufferLen, reverseComplement):
+    '''
+    Lines up recovered strings so the pattern is in the same columns for every read.  Each string starts with the pattern (it
+    came from the pattern's BWT range) and wraps around at the '$', so it is rotated back into read order, reverse-complemented
+    if requested, and shifted so that the pattern starts at column bufferLen-patternLen.  The pattern is kept in upper case and
+    the rest of the read is lower case; columns outside of the read are '.'.
+    @param rows - a matrix from recoverRows(...)
+    @param lengths - the string lengths from recoverRows(...)
+    @param patternLen - the length of the pattern
+    @param bufferLen - the read length used for the layout (counting the '$')
+    @param reverseComplement - if True, the strings are from the reverse-complement of the pattern and are flipped to match it
+    @return - a numpy uint8 matrix with one aligned read per row that is 2*bufferLen-patternLen columns wide (or wider if a read
+        doesn't fit)
+    '''
+    numRows = rows.shape[0]
+    fixedSize = 2*bufferLen-patternLen
+    if numRows == 0:
+        return np.zeros(dtype='<u1', shape=(0, fixedSize))
+
+    #position of the '$' in each string, padding is '.' so it can't be found there
+    dollarPos = np.argmax(rows == ord('$'), axis=1)
+
+    #readIndex[r, j] is the column of "rows" that ends up at position j of the aligned read (before shifting)
+    j = np.arange(0, rows.shape[1])[np.newaxis, :]
+    rowLengths = lengths[:, np.newaxis]
+    if reverseComplement:
+        #read order starts at the '$' of the reverse-complement, which is mirrored from the '$' here
+        readIndex = rowLengths-1-((j+(rowLengths-1-dollarPos[:, np.newaxis])) % rowLengths)
+        beforePattern = dollarPos+1-patternLen
+    else:
+        #read order starts just after the '$' and ends with it
+        readIndex = (j+dollarPos[:, np.newaxis]+1) % rowLengths
+        beforePattern = lengths-dollarPos-1
+
+    symbols = rows[np.arange(0, numRows)[:, np.newaxis], readIndex]
+    if reverseComplement:
+        symbols = complementLookup[symbols]
+
+    #everything but the pattern is lower case
+    isPattern = (j >= beforePattern[:, np.newaxis]) & (j < beforePattern[:, np.newaxis]+patternLen)
+    symbols = np.where(isPattern, symbols, lowerLookup[symbols])
+
+    #shift each read so the pattern lines up, a read that is longer than the layout just starts at the first column
+    leftPad = np.maximum(bufferLen-patternLen-beforePattern, 0)
+    width = max(fixedSize, int((leftPad+lengths).max()))
+    ret = np.empty(dtype='<u1', shape=(numRows, width))
+    ret[:] = ord('.')
+
+    inRead = j < rowLengths
+    rowIDs, columns = np.nonzero(inRead)
+    ret[rowIDs, leftPad[rowIDs]+columns] = symbols[rowIDs, columns]
+    return ret
+
+def extractAlignedReads(bwt, forwardIndices, reverseIndices, patternLen, bufferLen):
+    '''
+    Recovers and lines up reads containing a pattern or its reverse-complement
+    @param bwt - an instance of the BasicBWT class from the "msbwt" package
+    @param forwardIndices - the BWT indices (a range or list) of reads with the pattern
+    @param reverseIndices - the BWT indices (a range or list) of reads with the reverse-complement of the pattern
+    @param patternLen - the length of the pattern
+    @param bufferLen - the read length used for the layout (counting the '$')
+    @return - a numpy uint8 matrix with the aligned forward reads followed by the aligned reverse-complement reads
+    '''
+    numReads = len(forwardIndices)+len(reverseIndices)
+    with requestTiming.span('recoverString', numReads):
+        forwardRows, forwardLengths = recoverRows(bwt, forwardIndices)
+        reverseRows, reverseLengths = recoverRows(bwt, reverseIndices)
+    serverMetrics.observe('msbwt_reads_recovered', numReads)
+    with requestTiming.span('alignReads', numReads):
+        forwardAligned = alignRows(forwardRows, forwardLengths, patternLen, bufferLen, False)
+        reverseAligned = alignRows(reverseRows, reverseLengths, patternLen, bufferLen, True)
+
+    #the two halves can only differ in width if some reads didn't fit the layout
+    width = max(forwardAligned.shape[1], reverseAligned.shape[1])
+    ret = np.empty(dtype='<u1', shape=(forwardAligned.shape[0]+reverseAligned.shape[0], width))
+    ret[:] = ord('.')
+    ret[0:forwardAligned.shape[0], 0:forwardAligned.shape[1]] = forwardAligned
+    ret[forwardAligned.shape[0]:, 0:reverseAligned.shape[1]] = reverseAligned
+    return ret
+
+def getPageIndices(forwardRange, reverseRange, page, pageSize):
+    '''
+    Splits the reads for a pattern into pages, the forward reads are first followed by the reverse-complement reads
+    @param forwardRange - the BWT range (lo, hi) of the pattern
+    @param reverseRange - the BWT range (lo, hi) of the reverse-complement of the pattern
+    @param page - the page to get, starting from 0
+    @param pageSize - the number of reads on each page
+    @return - a tuple (forward indices, reverse indices) of the ranges on this page
+    '''
+    numForward = forwardRange[1]-forwardRange[0]
+    numReverse = reverseRange[1]-reverseRange[0]
+    start = page*pageSize
+    end = start+pageSize
+    forwardIndices = xrange(forwardRange[0]+min(start, numForward), forwardRange[0]+min(end, numForward))
+    reverseIndices = xrange(reverseRange[0]+min(max(start-numForward, 0), numReverse),
+                            reverseRange[0]+min(max(end-numForward, 0), numReverse))
+    return (forwardIndices, reverseIndices)
+
+def getSampleIndices(forwardRange, reverseRange, sampleSize, seed=0):
+    '''
+    Picks a uniform random subset of the reads for a pattern; the same ranges and seed always pick the same reads
+    @param forwardRange - the BWT range (lo, hi) of the pattern
+    @param reverseRange - the BWT range (lo, hi) of the reverse-complement of the pattern
+    @param sampleSize - the maximum number of reads to pick
+    @param seed - the seed for the random choice
+    @return - a tuple (forward indices, reverse indices) of the picked reads in BWT order
+    '''
+    numForward = forwardRange[1]-forwardRange[0]
+    numReverse = reverseRange[1]-reverseRange[0]
+    if numForward+numReverse <= sampleSize:
+        return (xrange(forwardRange[0], forwardRange[1]), xrange(reverseRange[0], reverseRange[1]))
+
+    #random.sample(...) only stores the picked values, so this doesn't depend on the number of reads
+    picked = sorted(random.Random(seed).sample(xrange(0, numForward+numReverse), sampleSize))
+    forwardIndices = [forwardRange[0]+x for x in picked if x < numForward]
+    reverseIndices = [reverseRange[0]+x-numForward for x in picked if x >= numForward]
+    return (forwardIndices, reverseIndices)
+
+def selectReads(forwardRange, reverseRange, page, sample):
+    '''
+    Picks the reads to display for a pattern, this keeps the work for a single request bounded no matter how many reads match
+    @param forwardRange - the BWT range (lo, hi) of the pattern
+    @param reverseRange - the BWT range (lo, hi) of the reverse-complement of the pattern
+    @param page - the page of reads to show starting from 0, or None
+    @param sample - if True, a uniform sample of the reads is shown; this is also used when no page is given and there are more
+        than msSharedUtil.maxDisplayReads reads
+    @return - a tuple (forward indices, reverse indices, description) where the description is an empty string if every read was
+        selected
+    '''
+    count = forwardRange[1]-forwardRange[0]+reverseRange[1]-reverseRange[0]
+    pageSize = msSharedUtil.readPageSize
+    if page != None:
+        numPages = max(1, (count+pageSize-1)//pageSize)
+        page = min(max(page, 0), numPages-1)
+        forwardIndices, reverseIndices = getPageIndices(forwardRange, reverseRange, page, pageSize)
+        numSelected = len(forwardIndices)+len(reverseIndices)
+        description = 'Showing reads %d-%d (page %d of %d)' % (page*pageSize+1, page*pageSize+numSelected, page+1, numPages)
+    elif sample or count > msSharedUtil.maxDisplayReads:
+        forwardIndices, reverseIndices = getSampleIndices(forwardRange, reverseRange, msSharedUtil.readSampleSize)
+        numSelected = len(forwardIndices)+len(reverseIndices)
+        description = 'Showing a uniform sample of %d reads (%d forward, %d reverse-complemented)' % (numSelected, len(forwardIndices), len(reverseIndices))
+    else:
+        forwardIndices = xrange(forwardRange[0], forwardRange[1])
+        reverseIndices = xrange(reverseRange[0], reverseRange[1])
+        description = ''
+    return (forwardIndices, reverseIndices, description)
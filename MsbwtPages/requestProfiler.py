@@ -0,0 +1,203 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the on-demand profiler for single requests.  An admin request (see isAdminRequest() in "application.py") with
+an "X-Profile" header is run under a profiler from the start of the request until its response is closed, so streamed pages and
+results are covered until their last byte.  The profiler only watches the thread handling that request, so other requests are
+not slowed down.  There are two modes:
+    sample - a background thread records the stack of the request every "profileSampleSeconds"; this adds very little overhead
+    cprofile - the request also runs under cProfile for exact call counts and times, which makes it run slower
+Tasks the request sends to the batch workers are profiled in the worker and added to the request's profile (see
+workerPool.runTimed(...)).  The profile is saved in "profileDirectory" (see msSharedUtil) as "<request ID>.collapsed", with one
+"frame;frame;frame count" line per sampled stack for flame graph tools, and for "cprofile" as "<request ID>.pstats", which can be
+read with the "pstats" module.
+'''
+
+import collections
+import cProfile
+import os
+import pstats
+import re
+import sys
+import thread
+import threading
+import time
+import uuid
+
+import msSharedUtil
+
+#the modes that can be asked for in the "X-Profile" header
+PROFILE_MODES = ['sample', 'cprofile']
+
+#the request IDs a client may choose with an "X-Request-ID" header, anything else gets a generated ID
+VALID_REQUEST_ID = re.compile('^[A-Za-z0-9_.-]{1,64}$')
+
+#the profile of the request each thread is working on
+local = threading.local()
+
+class StackSampler(threading.Thread):
+    '''
+    A thread that counts the stacks of another thread at a fixed interval
+    '''
+    def __init__(self, threadID, interval):
+        '''
+        @param threadID - the ID of the thread to sample, from thread.get_ident()
+        @param interval - the number of seconds between samples
+        '''
+        threading.Thread.__init__(self, name="requestProfiler")
+        self.daemon = True
+        self.threadID = threadID
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.threadID, None)
+            if frame != None:
+                self.samples[collapseStack(frame)] += 1
+            del frame
+
+    def stop(self):
+        '''
+        Stops sampling and waits for the thread to exit
+        '''
+        self.stopped.set()
+        self.join()
+
+class SavedStats(object):
+    '''
+    Holds the statistics from a cProfile run in another process so pstats.Stats(...) can load them like a profiler
+    '''
+    def __init__(self, stats):
+        '''
+        @param stats - the "stats" dictionary of a cProfile.Profile after create_stats()
+        '''
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def collapseStack(frame):
+    '''
+    @param frame - the innermost frame of a stack
+    @return - the stack as "file:function" names from the outermost frame in, separated by ';'
+    '''
+    names = []
+    while frame != None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def getRequestID(requestedID):
+    '''
+    @param requestedID - the value of the "X-Request-ID" header, or None
+    @return - the ID the profile is saved under
+    '''
+    if requestedID != None and VALID_REQUEST_ID.match(requestedID):
+        return requestedID
+    return time.strftime('%Y%m%d-%H%M%S')+'-'+uuid.uuid4().hex[0:8]
+
+def start(requestID, mode):
+    '''
+    Starts profiling the current thread
+    @param requestID - the ID the profile is saved under, see getRequestID(...)
+    @param mode - one of PROFILE_MODES
+    @return - the profiling session, a dictionary that is passed to the other functions here
+    '''
+    session = {'requestID':requestID,
+               'mode':mode,
+               'profile':None,
+               'sampler':StackSampler(thread.get_ident(), msSharedUtil.profileSampleSeconds),
+               'workerStats':[],
+               'workerSamples':collections.Counter(),
+               'stopped':False}
+    session['sampler'].start()
+    if mode == 'cprofile':
+        session['profile'] = cProfile.Profile()
+        session['profile'].enable()
+    local.session = session
+    return session
+
+def resetAfterFork():
+    '''
+    Drops the profiler and session a forked process inherits from the thread that forked it
+    '''
+    sys.setprofile(None)
+    local.session = None
+
+def getMode():
+    '''
+    @return - the profiling mode of the request in this thread, or None if it isn't being profiled
+    '''
+    session = getattr(local, 'session', None)
+    if session == None:
+        return None
+    return session['mode']
+
+def stop(session):
+    '''
+    Stops profiling, this has to be called from the thread that started the session
+    @param session - the value returned by start(...), or None
+    '''
+    if session == None or session['stopped']:
+        return
+    session['stopped'] = True
+    if session['profile'] != None:
+        session['profile'].disable()
+    session['sampler'].stop()
+    if getattr(local, 'session', None) is session:
+        local.session = None
+
+def getProfileData(session):
+    '''
+    @param session - a stopped session from start(...), or None
+    @return - a picklable tuple (cProfile statistics or None, sampled stack counts) that mergeProfileData(...) can add to a request,
+        or None if "session" is None
+    '''
+    if session == None:
+        return None
+    stats = None
+    if session['profile'] != None:
+        session['profile'].create_stats()
+        stats = session['profile'].stats
+    return (stats, dict(session['sampler'].samples))
+
+def mergeProfileData(profileData):
+    '''
+    Adds the profile of work done somewhere else (such as in a batch worker) to the request in this thread
+    @param profileData - the value returned by getProfileData(...), or None
+    '''
+    session = getattr(local, 'session', None)
+    if session == None or profileData == None:
+        return
+    stats, samples = profileData
+    if stats != None:
+        session['workerStats'].append(stats)
+    session['workerSamples'].update(samples)
+
+def save(session):
+    '''
+    Writes the profile of a stopped session to "profileDirectory"
+    @param session - the value returned by start(...)
+    @return - the list of files written
+    '''
+    if not os.path.exists(msSharedUtil.profileDirectory):
+        os.makedirs(msSharedUtil.profileDirectory)
+    prefix = msSharedUtil.profileDirectory+'/'+session['requestID']
+    written = []
+
+    if session['profile'] != None:
+        stats = pstats.Stats(session['profile'])
+        for workerStats in session['workerStats']:
+            stats.add(SavedStats(workerStats))
+        stats.dump_stats(prefix+'.pstats')
+        written.append(prefix+'.pstats')
+
+    samples = session['sampler'].samples+session['workerSamples']
+    with open(prefix+'.collapsed', 'w') as fp:
+        for stack, count in sorted(samples.iteritems()):
+            fp.write('%s %d\n' % (stack, count))
+    written.append(prefix+'.collapsed')
+    return written
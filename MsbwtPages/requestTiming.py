@@ -0,0 +1,164 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the per-request timing breakdown.  The tools wrap each phase of their work (opening a BWT, finding a pattern,
+recovering reads, clustering, building a consensus, rendering HTML, writing JSON, ...) in span(...), which adds the time, the
+number of calls, and the number of items handled to the request that the current thread is working on.  Work done by the batch
+workers is timed the same way in the worker and sent back with the result (see workerPool.runTimed(...)), so the phases of every
+dataset are added together.  The breakdown is sent in a "Server-Timing" header and written as one JSON line per request (see
+"requestTiming" and "timingLogFile" in msSharedUtil).  Outside of a request, span(...) does nothing.
+'''
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+import msSharedUtil
+
+#the phases of the request each thread is working on; phase name -> [seconds, calls, items], or None if no request is timed
+local = threading.local()
+logLock = threading.Lock()
+
+def start():
+    '''
+    Starts timing a new request in this thread, replacing any request that was not finished
+    @return - the phases of the new request (see getPhases()), or None if "requestTiming" is off
+    '''
+    local.phases = collections.OrderedDict() if msSharedUtil.requestTiming else None
+    return local.phases
+
+def finish(phases):
+    '''
+    Stops timing a request; this can be called from any thread
+    @param phases - the value returned by start()
+    '''
+    if getattr(local, 'phases', None) is phases:
+        local.phases = None
+
+def getPhases():
+    '''
+    @return - an ordered dictionary from phase name to [seconds, calls, items] for the request in this thread, empty if no request
+        is being timed
+    '''
+    phases = getattr(local, 'phases', None)
+    if phases == None:
+        return collections.OrderedDict()
+    return collections.OrderedDict([(name, list(values)) for name, values in phases.iteritems()])
+
+def addPhase(name, seconds, calls=1, items=0):
+    '''
+    Adds to a phase of the request in this thread
+    @param name - the phase name, this has to be a valid "Server-Timing" name (letters, digits, and no spaces)
+    @param seconds - the time spent
+    @param calls - the number of times the phase ran
+    @param items - the number of items handled, such as reads or k-mers
+    '''
+    phases = getattr(local, 'phases', None)
+    if phases == None:
+        return
+    current = phases.get(name, None)
+    if current == None:
+        phases[name] = [seconds, calls, items]
+    else:
+        current[0] += seconds
+        current[1] += calls
+        current[2] += items
+
+def addItems(name, items):
+    '''
+    Adds to the items of a phase without counting another call, for when the number of items is only known afterwards
+    @param name - the phase name
+    @param items - the number of items handled
+    '''
+    addPhase(name, 0.0, 0, items)
+
+def mergePhases(phases):
+    '''
+    Adds the phases timed somewhere else (such as in a batch worker) to the request in this thread
+    @param phases - a dictionary from phase name to [seconds, calls, items]
+    '''
+    for name, (seconds, calls, items) in phases.iteritems():
+        addPhase(name, seconds, calls, items)
+
+@contextlib.contextmanager
+def span(name, items=0):
+    '''
+    Times the body of a "with" statement as one call of a phase; a span should never contain a "yield" to the client, otherwise
+    the time spent sending is counted too
+    @param name - the phase name
+    @param items - the number of items handled
+    '''
+    if getattr(local, 'phases', None) == None:
+        yield
+        return
+    st = time.time()
+    try:
+        yield
+    finally:
+        addPhase(name, time.time()-st, 1, items)
+
+def timeChunks(name, chunks, items=0):
+    '''
+    Passes on the strings from a generator, timing the work that makes each one as a single call of a phase; unlike span(...),
+    this can wrap a generator that is streamed to the client because the time spent sending isn't counted
+    @param name - the phase name
+    @param chunks - a generator of strings
+    @param items - the number of items handled
+    @return - a generator of the same strings
+    '''
+    chunks = iter(chunks)
+    calls = 1
+    while True:
+        st = time.time()
+        chunk = next(chunks, None)
+        addPhase(name, time.time()-st, calls, items)
+        calls = 0
+        items = 0
+        if chunk == None:
+            return
+        yield chunk
+
+def formatHeader(phases, totalSeconds):
+    '''
+    @param phases - a dictionary from phase name to [seconds, calls, items]
+    @param totalSeconds - the time since the request started
+    @return - the value of the "Server-Timing" header, the durations are in milliseconds
+    '''
+    entries = ['%s;dur=%.1f;desc="%d calls, %d items"' % (name, seconds*1000, calls, items)
+               for name, (seconds, calls, items) in phases.iteritems()]
+    entries.append('total;dur=%.1f' % (totalSeconds*1000))
+    return ', '.join(entries)
+
+def logRequest(method, path, route, status, totalSeconds, phases):
+    '''
+    Writes the timing of a finished request as one JSON line to "timingLogFile" (standard error if None), unless it took less
+    than "timingLogSeconds"
+    @param method - the HTTP method
+    @param path - the requested path
+    @param route - the route that handled the request
+    @param status - the response status code
+    @param totalSeconds - the time from the start of the request until the response was closed
+    @param phases - a dictionary from phase name to [seconds, calls, items]
+    '''
+    if totalSeconds < msSharedUtil.timingLogSeconds:
+        return
+    record = collections.OrderedDict([('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                                      ('pid', os.getpid()),
+                                      ('method', method),
+                                      ('path', path),
+                                      ('route', route),
+                                      ('status', status),
+                                      ('totalMs', round(totalSeconds*1000, 1)),
+                                      ('phases', collections.OrderedDict([(name, {'ms':round(seconds*1000, 1), 'calls':calls, 'items':items})
+                                                                          for name, (seconds, calls, items) in phases.iteritems()]))])
+    line = json.dumps(record)+'\n'
+    with logLock:
+        if msSharedUtil.timingLogFile == None:
+            sys.stderr.write(line)
+        else:
+            with open(msSharedUtil.timingLogFile, 'a') as fp:
+                fp.write(line)
@@ -0,0 +1,229 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the server metrics that are exported in the Prometheus text format at "/metrics".  Recording a value only
+updates a dictionary in the current process under a lock, so the metrics can stay on under load.  Since requests are handled by
+several processes (the server processes from "serve.py" and the batch workers), each process writes its values to
+"metricsDirectory" (see msSharedUtil) every "metricsFlushSeconds" from a background thread, and "/metrics" adds up the files of
+every running process along with its own current values.
+'''
+
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+import msSharedUtil
+
+#bucket upper bounds for the histograms
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+LOAD_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0]
+READ_BUCKETS = [0, 10, 100, 1000, 10000, 100000, 1000000]
+
+#metric name -> (type, help text, histogram buckets)
+METRICS = {'msbwt_request_duration_seconds':('histogram', 'Time spent handling a request, including any streamed body', LATENCY_BUCKETS),
+           'msbwt_requests_in_flight':('gauge', 'Requests currently being handled', None),
+           'msbwt_responses_total':('counter', 'Responses sent, by status code', None),
+           'msbwt_bwt_load_seconds':('histogram', 'Time spent opening a BWT in the shared registry', LOAD_BUCKETS),
+           'msbwt_kmers_counted_total':('counter', 'K-mers counted, by whether the count came from the BWT or the count cache', None),
+           'msbwt_reads_recovered':('histogram', 'Reads recovered from the BWT for one dataset section of a page', READ_BUCKETS)}
+
+#(metric name, sorted label tuple) -> value; a histogram value is [count in each bucket..., count above the last bucket, sum, count]
+values = {}
+valuesLock = threading.Lock()
+
+#the process the values belong to; a forked process starts over so its parent's values aren't counted twice
+ownerPid = None
+
+#if False, nothing is recorded; "serve.py" turns this off in its parent, which only loads datasets before forking and should
+#not start a flush thread that the server processes would inherit
+recording = True
+
+def resetAfterFork():
+    '''
+    Drops the values and lock a forked process inherits; the lock may have been held by another thread of the parent when it
+    forked, so the child gets a new one
+    '''
+    global valuesLock, ownerPid, recording
+    valuesLock = threading.Lock()
+    values.clear()
+    ownerPid = None
+    recording = True
+
+def checkOwner():
+    '''
+    Resets the values and starts the flush thread the first time this process records something; call with valuesLock held
+    '''
+    global ownerPid
+    if ownerPid == os.getpid():
+        return
+    ownerPid = os.getpid()
+    values.clear()
+    if msSharedUtil.metricsDirectory != None:
+        t = threading.Thread(target=flushLoop, name="serverMetrics")
+        t.daemon = True
+        t.start()
+
+def increment(name, amount=1, **labels):
+    '''
+    Adds to a counter or gauge
+    @param name - the metric name from METRICS
+    @param amount - the amount to add, negative values are only allowed for gauges
+    @param labels - the label values for this series
+    '''
+    if not recording:
+        return
+    key = (name, tuple(sorted(labels.iteritems())))
+    with valuesLock:
+        checkOwner()
+        values[key] = values.get(key, 0)+amount
+
+def observe(name, value, **labels):
+    '''
+    Adds a value to a histogram
+    @param name - the metric name from METRICS
+    @param value - the observed value
+    @param labels - the label values for this series
+    '''
+    if not recording:
+        return
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.iteritems())))
+    with valuesLock:
+        checkOwner()
+        current = values.get(key, None)
+        if current == None:
+            current = [0]*(len(buckets)+3)
+            values[key] = current
+        current[bisect.bisect_left(buckets, value)] += 1
+        current[-2] += value
+        current[-1] += 1
+
+def getSnapshot():
+    '''
+    @return - a list of [name, labels, value] for every series in this process, the labels are a list of [label, value] pairs
+    '''
+    with valuesLock:
+        checkOwner()
+        return [[name, [list(pair) for pair in labels], list(value) if isinstance(value, list) else value]
+                for (name, labels), value in values.iteritems()]
+
+def flushLoop():
+    '''
+    The body of the background thread, writes this process's values to "metricsDirectory" every "metricsFlushSeconds"
+    '''
+    while True:
+        time.sleep(msSharedUtil.metricsFlushSeconds)
+        try:
+            flush()
+        except (IOError, OSError):
+            #a full or missing disk shouldn't kill the thread; the next flush will try again
+            pass
+
+def flush():
+    '''
+    Writes this process's values to "metricsDirectory"
+    '''
+    if not os.path.exists(msSharedUtil.metricsDirectory):
+        os.makedirs(msSharedUtil.metricsDirectory)
+    metricsFN = '%s/%d.json' % (msSharedUtil.metricsDirectory, os.getpid())
+    tempFN = metricsFN+'.tmp'
+    with open(tempFN, 'w') as fp:
+        json.dump(getSnapshot(), fp)
+    os.rename(tempFN, metricsFN)
+
+def isRunning(pid):
+    '''
+    @param pid - a process ID
+    @return - True if that process is still running
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def collect():
+    '''
+    Adds up the values of this process and every other running process that has written them
+    @return - a dictionary from (metric name, label tuple) to the total value
+    '''
+    snapshots = [getSnapshot()]
+    if msSharedUtil.metricsDirectory != None:
+        for metricsFN in glob.glob(msSharedUtil.metricsDirectory+'/*.json'):
+            pid = int(os.path.basename(metricsFN)[0:-5])
+            if pid == os.getpid():
+                continue
+            if not isRunning(pid):
+                #the values of a process that has exited are dropped, like they would be for a single restarted process
+                try:
+                    os.remove(metricsFN)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(metricsFN, 'r') as fp:
+                    snapshots.append(json.load(fp))
+            except (IOError, ValueError):
+                continue
+
+    ret = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            key = (name, tuple([tuple(pair) for pair in labels]))
+            if isinstance(value, list):
+                current = ret.setdefault(key, [0]*len(value))
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                ret[key] = ret.get(key, 0)+value
+    return ret
+
+def formatLabels(labels, extra=[]):
+    '''
+    @param labels - a tuple of (label, value) pairs
+    @param extra - more (label, value) pairs to add at the end
+    @return - the label part of a Prometheus sample, such as '{route="/massQuery"}'
+    '''
+    pairs = list(labels)+extra
+    if len(pairs) == 0:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{'+','.join(['%s="%s"' % pair for pair in escaped])+'}'
+
+def formatNumber(value):
+    '''
+    @param value - an int or float
+    @return - the value as Prometheus expects it
+    '''
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def render():
+    '''
+    @return - every metric in the Prometheus text format
+    '''
+    totals = collect()
+    lines = []
+    for name in sorted(METRICS.keys()):
+        metricType, helpText, buckets = METRICS[name]
+        lines.append('# HELP %s %s' % (name, helpText))
+        lines.append('# TYPE %s %s' % (name, metricType))
+        for (seriesName, labels), value in sorted(totals.iteritems()):
+            if seriesName != name:
+                continue
+            if metricType == 'histogram':
+                #the buckets are stored separately and reported as running totals
+                cumulative = 0
+                for i, bound in enumerate(buckets):
+                    cumulative += value[i]
+                    lines.append('%s_bucket%s %d' % (name, formatLabels(labels, [('le', formatNumber(bound))]), cumulative))
+                lines.append('%s_bucket%s %d' % (name, formatLabels(labels, [('le', '+Inf')]), value[-1]))
+                lines.append('%s_sum%s %s' % (name, formatLabels(labels), formatNumber(value[-2])))
+                lines.append('%s_count%s %d' % (name, formatLabels(labels), value[-1]))
+            else:
+                lines.append('%s%s %s' % (name, formatLabels(labels), formatNumber(value)))
+    return '\n'.join(lines)+'\n'
@@ -0,0 +1,433 @@
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains the worker processes used to count k-mers in many datasets at once.  Each worker is its own single process
+pool and a dataset is always sent to the same worker, so that worker keeps the BWT open in its own registry between requests.
+Counts go through the shared count cache, so k-mers that have been counted before don't need the BWT at all.  The number of
+workers and the number of datasets a single request may have in flight are set in msSharedUtil.  The same workers also build the
+per-dataset sections of the "msCompare" and "msAllele" pages.  Each task is timed in the worker (see "requestTiming") and its
+phases are added to the request that sent it; if that request is being profiled (see "requestProfiler"), so is the task.
+A page section has a time limit that starts when a worker starts running it, and a section that goes over is stopped by killing
+its worker, which the pool replaces right away; this way a slow dataset doesn't hold up the tasks waiting behind it.  Since the
+workers are shared with Batch Query and jobs, a section that has waited that long for its worker to finish other kinds of work
+is skipped.  With no workers, the sections run in the request thread and their time limit is only checked between steps (see
+checkSectionTime()).
+'''
+
+import collections
+import itertools
+import multiprocessing
+import os
+import Queue
+import signal
+import threading
+import time
+import traceback
+import zlib
+
+import countCache
+import msSharedUtil
+import queryPanels
+import requestProfiler
+import requestTiming
+import serverMetrics
+
+workers = None
+workersLock = threading.Lock()
+
+#for each worker, the shared state of the page section it is running (see runTracked(...)) and the lock that guards it
+workerStates = None
+
+#IDs for the page section tasks, 0 means no task
+taskIDs = itertools.count(1)
+
+#the number of skipped page sections each worker remembers (see checkTask(...)), a skipped section that is forgotten before the
+#worker reaches it still runs but nothing waits for its result
+CANCEL_SLOTS = 64
+
+#how often (in seconds) mapDatasets(...) checks whether its sections have started or gone over their time limit
+POLL_SECONDS = 0.05
+
+#set inside each worker process by initWorker(...)
+taskState = None
+taskLock = None
+
+#the time limit of the page section running in this thread, when mapDatasets(...) runs the sections itself
+sectionLocal = threading.local()
+
+class SectionTimeout(Exception):
+    '''
+    Raised by checkSectionTime() when a page section running in the request thread has gone over its time limit
+    '''
+    pass
+
+def getWorkers():
+    '''
+    Starts the worker processes the first time they are needed
+    @return - a list of single process pools, one per worker
+    '''
+    global workers, workerStates
+    with workersLock:
+        if workers == None:
+            workerStates = [createState() for x in xrange(0, msSharedUtil.batchWorkers)]
+            workers = [multiprocessing.Pool(1, initWorker, workerStates[x]) for x in xrange(0, msSharedUtil.batchWorkers)]
+    return workers
+
+def createState():
+    '''
+    @return - a tuple (state, lock) shared with a worker, where the state is [task ID, start time, process ID] of the page section
+        the worker is running followed by CANCEL_SLOTS IDs of skipped sections, each one in the slot (task ID % CANCEL_SLOTS)
+    '''
+    return (multiprocessing.RawArray('d', 3+CANCEL_SLOTS), multiprocessing.Lock())
+
+def initWorker(state, lock):
+    '''
+    Runs when a worker process starts, including when one is started to replace a worker that was stopped
+    @param state - the worker's shared state from createState()
+    @param lock - the lock that guards "state"
+    '''
+    global taskState, taskLock
+    #the workers may be forked during a profiled request (or while another thread records a metric), so they drop the profiler
+    #and metrics they inherit
+    requestProfiler.resetAfterFork()
+    serverMetrics.resetAfterFork()
+    taskState = state
+    taskLock = lock
+
+def getWorkerIndex(dataset, numWorkers):
+    '''
+    @param dataset - the dataset ID
+    @param numWorkers - the number of workers available
+    @return - the index of the worker that owns this dataset
+    '''
+    return (zlib.crc32(dataset) & 0xffffffff) % numWorkers
+
+def runTimed(function, args, profileMode):
+    '''
+    Runs a task inside a worker with its own timing breakdown (and profile), so they can be sent back to the request that sent it
+    @param function - a module level function
+    @param args - a tuple with the arguments to "function"
+    @param profileMode - the profiling mode of the request that sent the task, None if it isn't being profiled
+    @return - a tuple (result, phases, profile data) where the phases are from requestTiming.getPhases() and the profile data is
+        from requestProfiler.getProfileData(...)
+    '''
+    phases = requestTiming.start()
+    session = requestProfiler.start('worker', profileMode) if profileMode != None else None
+    try:
+        result = function(*args)
+    finally:
+        requestProfiler.stop(session)
+        requestTiming.finish(phases)
+    return (result, phases if phases != None else {}, requestProfiler.getProfileData(session))
+
+def runTracked(taskID, function, args, profileMode):
+    '''
+    Runs a page section with runTimed(...), recording in the worker's shared state that it is running so the sender knows when
+    its time limit starts and which process to stop if it goes over
+    @param taskID - the ID the sender gave this task
+    @param function - a module level function
+    @param args - a tuple with the arguments to "function"
+    @param profileMode - the profiling mode of the request that sent the task, None if it isn't being profiled
+    @return - the value returned by runTimed(...), or None if the sender skipped the task before it started
+    '''
+    with taskLock:
+        if taskState[3+taskID % CANCEL_SLOTS] == taskID:
+            return None
+        taskState[0] = taskID
+        taskState[1] = time.time()
+        taskState[2] = os.getpid()
+    try:
+        return runTimed(function, args, profileMode)
+    finally:
+        with taskLock:
+            taskState[0] = 0
+
+def stopTask(state, taskID):
+    '''
+    Stops a task by killing the worker running it; the worker's pool starts a new worker for the tasks waiting behind it
+    @param state - a tuple (state, lock) from createState()
+    @param taskID - the ID of a task sent to that worker
+    '''
+    values, lock = state
+    with lock:
+        #the worker clears its state under the same lock before it sends a result, so it can't be stopped in the middle of that
+        if values[0] == taskID:
+            try:
+                os.kill(int(values[2]), signal.SIGKILL)
+            except OSError:
+                pass
+            values[0] = 0
+
+def mergeTaskInfo(phases, profileData):
+    '''
+    Adds the timing breakdown and profile of a finished task to the request in this thread
+    @param phases - the phases from runTimed(...)
+    @param profileData - the profile data from runTimed(...)
+    '''
+    requestTiming.mergePhases(phases)
+    requestProfiler.mergeProfileData(profileData)
+
+def countDataset(dataset, kmers, forward, revComp):
+    '''
+    Counts all of the k-mers in a single dataset, this is what runs inside the workers
+    @param dataset - the dataset ID to query against
+    @param kmers - the list of k-mers to count
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - a tuple (dataset, forward counts, reverse-complement counts, error message); on failure the counts are None and
+        the error message holds the traceback from the worker
+    '''
+    try:
+        forwardResults, rcResults = countCache.countKmerStrands(dataset, kmers, forward, revComp)
+        return (dataset, forwardResults, rcResults, None)
+    except Exception:
+        return (dataset, None, None, traceback.format_exc())
+
+def countPanelDataset(dataset, panelID, forward, revComp):
+    '''
+    Counts a registered panel in a single dataset, this is what runs inside the workers; the panel is loaded from disk the first
+    time a worker needs it
+    @param dataset - the dataset ID to query against
+    @param panelID - the ID from queryPanels.registerPanel(...)
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - see countDataset(...)
+    '''
+    try:
+        panel = queryPanels.getPanel(panelID)
+        if panel == None:
+            raise KeyError('Unknown panel: '+str(panelID))
+        forwardResults, rcResults = queryPanels.countPanel(dataset, panel, forward, revComp)
+        return (dataset, forwardResults, rcResults, None)
+    except Exception:
+        return (dataset, None, None, traceback.format_exc())
+
+def countDatasets(datasets, kmers, forward, revComp):
+    '''
+    Counts the k-mers in every dataset, spreading the datasets across the workers
+    @param datasets - the list of dataset IDs to query against
+    @param kmers - the list of k-mers to count
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - a generator of tuples (dataset, forward counts, reverse-complement counts) in the order they finish
+    '''
+    kmers = [str(kmer) for kmer in kmers]
+    return dispatchCounts(countDataset, datasets, (kmers, forward, revComp))
+
+def countPanelDatasets(datasets, panelID, forward, revComp):
+    '''
+    Counts a registered panel in every dataset, spreading the datasets across the workers; only the panel ID is sent to them
+    @param datasets - the list of dataset IDs to query against
+    @param panelID - the ID from queryPanels.registerPanel(...)
+    @param forward - if True, the forward counts are calculated
+    @param revComp - if True, the reverse-complement counts are calculated
+    @return - a generator of tuples (dataset, forward counts, reverse-complement counts) in the order they finish
+    '''
+    return dispatchCounts(countPanelDataset, datasets, (panelID, forward, revComp))
+
+def dispatchCounts(function, datasets, args):
+    '''
+    The scheduling shared by countDatasets(...) and countPanelDatasets(...)
+    @param function - either countDataset or countPanelDataset
+    @param datasets - the list of dataset IDs to query against
+    @param args - a tuple with the rest of the arguments to "function"
+    @return - a generator of tuples (dataset, forward counts, reverse-complement counts) in the order they finish
+    '''
+    if msSharedUtil.batchWorkers <= 0:
+        #no workers configured, count everything in this thread
+        for dataset in datasets:
+            dataset, forwardResults, rcResults, error = function(dataset, *args)
+            if error != None:
+                raise RuntimeError('Counting failed on dataset %s:\n%s' % (dataset, error))
+            yield (dataset, forwardResults, rcResults)
+        return
+
+    pools = getWorkers()
+    profileMode = requestProfiler.getMode()
+    finished = Queue.Queue()
+    limit = max(1, msSharedUtil.batchRequestConcurrency)
+    pending = 0
+    nextIndex = 0
+
+    while nextIndex < len(datasets) or pending > 0:
+        #keep at most "limit" datasets from this request in flight
+        while nextIndex < len(datasets) and pending < limit:
+            dataset = datasets[nextIndex]
+            pool = pools[getWorkerIndex(dataset, len(pools))]
+            pool.apply_async(runTimed, (function, (dataset, )+args, profileMode), callback=finished.put)
+            nextIndex += 1
+            pending += 1
+
+        #the timeout keeps the wait interruptible
+        (dataset, forwardResults, rcResults, error), phases, profileData = finished.get(True, 3600)
+        pending -= 1
+        mergeTaskInfo(phases, profileData)
+        if error != None:
+            raise RuntimeError('Worker failed on dataset %s:\n%s' % (dataset, error))
+        yield (dataset, forwardResults, rcResults)
+
+def runDatasetTask(function, dataset, args):
+    '''
+    Runs a per-dataset function and catches any failure, this is what runs inside the workers for mapDatasets(...)
+    @param function - a module level function that takes the dataset followed by "args"
+    @param dataset - the dataset ID
+    @param args - a tuple with the rest of the arguments
+    @return - a tuple (result, error message); on failure the result is None and the error message holds the traceback
+    '''
+    try:
+        return (function(dataset, *args), None)
+    except Exception:
+        return (None, traceback.format_exc())
+
+def checkSectionTime():
+    '''
+    Called by a page section between its steps; when the section is running in the request thread (no workers configured) and
+    has gone over its time limit, this raises SectionTimeout so it stops there, otherwise it does nothing
+    '''
+    deadline = getattr(sectionLocal, 'deadline', None)
+    if deadline != None and time.time() >= deadline:
+        raise SectionTimeout()
+
+def mapDatasets(function, datasets, args, timeout):
+    '''
+    Calls function(dataset, *args) for every dataset on the worker that owns that dataset, with at most
+    msSharedUtil.pageRequestConcurrency datasets from this request in flight at once; with no workers configured, the datasets
+    are run one at a time in this thread
+    @param function - a module level function that takes the dataset followed by "args"; the result must be picklable
+    @param datasets - the list of dataset IDs
+    @param args - a tuple with the rest of the arguments
+    @param timeout - the number of seconds each dataset has to finish, counted from when a worker starts running it; a dataset
+        that goes over is stopped, and a dataset that has waited this long behind other kinds of work is skipped; in this
+        thread, the limit is only checked when the function calls checkSectionTime()
+    @return - a generator of tuples (dataset, result) in the same order as "datasets"; the result is None if the dataset
+        didn't finish in time
+    '''
+    if msSharedUtil.batchWorkers <= 0:
+        #no workers configured, the sections use this process's open BWTs and stop at their next check once they go over
+        for dataset in datasets:
+            sectionLocal.deadline = time.time()+timeout
+            try:
+                result = function(dataset, *args)
+            except SectionTimeout:
+                result = None
+            finally:
+                sectionLocal.deadline = None
+            yield (dataset, result)
+        return
+
+    profileMode = requestProfiler.getMode()
+
+    pools = getWorkers()
+    limit = max(1, msSharedUtil.pageRequestConcurrency)
+    pending = collections.deque()
+    nextIndex = 0
+
+    while nextIndex < len(datasets) or len(pending) > 0:
+        #keep at most "limit" datasets from this request in flight
+        while nextIndex < len(datasets) and len(pending) < limit:
+            dataset = datasets[nextIndex]
+            workerIndex = getWorkerIndex(dataset, len(pools))
+            pending.append(startTask(pools[workerIndex], workerStates[workerIndex], function, dataset, args, profileMode))
+            nextIndex += 1
+
+        #results go out in order, but every section in flight is checked so one that goes over its limit is stopped right away
+        task = pending[0]
+        while not checkTask(task, timeout):
+            for otherTask in itertools.islice(pending, 1, None):
+                checkTask(otherTask, timeout)
+            task['asyncResult'].wait(POLL_SECONDS)
+        pending.popleft()
+        yield (task['dataset'], finishTask(task))
+
+def startTask(pool, state, function, dataset, args, profileMode):
+    '''
+    Sends a page section to a worker
+    @param pool - the worker's pool
+    @param state - the worker's shared state from createState()
+    @param function - a module level function that takes the dataset followed by "args"
+    @param dataset - the dataset ID
+    @param args - a tuple with the rest of the arguments
+    @param profileMode - the profiling mode of the request, None if it isn't being profiled
+    @return - a dictionary describing the task for checkTask(...) and finishTask(...)
+    '''
+    taskID = next(taskIDs)
+    asyncResult = pool.apply_async(runTracked, (taskID, runDatasetTask, (function, dataset, args), profileMode))
+    return {'dataset':dataset, 'state':state, 'taskID':taskID, 'asyncResult':asyncResult, 'deadline':None, 'stopped':False,
+            'queuedSeconds':0.0, 'lastCheck':time.time()}
+
+def checkTask(task, timeout):
+    '''
+    Starts the time limit of a page section once its worker starts running it, and stops the section if it goes over; a
+    section that is still waiting for its worker is skipped once it has spent as long waiting behind other kinds of work (Batch
+    Query counts and jobs), waiting behind other page sections doesn't count since they have limits of their own
+    @param task - the value returned by startTask(...)
+    @param timeout - the number of seconds the section has to finish once it starts
+    @return - True if the section has finished or was stopped
+    '''
+    if task['stopped'] or task['asyncResult'].ready():
+        return True
+    if task['deadline'] == None:
+        values, lock = task['state']
+        now = time.time()
+        with lock:
+            if values[0] == task['taskID']:
+                task['deadline'] = values[1]+timeout
+            else:
+                if values[0] == 0:
+                    task['queuedSeconds'] += now-task['lastCheck']
+                if task['queuedSeconds'] >= timeout:
+                    #the worker checks this under the same lock before it starts the section, so it will skip it
+                    values[3+task['taskID'] % CANCEL_SLOTS] = task['taskID']
+                    task['stopped'] = True
+        task['lastCheck'] = now
+        if task['stopped']:
+            return True
+    if task['deadline'] != None and time.time() >= task['deadline']:
+        stopTask(task['state'], task['taskID'])
+        task['stopped'] = True
+        return True
+    return False
+
+def finishTask(task):
+    '''
+    @param task - a finished or stopped task from startTask(...)
+    @return - the result of the section, or None if it was stopped
+    '''
+    if task['stopped']:
+        return None
+    taskResult = task['asyncResult'].get()
+    if taskResult == None:
+        return None
+    (result, error), phases, profileData = taskResult
+    mergeTaskInfo(phases, profileData)
+    if error != None:
+        raise RuntimeError('Worker failed on dataset %s:\n%s' % (task['dataset'], error))
+    return result
+
+def callOwners(function, datasets, timeout):
+    '''
+    Calls function(owned datasets) once on every worker, where the owned datasets are the ones from "datasets" that the worker
+    handles; with no workers configured, it is called once in this thread with every dataset
+    @param function - a module level function that takes a list of dataset IDs; the result must be picklable
+    @param datasets - the list of dataset IDs
+    @param timeout - the number of seconds the workers have to finish, all together
+    @return - a list with the result from each worker (in worker order, see getWorkerIndex(...)), None for a worker that didn't
+        finish in time
+    '''
+    if msSharedUtil.batchWorkers <= 0:
+        return [function(datasets)]
+
+    pools = getWorkers()
+    owned = [[] for pool in pools]
+    for dataset in datasets:
+        owned[getWorkerIndex(dataset, len(pools))].append(dataset)
+
+    asyncResults = [pool.apply_async(function, (owned[x], )) for x, pool in enumerate(pools)]
+    deadline = time.time()+timeout
+    ret = []
+    for asyncResult in asyncResults:
+        try:
+            ret.append(asyncResult.get(max(0, deadline-time.time())))
+        except multiprocessing.TimeoutError:
+            ret.append(None)
+    return ret
@@ -5,14 +5,18 @@ This file contains the server-side layout of all tools that Flask will use for a
 '''
 
 from flask import Flask
+from flask import g
 from flask import jsonify
 from flask import request
 from flask import Response
+from flask import stream_with_context
 
 from MUS import util
 from MUSCython import MultiStringBWTCython as MSBWT
 
 import locale
+import os
+import time
 locale.setlocale(locale.LC_ALL, 'en_US')
 import markup
 from markup import oneliner as element
@@ -22,6 +26,102 @@ VERSION = "0.1.0"
 # EB looks for an 'application' callable by default.
 application = Flask(__name__)
 
+#scan the dataset directories once up front; the catalog keeps itself up to date after this
+from MsbwtPages import datasetCatalog
+datasetCatalog.start()
+
+#pick up any batch query jobs that were interrupted when the server last stopped
+from MsbwtPages import jobQueue
+jobQueue.start()
+
+@application.before_request
+def startRequestMetrics():
+    from MsbwtPages import requestTiming
+    from MsbwtPages import serverMetrics
+    route = request.url_rule.rule if request.url_rule != None else 'unmatched'
+    serverMetrics.increment('msbwt_requests_in_flight', 1, route=route)
+    g.requestMetrics = {'route':route, 'method':request.method, 'path':request.path, 'start':time.time(),
+                        'phases':requestTiming.start(), 'finished':False}
+
+def finishRequestMetrics(requestMetrics, status):
+    '''
+    Records the latency and the timing breakdown of a request once its whole response has been sent
+    @param requestMetrics - the dictionary saved by startRequestMetrics()
+    @param status - the response status code
+    '''
+    from MsbwtPages import requestTiming
+    from MsbwtPages import serverMetrics
+    if requestMetrics['finished']:
+        return
+    requestMetrics['finished'] = True
+    route = requestMetrics['route']
+    totalSeconds = time.time()-requestMetrics['start']
+    serverMetrics.increment('msbwt_requests_in_flight', -1, route=route)
+    serverMetrics.increment('msbwt_responses_total', 1, route=route, status=str(status))
+    serverMetrics.observe('msbwt_request_duration_seconds', totalSeconds, route=route)
+
+    phases = requestMetrics['phases']
+    requestTiming.finish(phases)
+    if phases != None:
+        requestTiming.logRequest(requestMetrics['method'], requestMetrics['path'], route, status, totalSeconds, phases)
+
+    session = requestMetrics.get('profile', None)
+    if session != None:
+        from MsbwtPages import requestProfiler
+        requestProfiler.stop(session)
+        requestProfiler.save(session)
+
+@application.before_request
+def startRequestProfile():
+    #this runs after startRequestMetrics(), so the profile is stopped and saved along with the metrics
+    from MsbwtPages import msSharedUtil
+    from MsbwtPages import requestProfiler
+    profileMode = request.headers.get("X-Profile")
+    if profileMode == None:
+        return None
+    if msSharedUtil.profileDirectory == None:
+        return Response("Profiling is turned off", status=404)
+    if not isAdminRequest():
+        return Response("Forbidden", status=403)
+    if profileMode not in requestProfiler.PROFILE_MODES:
+        return Response("X-Profile must be one of: "+', '.join(requestProfiler.PROFILE_MODES), status=400)
+    requestID = requestProfiler.getRequestID(request.headers.get("X-Request-ID"))
+    g.requestMetrics['profile'] = requestProfiler.start(requestID, profileMode)
+
+@application.after_request
+def addRequestMetrics(response):
+    #streamed responses are still being generated here, so the request is finished when the response is closed
+    from MsbwtPages import requestTiming
+    requestMetrics = g.get('requestMetrics', None)
+    if requestMetrics != None:
+        status = response.status_code
+        response.call_on_close(lambda: finishRequestMetrics(requestMetrics, status))
+        if requestMetrics.get('profile', None) != None:
+            response.headers['X-Profile-ID'] = requestMetrics['profile']['requestID']
+        if requestMetrics['phases'] != None:
+            #for a streamed response, this only has the phases finished before the first byte; the log line has all of them
+            response.headers['Server-Timing'] = requestTiming.formatHeader(requestMetrics['phases'], time.time()-requestMetrics['start'])
+    return response
+
+@application.teardown_request
+def failRequestMetrics(error):
+    #only requests that raised before a response was made are still open here
+    requestMetrics = g.get('requestMetrics', None)
+    if error != None and requestMetrics != None:
+        finishRequestMetrics(requestMetrics, 500)
+
+def isAdminRequest():
+    '''
+    Checks whether the current request is allowed to use the admin endpoints.  If "adminToken" is set in msSharedUtil, the
+    request must provide it in an "X-Admin-Token" header or a "token" field; otherwise only local requests are allowed.
+    @return - True if the request is allowed
+    '''
+    from MsbwtPages import msSharedUtil
+    if msSharedUtil.adminToken == None:
+        return request.remote_addr in ('127.0.0.1', '::1')
+    token = request.headers.get("X-Admin-Token", request.values.get("token"))
+    return token == msSharedUtil.adminToken
+
 def addTitleToPage(content):
     '''
     This useful function creates a title and wraps it around the actual contents generated by the various tools.  This is
@@ -91,6 +191,36 @@ def addTitleToPage(content):
     
     return str(page)
 
+#stands in for the contents when the title page is split around a streamed response
+CONTENT_MARKER = '<!--content-->'
+
+def streamTitlePage(contentChunks):
+    '''
+    The streaming version of addTitleToPage(...), the title and menus are sent before the contents are generated and the
+    contents are sent one piece at a time
+    @param contentChunks - a generator of strings for the actual content
+    @return - a generator of strings for Flask to stream
+    '''
+    header, footer = addTitleToPage(CONTENT_MARKER).split(CONTENT_MARKER)
+    yield header
+    for chunk in contentChunks:
+        yield chunk+'\n'
+    yield footer
+
+def getReadPage():
+    '''
+    @return - the page of reads asked for in the "page" form field starting from 0, None if no page was asked for, or -1 if the
+        field isn't a page number
+    '''
+    page = request.form.get("page")
+    if not page:
+        return None
+    try:
+        page = int(page)
+    except ValueError:
+        return -1
+    return page-1 if page >= 1 else -1
+
 @application.route('/')
 def msHomeCaller():
     from MsbwtPages import msHome
@@ -104,7 +234,11 @@ def msCompareCaller():
     elif request.method == 'POST':
         datasets = request.form.getlist("dataset")
         pattern = request.form.get("pattern")
-        return addTitleToPage(msCompare.POST(datasets, pattern))
+        page = getReadPage()
+        if page == -1:
+            return Response("page must be a positive integer", status=400)
+        sample = (request.form.get("sample") == "true")
+        return Response(stream_with_context(streamTitlePage(msCompare.streamPOST(datasets, pattern, page, sample))), mimetype="text/html")
 
 @application.route('/msAllele', methods=['GET', 'POST'])
 def msAlleleCaller():
@@ -114,7 +248,11 @@ def msAlleleCaller():
     elif request.method == 'POST':
         datasets = request.form.getlist("dataset")
         pattern = request.form.get("pattern")
-        return addTitleToPage(msAllele.POST(datasets, pattern))
+        page = getReadPage()
+        if page == -1:
+            return Response("page must be a positive integer", status=400)
+        sample = (request.form.get("sample") == "true")
+        return Response(stream_with_context(streamTitlePage(msAllele.streamPOST(datasets, pattern, page, sample))), mimetype="text/html")
 
 @application.route('/msTarget', methods=['GET'])
 def msTargetCaller():
@@ -129,6 +267,16 @@ def followPathCaller():
     kmerThreshold = int(request.form.get("kmerThreshold"))
     return Response(followPath.getPath(dataset, kmer, kmerThreshold), mimetype="application/json")
 
+@application.route('/exploreGraph', methods=['POST'])
+def exploreGraphCaller():
+    from MsbwtPages import followPath
+    dataset = str(request.form.get("dataset"))
+    kmer = str(request.form.get("kmerText"))
+    kmerThreshold = int(request.form.get("kmerThreshold"))
+    maxNodes = int(request.form.get("maxNodes", 500))
+    maxDepth = int(request.form.get("maxDepth", 100))
+    return Response(followPath.exploreGraph(dataset, kmer, kmerThreshold, maxNodes, maxDepth), mimetype="application/json")
+
 @application.route('/msMassQuery')
 def msMassQueryCaller():
     from MsbwtPages import msMassQuery
@@ -136,11 +284,31 @@ def msMassQueryCaller():
 
 @application.route('/massQuery', methods=['POST'])
 def massQueryCaller():
+    from MsbwtPages import binaryProtocol
     from MsbwtPages import massQuery
+    if request.mimetype == binaryProtocol.REQUEST_TYPE:
+        try:
+            datasets, kmerQueries, forward, revComp = binaryProtocol.decodeRequest(request.get_data())
+        except ValueError as e:
+            return Response(str(e), status=400)
+        if len(datasets) != 1:
+            return Response("Mass Query takes exactly one dataset", status=400)
+        return Response(massQuery.getBinaryMassQueryResults(datasets[0], kmerQueries, forward, revComp), mimetype=binaryProtocol.RESPONSE_TYPE)
     dataset = str(request.form.get("dataset"))
     jsonQueries = str(request.form.get("kmerQueries"))
     forward = str(request.form.get("forwardEnabled"))
     revComp = str(request.form.get("revCompEnabled"))
+    if request.form.get("panelID") != None:
+        from MsbwtPages import queryPanels
+        panel = queryPanels.getPanel(request.form.get("panelID"))
+        if panel == None:
+            return Response("Unknown panel", status=404)
+        if request.form.get("stream") == "true":
+            start = int(request.form.get("start", 0))
+            return Response(stream_with_context(massQuery.streamPanelMassQueryResults(dataset, panel, start, forward, revComp)), mimetype="application/x-ndjson")
+        return Response(massQuery.getPanelMassQueryResults(dataset, panel, forward, revComp), mimetype="application/json")
+    if request.form.get("stream") == "true":
+        return Response(stream_with_context(massQuery.streamMassQueryResults(dataset, jsonQueries, forward, revComp)), mimetype="application/x-ndjson")
     return Response(massQuery.getMassQueryResults(dataset, jsonQueries, forward, revComp), mimetype="application/json")
 
 @application.route('/msBatchQuery')
@@ -150,21 +318,118 @@ def msBatchQueryCaller():
 
 @application.route('/batchQuery', methods=['POST'])
 def batchQueryCaller():
+    from MsbwtPages import binaryProtocol
     from MsbwtPages import batchQuery
+    if request.mimetype == binaryProtocol.REQUEST_TYPE:
+        try:
+            datasets, kmerQueries, forward, revComp = binaryProtocol.decodeRequest(request.get_data())
+        except ValueError as e:
+            return Response(str(e), status=400)
+        return Response(stream_with_context(batchQuery.streamBinaryBatchQueryResults(datasets, kmerQueries, forward, revComp)), mimetype=binaryProtocol.RESPONSE_TYPE)
     datasets = str(request.form.get("datasets"))
     jsonQueries = str(request.form.get("kmerQueries"))
     forward = str(request.form.get("forwardEnabled"))
     revComp = str(request.form.get("revCompEnabled"))
+    if request.form.get("panelID") != None:
+        from MsbwtPages import queryPanels
+        panelID = str(request.form.get("panelID"))
+        if queryPanels.getPanel(panelID) == None:
+            return Response("Unknown panel", status=404)
+        if request.form.get("stream") == "true":
+            return Response(stream_with_context(batchQuery.streamPanelBatchQueryResults(datasets, panelID, forward, revComp)), mimetype="application/x-ndjson")
+        return Response(batchQuery.getPanelBatchQueryResults(datasets, panelID, forward, revComp), mimetype="application/json")
+    if request.form.get("stream") == "true":
+        return Response(stream_with_context(batchQuery.streamBatchQueryResults(datasets, jsonQueries, forward, revComp)), mimetype="application/x-ndjson")
     return Response(batchQuery.getBatchQueryResults(datasets, jsonQueries, forward, revComp), mimetype="application/json")
 
+@application.route('/panel', methods=['POST'])
+def panelRegisterCaller():
+    from MsbwtPages import queryPanels
+    if 'file' in request.files:
+        text = request.files['file'].read()
+    else:
+        text = str(request.form.get("kmers", ""))
+    try:
+        kmers = queryPanels.parsePanel(text, str(request.form.get("format", "text")), int(request.form.get("column", 1)),
+                                       request.form.get("headerPresent") == "true", str(request.form.get("delimiter", ",")))
+        return jsonify(queryPanels.registerPanel(kmers))
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+@application.route('/panel/<panelID>', methods=['GET'])
+def panelInfoCaller(panelID):
+    from MsbwtPages import queryPanels
+    panel = queryPanels.getPanel(panelID)
+    if panel == None:
+        return Response("Unknown panel", status=404)
+    return jsonify(queryPanels.getSummary(panel))
+
+@application.route('/batchJob', methods=['POST'])
+def batchJobSubmitCaller():
+    from MsbwtPages import jobQueue
+    datasets = str(request.form.get("datasets"))
+    jsonQueries = str(request.form.get("kmerQueries"))
+    forward = str(request.form.get("forwardEnabled"))
+    revComp = str(request.form.get("revCompEnabled"))
+    return jsonify({"jobID":jobQueue.submitJob(datasets, jsonQueries, forward, revComp)})
+
+@application.route('/batchJob/<jobID>', methods=['GET'])
+def batchJobStatusCaller(jobID):
+    from MsbwtPages import jobQueue
+    status = jobQueue.getStatus(jobID)
+    if status == None:
+        return Response("Unknown job", status=404)
+    return jsonify(status)
+
+@application.route('/batchJob/<jobID>/result', methods=['GET'])
+def batchJobResultCaller(jobID):
+    from MsbwtPages import jobQueue
+    result = jobQueue.getResult(jobID)
+    if result == None:
+        return Response("Job is not finished", status=404)
+    return Response(result, mimetype="application/json")
+
 @application.route('/msHelp')
 def msHelpCaller():
     from MsbwtPages import msHelp
     return addTitleToPage(msHelp.GET())
+
+@application.route('/bwtCacheStats', methods=['GET'])
+def bwtCacheStatsCaller():
+    from MsbwtPages import bwtRegistry
+    return jsonify(bwtRegistry.getStats())
+
+@application.route('/bwtMemory', methods=['GET'])
+def bwtMemoryCaller():
+    from MsbwtPages import bwtMemory
+    if not isAdminRequest():
+        return Response("Forbidden", status=403)
+    return jsonify(bwtMemory.getMemoryReport())
+
+@application.route('/metrics', methods=['GET'])
+def metricsCaller():
+    from MsbwtPages import serverMetrics
+    return Response(serverMetrics.render(), mimetype="text/plain; version=0.0.4")
+
+@application.route('/countCacheStats', methods=['GET'])
+def countCacheStatsCaller():
+    from MsbwtPages import countCache
+    return jsonify(countCache.getStats())
+
+@application.route('/admin/reloadCatalog', methods=['POST'])
+def reloadCatalogCaller():
+    if not isAdminRequest():
+        return Response("Forbidden", status=403)
+    return jsonify(datasetCatalog.reload())
     
 # run the app.
 if __name__ == "__main__":
     # Setting debug to True enables debug output. This line should be
     # removed before deploying a production app.
     application.debug = True
+
+    #the reloader runs this file twice, only the process that serves requests needs the BWTs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from MsbwtPages import bwtMemory
+        bwtMemory.startup()
     application.run()
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file contains a benchmark for the query tools.  Synthetic k-mer panels and seeds are drawn from the reads in the configured
+datasets (the examples by default) and each tool is timed both by calling its handler directly and through the Flask test
+client.  The latency percentiles, throughput, and peak memory are written to a JSON file so two runs can be compared:
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json --compare before.json
+
+Everything runs locally; the count cache is turned off (unless --count-cache is given) so repeated runs measure the BWT.
+'''
+
+import argparse
+import json
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+from MsbwtPages import msSharedUtil
+
+BENCHMARKS = ['massQuery', 'batchQuery', 'followPath', 'msCompare', 'msAllele']
+MODES = ['direct', 'flask']
+
+def buildPanel(bwt, rng, numKmers, kmerSize):
+    '''
+    Builds a k-mer panel from a dataset; half of the k-mers are taken from random reads (a quarter of those are reverse-
+    complemented) and the other half are random sequences that are mostly absent
+    @param bwt - the BWT to draw reads from
+    @param rng - a random.Random instance so panels are the same between runs
+    @param numKmers - the number of k-mers in the panel
+    @param kmerSize - the length of each k-mer
+    @return - a list of k-mers
+    '''
+    ret = []
+    for x in xrange(0, numKmers):
+        if x % 2 == 0:
+            ret.append(getReadKmer(bwt, rng, kmerSize))
+            if x % 4 == 0:
+                ret[-1] = MSBWT.reverseComplement(ret[-1])
+        else:
+            ret.append(''.join([rng.choice('ACGT') for y in xrange(0, kmerSize)]))
+    return ret
+
+def getReadKmer(bwt, rng, kmerSize):
+    '''
+    @param bwt - the BWT to draw a read from
+    @param rng - a random.Random instance
+    @param kmerSize - the length of the k-mer
+    @return - a k-mer from a random position in a random read that only contains A, C, G, and T
+    '''
+    while True:
+        #the first rows of the BWT are the reads themselves starting from the '$'
+        read = bwt.recoverString(rng.randrange(0, bwt.getSymbolCount(0)))[1:]
+        if len(read) >= kmerSize:
+            start = rng.randrange(0, len(read)-kmerSize+1)
+            kmer = read[start:start+kmerSize]
+            if kmer.strip('ACGT') == '':
+                return kmer
+
+def getPeakRSS(pid=None):
+    '''
+    @param pid - the process to check, None for this process
+    @return - the peak resident set size in bytes, or None if it isn't available
+    '''
+    if pid == None:
+        #ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    try:
+        with open('/proc/%d/status' % pid) as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except IOError:
+        pass
+    return None
+
+def getWorkerPeakRSS():
+    '''
+    @return - the largest peak resident set size in bytes of the batch query workers, None if they haven't started
+    '''
+    from MsbwtPages import workerPool
+    if workerPool.workers == None:
+        return None
+    peaks = [getPeakRSS(p.pid) for pool in workerPool.workers for p in pool._pool]
+    peaks = [p for p in peaks if p != None]
+    return max(peaks) if len(peaks) > 0 else None
+
+def timeCalls(function, repeats):
+    '''
+    Calls a function once to warm up and then "repeats" more times
+    @param function - the function to time, it takes no arguments
+    @param repeats - the number of timed calls
+    @return - a list of latencies in seconds
+    '''
+    function()
+    latencies = []
+    for x in xrange(0, repeats):
+        start = time.time()
+        function()
+        latencies.append(time.time()-start)
+    return latencies
+
+def summarize(latencies, kmersPerCall):
+    '''
+    @param latencies - a list of latencies in seconds
+    @param kmersPerCall - the number of k-mers each call handles
+    @return - a dictionary of latency statistics in milliseconds and the throughput in k-mers per second
+    '''
+    latencies = np.array(latencies)
+    return {'calls':len(latencies),
+            'kmersPerCall':kmersPerCall,
+            'p50':float(np.percentile(latencies, 50)*1000),
+            'p95':float(np.percentile(latencies, 95)*1000),
+            'p99':float(np.percentile(latencies, 99)*1000),
+            'mean':float(np.mean(latencies)*1000),
+            'max':float(np.max(latencies)*1000),
+            'kmersPerSecond':float(kmersPerCall*len(latencies)/np.sum(latencies)) if np.sum(latencies) > 0 else 0.0}
+
+def buildCalls(benchmark, mode, client, groupDatasets, panel, seeds, threshold):
+    '''
+    @param benchmark - one of BENCHMARKS
+    @param mode - one of MODES
+    @param client - the Flask test client (only used in "flask" mode)
+    @param groupDatasets - the dataset IDs in the group being benchmarked
+    @param panel - the k-mer panel for the group
+    @param seeds - the seeds for the group
+    @param threshold - the threshold for followPath
+    @return - a tuple (function to time, number of k-mers per call)
+    '''
+    from MsbwtPages import batchQuery, followPath, massQuery, msAllele, msCompare
+
+    jsonPanel = json.dumps(panel)
+    jsonDatasets = json.dumps(groupDatasets)
+    seedIndex = [0]
+
+    def nextSeed():
+        seedIndex[0] = (seedIndex[0]+1) % len(seeds)
+        return seeds[seedIndex[0]]
+
+    def checkResponse(response):
+        if response.status_code != 200:
+            raise RuntimeError('%s returned %d' % (benchmark, response.status_code))
+        return response.get_data()
+
+    if benchmark == 'massQuery':
+        if mode == 'direct':
+            return (lambda: massQuery.getMassQueryResults(groupDatasets[0], jsonPanel, "true", "true"), len(panel))
+        return (lambda: checkResponse(client.post('/massQuery', data={'dataset':groupDatasets[0], 'kmerQueries':jsonPanel,
+                                                                       'forwardEnabled':'true', 'revCompEnabled':'true'})),
+                len(panel))
+    elif benchmark == 'batchQuery':
+        if mode == 'direct':
+            return (lambda: batchQuery.getBatchQueryResults(jsonDatasets, jsonPanel, "true", "true"), len(panel)*len(groupDatasets))
+        return (lambda: checkResponse(client.post('/batchQuery', data={'datasets':jsonDatasets, 'kmerQueries':jsonPanel,
+                                                                        'forwardEnabled':'true', 'revCompEnabled':'true'})),
+                len(panel)*len(groupDatasets))
+    elif benchmark == 'followPath':
+        if mode == 'direct':
+            return (lambda: followPath.getPath(groupDatasets[0], nextSeed(), threshold), 1)
+        return (lambda: checkResponse(client.post('/followPath', data={'dataset':groupDatasets[0], 'kmerText':nextSeed(),
+                                                                        'kmerThreshold':threshold})), 1)
+    elif benchmark == 'msCompare':
+        if mode == 'direct':
+            return (lambda: str(msCompare.POST(groupDatasets, nextSeed())), len(groupDatasets))
+        return (lambda: checkResponse(client.post('/msCompare', data={'dataset':groupDatasets, 'pattern':nextSeed()})),
+                len(groupDatasets))
+    elif benchmark == 'msAllele':
+        if mode == 'direct':
+            return (lambda: str(msAllele.POST(groupDatasets, nextSeed())), len(groupDatasets))
+        return (lambda: checkResponse(client.post('/msAllele', data={'dataset':groupDatasets, 'pattern':nextSeed()})),
+                len(groupDatasets))
+    raise ValueError('Unknown benchmark: '+benchmark)
+
+def runBenchmarks(args):
+    '''
+    @param args - the parsed command line arguments
+    @return - a dictionary with the settings and a list of results, ready to be saved as JSON
+    '''
+    from MsbwtPages import bwtRegistry, datasetCatalog
+
+    client = None
+    if 'flask' in args.modes:
+        import application
+        client = application.application.test_client()
+
+    datasetCatalog.ensureLoaded()
+    rng = random.Random(args.seed)
+    results = []
+    for j, groupLabel, entries in datasetCatalog.getGroups():
+        if len(entries) == 0:
+            continue
+        groupDatasets = [entry['id'] for entry in entries]
+        bwt = bwtRegistry.getBWT(groupDatasets[0])
+
+        #the k-mers have to fit in the reads; uniform lengths count the '$'
+        readLen = msSharedUtil.uniformLengths[j]-1 if msSharedUtil.uniformLengths[j] > 0 else len(bwt.recoverString(0))-1
+        kmerSize = max(1, min(args.kmerSize, readLen-5))
+        panel = buildPanel(bwt, rng, args.kmers, kmerSize)
+        seeds = [getReadKmer(bwt, rng, kmerSize) for x in xrange(0, args.seeds)]
+
+        for benchmark in args.benchmarks:
+            for mode in args.modes:
+                function, kmersPerCall = buildCalls(benchmark, mode, client, groupDatasets, panel, seeds, args.threshold)
+                result = summarize(timeCalls(function, args.repeats), kmersPerCall)
+                result.update({'benchmark':benchmark, 'mode':mode, 'group':groupLabel, 'kmerSize':kmerSize,
+                               'peakRSSBytes':getPeakRSS(), 'workerPeakRSSBytes':getWorkerPeakRSS()})
+                results.append(result)
+                print '%-12s %-7s %-12s p50 %9.2f ms  p95 %9.2f ms  p99 %9.2f ms  %12.1f k-mers/s' % (
+                    benchmark, mode, groupLabel, result['p50'], result['p95'], result['p99'], result['kmersPerSecond'])
+
+    return {'created':time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings':{'kmers':args.kmers, 'kmerSize':args.kmerSize, 'seeds':args.seeds, 'repeats':args.repeats,
+                        'seed':args.seed, 'threshold':args.threshold, 'countCache':args.countCache,
+                        'batchWorkers':msSharedUtil.batchWorkers},
+            'peakRSSBytes':getPeakRSS(),
+            'workerPeakRSSBytes':getWorkerPeakRSS(),
+            'results':results}
+
+def compareResults(old, new):
+    '''
+    Prints the change in latency and throughput for every result that is in both runs
+    @param old - the results from the earlier run
+    @param new - the results from this run
+    '''
+    oldResults = dict([((r['benchmark'], r['mode'], r['group']), r) for r in old['results']])
+    print
+    print '%-36s %12s %12s %12s' % ('', 'p50 change', 'p95 change', 'k-mers/s')
+    for r in new['results']:
+        key = (r['benchmark'], r['mode'], r['group'])
+        if key in oldResults:
+            o = oldResults[key]
+            print '%-36s %+11.1f%% %+11.1f%% %+11.1f%%' % (' '.join(key),
+                                                            100.0*(r['p50']-o['p50'])/o['p50'] if o['p50'] > 0 else 0.0,
+                                                            100.0*(r['p95']-o['p95'])/o['p95'] if o['p95'] > 0 else 0.0,
+                                                            100.0*(r['kmersPerSecond']-o['kmersPerSecond'])/o['kmersPerSecond']
+                                                            if o['kmersPerSecond'] > 0 else 0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the query tools against the configured datasets')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='the JSON file to write the results to (default: benchmark.json)')
+    parser.add_argument('--compare', default=None, help='a JSON file from an earlier run to compare against')
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS, help='the tools to benchmark (default: all)')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES, help='call the handlers directly and/or through Flask (default: both)')
+    parser.add_argument('--kmers', type=int, default=1000, help='the number of k-mers in each panel (default: 1000)')
+    parser.add_argument('--kmer-size', dest='kmerSize', type=int, default=25, help='the k-mer length, shortened for short reads (default: 25)')
+    parser.add_argument('--seeds', type=int, default=20, help='the number of seeds for the single pattern tools (default: 20)')
+    parser.add_argument('--repeats', type=int, default=20, help='the number of timed calls per benchmark (default: 20)')
+    parser.add_argument('--threshold', type=int, default=2, help='the Targeted Assembly threshold (default: 2)')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed for the panels (default: 0)')
+    parser.add_argument('--count-cache', dest='countCache', action='store_true', help='cache counts and paths (see countCacheEntries and countCachePaths)')
+    args = parser.parse_args()
+
+    #keep the benchmark from reading or writing the server's saved state
+    stateDir = tempfile.mkdtemp(prefix='msbwtBenchmark')
+    msSharedUtil.jobDirectory = stateDir+'/jobs'
+    msSharedUtil.countCacheDirectory = stateDir+'/countCache'
+    if not args.countCache:
+        msSharedUtil.countCacheEntries = 0
+        msSharedUtil.countCachePaths = 0
+
+    try:
+        results = runBenchmarks(args)
+    finally:
+        shutil.rmtree(stateDir, ignore_errors=True)
+
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=4, sort_keys=True)
+    print 'Results saved to '+args.output
+
+    if args.compare != None:
+        with open(args.compare) as fp:
+            compareResults(json.load(fp), results)
+
+if __name__ == '__main__':
+    main()
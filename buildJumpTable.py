@@ -0,0 +1,49 @@
+#!/usr/bin/python
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file builds the jump table sidecar (see MsbwtPages/jumpTable.py) for the datasets in the configured directories.  Run it
+after adding or rebuilding a BWT; a server process uses a new table the next time it opens the BWT (see bwtRegistry):
+
+    python buildJumpTable.py
+    python buildJumpTable.py 0-randomData1 0-randomData2 --q 12 --force
+
+Datasets that already have a current table of the same length are skipped unless --force is given.
+'''
+
+import argparse
+import time
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+from MsbwtPages import datasetCatalog
+from MsbwtPages import jumpTable
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the jump table sidecar for the configured datasets')
+    parser.add_argument('datasets', nargs='*', help='the dataset IDs to build, such as 0-randomData1 (default: every dataset)')
+    parser.add_argument('--q', type=int, default=10, help='the number of bases in each table entry, the table has 4^q entries (default: 10)')
+    parser.add_argument('--force', action='store_true', help='rebuild tables that are already up to date')
+    args = parser.parse_args()
+
+    if args.q < 1:
+        parser.error('--q must be at least 1')
+
+    if len(args.datasets) > 0:
+        entries = [datasetCatalog.getDataset(dataset) for dataset in args.datasets]
+    else:
+        entries = [entry for groupIndex, groupLabel, groupEntries in datasetCatalog.getGroups() for entry in groupEntries]
+
+    for entry in entries:
+        current = jumpTable.loadTable(entry['directory'])
+        if not args.force and current != None and current['q'] == args.q:
+            print '%s: up to date' % entry['id']
+            continue
+        st = time.time()
+        bwt = MSBWT.loadBWT(entry['directory'])
+        table = jumpTable.computeTable(bwt, args.q)
+        jumpTable.saveTable(entry['directory'], table, args.q)
+        print '%s: %d entries, %d bytes (%.1f seconds)' % (entry['id'], table.shape[0], table.nbytes, time.time()-st)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file builds the statistics sidecar (see MsbwtPages/datasetStats.py) for the datasets in the configured directories.  Run it
+after adding or rebuilding a BWT; the server picks up new sidecars on its next catalog refresh:
+
+    python buildStats.py
+    python buildStats.py 0-randomData1 0-randomData2 --force
+
+Datasets that already have a current sidecar are skipped unless --force is given.
+'''
+
+import argparse
+import time
+
+from MUSCython import MultiStringBWTCython as MSBWT
+
+from MsbwtPages import datasetCatalog
+from MsbwtPages import datasetStats
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the statistics sidecar for the configured datasets')
+    parser.add_argument('datasets', nargs='*', help='the dataset IDs to build, such as 0-randomData1 (default: every dataset)')
+    parser.add_argument('--sample-reads', dest='sampleReads', type=int, default=100000, help='the maximum number of reads used for the read length histogram (default: 100000)')
+    parser.add_argument('--force', action='store_true', help='rebuild sidecars that are already up to date')
+    args = parser.parse_args()
+
+    if len(args.datasets) > 0:
+        entries = [datasetCatalog.getDataset(dataset) for dataset in args.datasets]
+    else:
+        entries = [entry for groupIndex, groupLabel, groupEntries in datasetCatalog.getGroups() for entry in groupEntries]
+
+    for entry in entries:
+        if not args.force and datasetStats.loadStats(entry['directory']) != None:
+            print '%s: up to date' % entry['id']
+            continue
+        st = time.time()
+        bwt = MSBWT.loadBWT(entry['directory'])
+        stats = datasetStats.computeStats(bwt, entry['directory'], args.sampleReads)
+        datasetStats.saveStats(entry['directory'], stats)
+        print '%s: %d strings, %d bases (%.1f seconds)' % (entry['id'], stats['stringCount'], stats['baseCount'], time.time()-st)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+'''
+Author: James Holt
+Contact: holtjma@cs.unc.edu
+This file is the production entry point for the web tools.  "application.py" runs the single process Flask development server,
+while this binds the port once and forks several server processes that all accept connections from it:
+
+    python serve.py --host 0.0.0.0 --port 8000
+    python serve.py --processes 8 --hot 0-randomData1 1-randomData1
+
+Before forking, the datasets in "hotDatasets" (see msSharedUtil, or --hot) are opened and their files are read into the OS page
+cache, so every server process (and its batch workers) starts with them open and shares the same pages.  Each server process runs
+a readiness check (the hot datasets answer a count and the home page renders) before it accepts any connections, and a process
+that fails the check or exits is started again.
+'''
+
+import argparse
+import errno
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+from MsbwtPages import bwtMemory
+from MsbwtPages import bwtRegistry
+from MsbwtPages import datasetCatalog
+from MsbwtPages import jobQueue
+from MsbwtPages import msSharedUtil
+from MsbwtPages import serverMetrics
+
+#the page modules imported by the routes in "application.py"; they are imported before forking so that no server process pays
+#for the imports on its first request
+PAGE_MODULES = ['msHome', 'msCompare', 'msAllele', 'msTarget', 'followPath', 'msMassQuery', 'massQuery', 'msBatchQuery',
+                'batchQuery', 'msHelp', 'countCache']
+
+#the number of seconds to wait before starting a server process again after it exits
+RESTART_SECONDS = 1
+
+#server process ID -> slot number, only used in the parent
+children = {}
+stopping = False
+
+def preloadDatasets(hotDatasets):
+    '''
+    Opens each hot dataset in the shared registry and reads its files into the page cache, this runs in the parent before forking
+    @param hotDatasets - the list of dataset IDs to open
+    '''
+    for dataset in hotDatasets:
+        st = time.time()
+        directory = datasetCatalog.getDirectory(dataset)
+        bwtRegistry.getBWT(dataset)
+        numBytes = bwtMemory.warmDataset(directory)
+        values = bwtMemory.getProcessReport([dataset], False)[dataset]
+        print 'Preloaded %s: %d bytes read, %d mapped, %d resident (%.1f seconds)' % (dataset, numBytes, values['mappedBytes'],
+                                                                                      values['residentBytes'], time.time()-st)
+
+def checkReady(application, hotDatasets):
+    '''
+    The readiness check for a server process
+    @param application - the Flask application
+    @param hotDatasets - the list of dataset IDs that must be open
+    @return - None if the process is ready, otherwise a message describing what failed
+    '''
+    for dataset in hotDatasets:
+        bwtRegistry.getBWT(dataset).countOccurrencesOfSeq('A')
+    response = application.test_client().get('/')
+    if response.status_code != 200:
+        return 'the home page returned status %d' % response.status_code
+    return None
+
+def runServer(sock, host, port, slot, resumeJobs, hotDatasets):
+    '''
+    The body of each server process, it only returns by exiting
+    @param sock - the listening socket shared by all of the server processes
+    @param host - the host the socket is bound to
+    @param port - the port the socket is bound to
+    @param slot - the number of this server process, from 0 to the number of processes-1
+    @param resumeJobs - if True, this process resumes the batch query jobs that were unfinished when the server last stopped;
+        otherwise it only takes over jobs from server processes that have died (see jobQueue.heartbeatLoop())
+    @param hotDatasets - the list of dataset IDs that must be open before serving
+    '''
+    #the parent handles Ctrl-C and passes it on as SIGTERM, which exits normally so the batch workers are cleaned up
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    #the parent records no metrics, but this process starts from a clean set (and a lock no other thread can be holding)
+    serverMetrics.resetAfterFork()
+    try:
+        #the catalog and job threads are started here instead of in the parent since threads don't survive a fork
+        jobQueue.resumeJobs = resumeJobs
+        import application
+        error = checkReady(application.application, hotDatasets)
+    except Exception:
+        error = traceback.format_exc()
+    if error != None:
+        print 'Server process %d failed its readiness check:\n%s' % (slot, error)
+        sys.stdout.flush()
+        os._exit(1)
+
+    server = make_server(host, port, application.application, threaded=True, fd=sock.fileno())
+    print 'Server process %d (pid %d) is ready' % (slot, os.getpid())
+    sys.stdout.flush()
+    server.serve_forever()
+
+def startServer(sock, host, port, slot, resumeJobs, hotDatasets):
+    '''
+    Forks a server process
+    @param sock, host, port, slot, resumeJobs, hotDatasets - see runServer(...)
+    '''
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            runServer(sock, host, port, slot, resumeJobs, hotDatasets)
+        except Exception:
+            traceback.print_exc()
+        os._exit(1)
+    children[pid] = slot
+
+def stopServers(signum, frame):
+    '''
+    Signal handler for the parent, stops every server process
+    '''
+    global stopping
+    stopping = True
+    for pid in children.keys():
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the web tools with several preforked server processes')
+    parser.add_argument('--host', default='127.0.0.1', help='the address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5000, help='the port to listen on (default: 5000)')
+    parser.add_argument('--processes', type=int, default=msSharedUtil.serverProcesses, help='the number of server processes (default: serverProcesses in msSharedUtil)')
+    parser.add_argument('--hot', nargs='*', default=msSharedUtil.hotDatasets, help='the dataset IDs to preload before forking (default: hotDatasets in msSharedUtil)')
+    args = parser.parse_args()
+
+    #everything done here before forking is shared by the server processes; no metrics are recorded here, since the flush thread
+    #that would start isn't carried into the server processes but its lock could be
+    serverMetrics.recording = False
+    for moduleName in PAGE_MODULES:
+        __import__('MsbwtPages.'+moduleName)
+    for groupIndex, groupLabel, groupEntries in datasetCatalog.getGroups():
+        for entry in groupEntries:
+            if bwtMemory.prepareIndexes(entry['directory']):
+                print 'Built the FM-index for %s' % entry['id']
+    preloadDatasets(args.hot)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    print 'Listening on http://%s:%d with %d server processes' % (args.host, args.port, args.processes)
+
+    signal.signal(signal.SIGINT, stopServers)
+    signal.signal(signal.SIGTERM, stopServers)
+    for slot in xrange(0, args.processes):
+        startServer(sock, args.host, args.port, slot, slot == 0, args.hot)
+
+    while len(children) > 0:
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        slot = children.pop(pid, None)
+        if slot == None or stopping:
+            continue
+        print 'Server process %d (pid %d) exited with status %d, restarting it' % (slot, pid, status)
+        time.sleep(RESTART_SECONDS)
+        if not stopping:
+            #the jobs of the exited process are taken over through the job heartbeat, by this or any other live process
+            startServer(sock, args.host, args.port, slot, False, args.hot)
+
+if __name__ == '__main__':
+    main()
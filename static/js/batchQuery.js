@@ -26,6 +26,16 @@ var countRevComp
 
 var selectedDataset
 var selectedDatasets = []
+var panelID
+var receivedDatasets = {}
+
+//rows that finished before an earlier dataset, they are written once every dataset before them is
+var bufferedRows = {}
+var nextOutputIndex = 0
+
+//queries with more counts than this (k-mers times datasets) are submitted as a server-side job instead
+var jobThreshold = 1000000
+var jobPollTime = 2000
 var currentDatasetID = 0
 var currentQueryID = 0
 
@@ -151,12 +161,20 @@ function executeBatchQuery() {
         
         newHeader += '\n'
         resultBox.val(newHeader)
+        receivedDatasets = {}
+        bufferedRows = {}
+        nextOutputIndex = 0
         
         var currStart = 0
         if (currStart < kmerList.length) {
             //alright, so now we send our query, here are the necessary parameters
             //querySlice(0, Math.min(querySize, kmerList.length), 1000, myQueryID)
-            batchQuery(1000, myQueryID);
+            if (kmerList.length*parsedDatasets.length > jobThreshold) {
+                submitBatchJob(1000, myQueryID);
+            }
+            else {
+                registerPanel(1000, myQueryID);
+            }
         }
     }
     
@@ -164,70 +182,229 @@ function executeBatchQuery() {
     $('html, body').animate({scrollTop: $('#text-console').offset().top}, 100);
 }
 
+function registerPanel(waitTime, myQueryID) {
+    //the k-mers are uploaded once, then every dataset (and any retry) only refers to the panel
+    updateConsole("Uploading "+kmerList.length+" k-mers...")
+    var params = {
+        "kmers":kmerList.join("\n"),
+        "format":"text"
+    };
+    var handler = {
+        'callback': attacher(this, function(data) {
+            if (myQueryID == currentQueryID) {
+                panelID = JSON.parse(data).panelID
+                batchQuery(1000, myQueryID)
+            }
+        }),
+        'error': attacher(this, function(err, status, responseText) {
+            if (myQueryID == currentQueryID) {
+                console.log(err);
+                if (status >= 400 && status < 500) {
+                    //the panel was rejected (e.g. too many k-mers), sending it again won't help
+                    updateConsole('ERROR: '+responseText);
+                    return;
+                }
+                updateConsole('SERVER ERROR: '+err.toString());
+                updateConsole('Waiting '+waitTime+'ms to try again...')
+                setTimeout(function() {
+                    registerPanel(2*waitTime, myQueryID)
+                }, waitTime);
+            }
+        })
+    };
+    
+    AJAX('panel', handler, params);
+}
+
 function batchQuery(waitTime, myQueryID) {
-    updateConsole("Executing all queries...")
+    //only ask for the datasets we don't have yet, this matters when we are retrying after an error
+    var remainingDatasets = []
+    for (i=0; i < parsedDatasets.length; i++) {
+        if (!(parsedDatasets[i] in receivedDatasets)) {
+            remainingDatasets.push(parsedDatasets[i])
+        }
+    }
+    
+    updateConsole("Executing queries for "+remainingDatasets.length+" dataset(s)...")
+    var params = {
+        "panelID":panelID,
+        "datasets":JSON.stringify(remainingDatasets),
+        "forwardEnabled":countForward,
+        "revCompEnabled":countRevComp,
+        "stream":true
+    };
+    var handler = {
+        'record': attacher(this, function(record) {
+            if (myQueryID == currentQueryID) {
+                //each record is one finished dataset, its row is written as soon as every dataset before it is done
+                var newText = $("#"+record.dataset).val()
+                var currentIndex = 0
+                while (currentIndex < kmerList.length) {
+                    if (countForward) {
+                        newText += delimiter+record.counts[0][currentIndex]
+                    }
+                    if (countRevComp) {
+                        newText += delimiter+record.counts[1][currentIndex]
+                    }
+                    currentIndex += 1
+                }
+                newText += "\n"
+                receivedDatasets[record.dataset] = true
+                bufferedRows[record.dataset] = newText
+                updateConsole("Received "+$("#"+record.dataset).val());
+                
+                //the rows go out in the order the datasets were selected
+                var outputText = ""
+                while (nextOutputIndex < parsedDatasets.length && parsedDatasets[nextOutputIndex] in bufferedRows) {
+                    outputText += bufferedRows[parsedDatasets[nextOutputIndex]]
+                    delete bufferedRows[parsedDatasets[nextOutputIndex]]
+                    nextOutputIndex += 1
+                }
+                
+                //update the output box, and then our save link
+                if (outputText.length > 0) {
+                    resultBox.val(resultBox.val()+outputText);
+                    updateSaveLink();
+                }
+            }
+        }),
+        'callback': attacher(this, function() {
+            if (myQueryID == currentQueryID) {
+                if (Object.keys(receivedDatasets).length < parsedDatasets.length) {
+                    //the stream ended early, treat it like any other server error
+                    handler.error('Incomplete response')
+                }
+                else {
+                    updateConsole("All queries completed");
+                }
+            }
+        }),
+        'error': attacher(this, function(err, status, responseText) {
+            if (myQueryID == currentQueryID) {
+                console.log(err);
+                if (status == 404) {
+                    //saved panels are removed when they haven't been used in a while, so upload it again; only the datasets
+                    //we don't have yet are counted after that
+                    registerPanel(1000, myQueryID)
+                    return;
+                }
+                else if (status >= 400 && status < 500) {
+                    updateConsole('ERROR: '+responseText);
+                    return;
+                }
+                updateConsole('SERVER ERROR: '+err.toString());
+                updateConsole('Waiting '+waitTime+'ms to try again...')
+                
+                setTimeout(function() {
+                    batchQuery(2*waitTime, myQueryID)
+                }, waitTime);
+            }
+        })
+    };
+    
+    AJAXStream('batchQuery', handler, params);
+}
+
+function submitBatchJob(waitTime, myQueryID) {
+    updateConsole("Submitting batch job...")
     var params = {
         "kmerQueries":JSON.stringify(kmerList),
         "datasets":JSON.stringify(parsedDatasets),
         "forwardEnabled":countForward,
         "revCompEnabled":countRevComp
     };
-    console.log(params);
     var handler = {
         'callback': attacher(this, function(data) {
             if (myQueryID == currentQueryID) {
-                var parsedValues = JSON.parse(data);
-                console.log(parsedValues);
+                var jobID = JSON.parse(data).jobID
+                updateConsole("Job "+jobID+" submitted, waiting for results...")
+                pollBatchJob(jobID, waitTime, myQueryID)
+            }
+        }),
+        'error': attacher(this, function(err) {
+            if (myQueryID == currentQueryID) {
+                console.log(err);
+                updateConsole('SERVER ERROR: '+err.toString());
+                updateConsole('Waiting '+waitTime+'ms to try again...')
                 
-                var start = 0
-                var end = kmerList.length
-                var offset = 0
-                if (headerPresent) {
-                    offset = 1
+                //re-submitting the same query resumes the job on the server
+                setTimeout(function() {
+                    submitBatchJob(2*waitTime, myQueryID)
+                }, waitTime);
+            }
+        })
+    };
+    
+    AJAX('batchJob', handler, params);
+}
+
+function pollBatchJob(jobID, waitTime, myQueryID) {
+    var handler = {
+        'callback': attacher(this, function(data) {
+            if (myQueryID == currentQueryID) {
+                var status = JSON.parse(data)
+                if (status.state == "done") {
+                    updateConsole("Job "+jobID+" finished, retrieving results...")
+                    getBatchJobResult(jobID, waitTime, myQueryID)
                 }
-                var initialText = resultBox.val()
+                else if (status.state == "failed") {
+                    console.log(status.error);
+                    updateConsole("Job "+jobID+" failed, waiting "+waitTime+"ms to resume it...")
+                    setTimeout(function() {
+                        submitBatchJob(2*waitTime, myQueryID)
+                    }, waitTime);
+                }
+                else {
+                    updateConsole("Job "+jobID+" is "+status.state+": "+status.kmersDone+" of "+status.kmersTotal+" counts done")
+                    setTimeout(function() {
+                        pollBatchJob(jobID, waitTime, myQueryID)
+                    }, jobPollTime);
+                }
+            }
+        }),
+        'error': attacher(this, function(err) {
+            if (myQueryID == currentQueryID) {
+                //the job keeps running on the server, so just check again later
+                console.log(err);
+                updateConsole('SERVER ERROR: '+err.toString());
+                setTimeout(function() {
+                    pollBatchJob(jobID, waitTime, myQueryID)
+                }, jobPollTime);
+            }
+        })
+    };
+    
+    AJAX('batchJob/'+jobID, handler, null);
+}
 
-                for (i=0; i < selectedDatasets.length; i++) {
-                    selectedDataset = selectedDatasets[i].value
+function getBatchJobResult(jobID, waitTime, myQueryID) {
+    var handler = {
+        'callback': attacher(this, function(data) {
+            if (myQueryID == currentQueryID) {
+                var parsedValues = JSON.parse(data);
+                var initialText = resultBox.val()
+                
+                for (i=0; i < parsedDatasets.length; i++) {
+                    selectedDataset = parsedDatasets[i]
                     initialText += $("#"+selectedDataset).val()
                     
-                    var currentIndex = start
-                    while (currentIndex < end) {
+                    var currentIndex = 0
+                    while (currentIndex < kmerList.length) {
                         if (countForward) {
-                            initialText += delimiter+parsedValues[selectedDataset][0][currentIndex-start]
+                            initialText += delimiter+parsedValues[selectedDataset][0][currentIndex]
                         }
                         if (countRevComp) {
-                            initialText += delimiter+parsedValues[selectedDataset][1][currentIndex-start]
+                            initialText += delimiter+parsedValues[selectedDataset][1][currentIndex]
                         }
                         currentIndex += 1
                     }
-                    
-                    if (end >= kmerList.length) {
-                        initialText += "\n"
-                    }
+                    initialText += "\n"
                 }
                 
                 //update the output box, and then our save link
                 resultBox.val(initialText);
                 updateSaveLink();
                 updateConsole("All queries completed");
-                /*
-                if (end < kmerList.length) {
-                    //querySlice(end, Math.min(end+querySize, kmerList.length), 1000, myQueryID)
-                }
-                else {
-                    currentDatasetID++
-                    
-                    if (currentDatasetID < selectedDatasets.length) {
-                        selectedDataset = selectedDatasets[currentDatasetID].value
-                        querySlice(0, Math.min(querySize, kmerList.length), 1000, myQueryID)
-                    }
-                    else {
-                        //do nothing, we have finished the last query
-                        updateConsole("All queries completed")
-                    }
-                }
-                */
             }
         }),
         'error': attacher(this, function(err) {
@@ -235,16 +412,14 @@ function batchQuery(waitTime, myQueryID) {
                 console.log(err);
                 updateConsole('SERVER ERROR: '+err.toString());
                 updateConsole('Waiting '+waitTime+'ms to try again...')
-                
                 setTimeout(function() {
-                    //querySlice(start, end, 2*waitTime, myQueryID)
-                    batchQuery(2*waitTime, myQueryID)
+                    getBatchJobResult(jobID, 2*waitTime, myQueryID)
                 }, waitTime);
             }
         })
     };
     
-    AJAX('batchQuery', handler, params);
+    AJAX('batchJob/'+jobID+'/result', handler, null);
 }
 
 function querySlice(start, end, waitTime, myQueryID) {
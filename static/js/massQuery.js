@@ -19,11 +19,11 @@ function attacher() {
     }
 };
 
-var querySize = 1000
 var kmerList
 var countForward
 var countRevComp
 var selectedDataset
+var panelID
 var currentQueryID = 0
 
 var inputBox = $("#input-textbox");
@@ -138,10 +138,9 @@ function executeBatchQuery() {
         newHeader += '\n'
         resultBox.val(newHeader)
         
-        var currStart = 0
-        if (currStart < kmerList.length) {
-            //alright, so now we send our query, here are the necessary parameters
-            querySlice(0, Math.min(querySize, kmerList.length), 1000, myQueryID)
+        if (kmerList.length > 0) {
+            //alright, so now we upload the k-mers once as a panel, then the results are streamed back as they are counted
+            registerPanel(1000, myQueryID, 0)
         }
     }
     
@@ -149,45 +148,86 @@ function executeBatchQuery() {
     $('html, body').animate({scrollTop: $('#text-console').offset().top}, 100);
 }
 
-function querySlice(start, end, waitTime, myQueryID) {
-    updateConsole("Executing queries ["+(start+1)+","+end+"]...")
+function registerPanel(waitTime, myQueryID, start) {
+    updateConsole("Uploading "+kmerList.length+" k-mers...")
     var params = {
-        "kmerQueries":JSON.stringify(kmerList.slice(start, end)),
+        "kmers":kmerList.join("\n"),
+        "format":"text"
+    };
+    var handler = {
+        'callback': attacher(this, function(data) {
+            if (myQueryID == currentQueryID) {
+                panelID = JSON.parse(data).panelID
+                queryStream(start, 1000, myQueryID)
+            }
+        }),
+        'error': attacher(this, function(err, status, responseText) {
+            if (myQueryID == currentQueryID) {
+                console.log(err);
+                if (status >= 400 && status < 500) {
+                    //the panel was rejected (e.g. too many k-mers), sending it again won't help
+                    updateConsole('ERROR: '+responseText);
+                    return;
+                }
+                updateConsole('SERVER ERROR: '+err.toString());
+                updateConsole('Waiting '+waitTime+'ms to try again...')
+                setTimeout(function(){
+                    registerPanel(2*waitTime, myQueryID, start)
+                }, waitTime);
+            }
+        })
+    };
+    
+    AJAX('./panel', handler, params);
+}
+
+function queryStream(start, waitTime, myQueryID) {
+    updateConsole("Executing queries ["+(start+1)+","+kmerList.length+"]...")
+    var params = {
+        "panelID":panelID,
+        "start":start,
         "dataset":selectedDataset,
         "forwardEnabled":countForward,
-        "revCompEnabled":countRevComp
+        "revCompEnabled":countRevComp,
+        "stream":true
     };
     
+    //the server sends the counts back in chunks, this is where the next unreceived query is
+    var received = start
+    var offset = 0
+    if (headerPresent) {
+        offset = 1
+    }
+    
     var handler = {
-        'callback': attacher(this, function(data) {
+        'record': attacher(this, function(record) {
             if (myQueryID == currentQueryID) {
-                var parsedValues = JSON.parse(data);
-                
-                var currentIndex = start
-                var offset = 0
-                if (headerPresent) {
-                    offset = 1
-                }
-                var initialText = resultBox.val()
-                while (currentIndex < end) {
-                    //initialText += kmerList[currentIndex]+","+parsedValues[0][currentIndex-start]
-                    initialText += parsedLines[currentIndex+offset].join(delimiter)
+                var chunkStart = start+record.start
+                var chunkLength = Math.max(record.counts[0].length, record.counts[1].length)
+                var newText = ""
+                for (var i = 0; i < chunkLength; i++) {
+                    newText += parsedLines[chunkStart+i+offset].join(delimiter)
                     if (countForward) {
-                        initialText += delimiter+parsedValues[0][currentIndex-start]
+                        newText += delimiter+record.counts[0][i]
                     }
                     if (countRevComp) {
-                        initialText += delimiter+parsedValues[1][currentIndex-start]
+                        newText += delimiter+record.counts[1][i]
                     }
-                    initialText += "\n"
-                    currentIndex += 1
+                    newText += "\n"
                 }
+                received = chunkStart+chunkLength
                 
                 //update the output box, and then our save link
-                resultBox.val(initialText);
+                resultBox.val(resultBox.val()+newText);
                 updateSaveLink();
-                
-                if (end < kmerList.length) {
-                    querySlice(end, Math.min(end+querySize, kmerList.length), 1000, myQueryID)
+                updateConsole("Received queries ["+(chunkStart+1)+","+received+"]")
+            }
+        }),
+        'callback': attacher(this, function() {
+            if (myQueryID == currentQueryID) {
+                if (received < kmerList.length) {
+                    //the stream ended early, treat it like any other server error
+                    handler.error('Incomplete response')
                 }
                 else {
                     //do nothing, we have finished the last query
@@ -195,20 +235,30 @@ function querySlice(start, end, waitTime, myQueryID) {
                 }
             }
         }),
-        'error': attacher(this, function(err) {
+        'error': attacher(this, function(err, status, responseText) {
             if (myQueryID == currentQueryID) {
                 console.log(err);
+                if (status == 404) {
+                    //saved panels are removed when they haven't been used in a while, so upload it again and pick up where we were
+                    registerPanel(1000, myQueryID, received)
+                    return;
+                }
+                else if (status >= 400 && status < 500) {
+                    updateConsole('ERROR: '+responseText);
+                    return;
+                }
                 updateConsole('SERVER ERROR: '+err.toString());
                 updateConsole('Waiting '+waitTime+'ms to try again...')
                 
+                //only the queries we haven't received yet are sent again
                 setTimeout(function(){
-                    querySlice(start, end, 2*waitTime, myQueryID)
+                    queryStream(received, 2*waitTime, myQueryID)
                 }, waitTime);
             }
         })
     };
     
-    AJAX('./massQuery', handler, params);
+    AJAXStream('./massQuery', handler, params);
 }
 
 function updateFile(input) {
@@ -23,7 +23,7 @@ function AJAX(script, handler, params) {
                 handler.error('Empty response');
         }
         else if(xmlhttp.readyState == 4) {
-            handler.error('Error: '+xmlhttp.status);
+            handler.error('Error: '+xmlhttp.status, xmlhttp.status, xmlhttp.responseText);
         }
     }
     if(params) {
@@ -68,3 +68,44 @@ function RPC(script, handler, params) {
     }
     AJAX(script, tmp_handler, params);
 }
+
+// Same as AJAX(...), but for newline-delimited JSON responses.  Each
+// record is handed to handler.record as soon as its line arrives, then
+// handler.callback is called once the response is complete.
+function AJAXStream(script, handler, params) {
+    var xmlhttp = new XMLHttpRequest();
+    var parsedLength = 0;
+    
+    function parseRecords() {
+        var response = xmlhttp.responseText;
+        var lineEnd = response.indexOf('\n', parsedLength);
+        while (lineEnd != -1) {
+            var line = response.substring(parsedLength, lineEnd);
+            parsedLength = lineEnd+1;
+            if (line.length > 0)
+                handler.record(JSON.parse(line));
+            lineEnd = response.indexOf('\n', parsedLength);
+        }
+    }
+    
+    xmlhttp.onprogress=function(){
+        if (xmlhttp.status == 200)
+            parseRecords();
+    }
+    xmlhttp.onreadystatechange=function(){
+        if (xmlhttp.readyState == 4 && xmlhttp.status == 200) {
+            parseRecords();
+            handler.callback();
+        }
+        else if(xmlhttp.readyState == 4) {
+            handler.error('Error: '+xmlhttp.status, xmlhttp.status, xmlhttp.responseText);
+        }
+    }
+    xmlhttp.open("POST", script, true);
+    var data = '';
+    for(p in params) {
+        data += '&' + p + '=' + params[p];
+    }
+    xmlhttp.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
+    xmlhttp.send(data);
+}
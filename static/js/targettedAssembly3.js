@@ -213,6 +213,177 @@ function addNodeOnClick() {
     }
 };
 
+//saves the results for a node and adds any children that pass the threshold; "parsedValues" has the same format that "/followPath" returns
+function applyNodeResult(clickID, parsedValues) {
+    var validSymbols = 'ACGT';
+    
+    //we got a response, save the response values
+    pathList[clickID] = parsedValues[0];
+    countsList[clickID] = parsedValues[1];
+    revCountsList[clickID] = parsedValues[2];
+    nodeStatus[clickID] = STATE_RESULTS_READY;
+    
+    var nextCounts = parsedValues[3]
+    var revNextCounts = parsedValues[4]
+    
+    var clickIntID, nIntID;
+    
+    //this is the only way i know to change color in SVG
+    var parentModStr = "<td>"+clickID+"</td>";
+    parentModStr += "<td>"+pathList[clickID].length.toString()+"</td>";
+    parentModStr += "<td> ";
+    
+    var newColor;
+    if (clickID == "n0") newColor = '#0f0';
+    else newColor = '#000';
+    
+    //now lets add any new nodes that may be necessary
+    var foundChild = false;
+    //console.log(nextCounts);
+    for (x in nextCounts)
+    {
+        if((nextCounts[x]+revNextCounts[x]) >= KMER_THRESHOLD)
+        {
+            foundChild = true;
+            //we need to make a node and an edge
+            //add the node and kmer to our graph
+            newStart = pathList[clickID].substring(pathList[clickID].length-kmerLength+1)+validSymbols[x];
+            var previouslyFound = false;
+            for (nID in kmerStartList) {
+                if(kmerStartList[nID] == newStart) {
+                    //we just need to add a backedge basically
+                    clickIntID = parseInt(clickID.substring(1));
+                    nIntID = parseInt(nID.substring(1));
+                    links.push({source: nodes[clickIntID], target: nodes[nIntID]});
+                    
+                    edgeTextValues["n"+clickIntID+"-n"+nIntID] = intToBase[x]+":"+(nextCounts[x]+revNextCounts[x]);
+                    
+                    //update the parent string
+                    parentModStr += nID+" ";
+                    
+                    //break out cause we found a back edge
+                    edgeID += 1;
+                    previouslyFound = true;
+                    break;
+                }
+            }
+            
+            if(!previouslyFound)
+            {
+                //add new node info and push it onto our node list
+                kmerStartList['n'+nodeID.toString()] = newStart
+                nodeStatus['n'+nodeID.toString()] = STATE_UNEXPLORED;
+                parentList['n'+nodeID.toString()] = clickID;
+                nodeColor['n'+nodeID.toString()] = '#ccc';
+                nodes.push({id: 'n'+nodeID.toString()});
+                
+                //update the parent string with this new node
+                parentModStr += "n"+nodeID.toString()+" ";
+                
+                //add a new row corresponding to this node
+                var newRowStr = "<tr id='results-row-n"+nodeID.toString()+"'>";
+                newRowStr += "<td>n"+nodeID.toString()+"</td>";
+                newRowStr += "<td>???</td>";
+                newRowStr += "<td>???</td>";
+                newRowStr += "<td>???</td>";
+                newRowStr += "<td>???</td>";
+                newRowStr += "</tr>";
+                
+                $('#resultsTable tr:last').after(newRowStr);
+                
+                //add the link edge here
+                clickIntID = parseInt(clickID.substring(1));
+                links.push({source: nodes[clickIntID], target: nodes[nodeID]});
+                
+                edgeTextValues['n'+clickIntID+"-n"+nodeID] = intToBase[x]+":"+(nextCounts[x]+revNextCounts[x]);
+                
+                //increment now that we're done with the id
+                nodeID += 1;
+                edgeID += 1;
+            }
+        }
+    }
+    
+    if (!foundChild) {
+        parentModStr += "---";
+        if (newColor != '#0f0') newColor = '#f00';
+    }
+    
+    //change the node color of the node that was click to red if terminal, green if the seed node, or black if non-seed and non-terminal
+    nodeColor[clickID] = newColor;
+    d3.select(".node."+clickID).style("fill", newColor);
+    updateGraph();
+    
+    parentModStr += "</td><td style='font-family: \"Courier New\", Courier, monospace;'>";
+    var z = 0;
+    var step = 50;
+    while(z < pathList[clickID].length) {
+        parentModStr += pathList[clickID].slice(z, z+step)+"<br/>";
+        z += step;
+    }
+                     
+    parentModStr += "</td>";
+    parentModStr += "<td><button id='toggle-chart-"+clickID+"' onclick='toggleCountChart(\""+clickID+"\")'>Show counts</button><br/><div id='chart-div-"+clickID+"'></div></td>";
+    
+    $("#results-row-"+clickID).html(parentModStr);
+}
+
+//asks the server to expand the graph breadth-first from the seed and replays the result as if each node had been clicked in order
+function exploreFromSeed() {
+    if (kmerStartList['n0'] == undefined) {
+        updateConsole('ERROR: Add a seed before exploring.');
+        return;
+    }
+    
+    var maxNodes = parseInt(document.getElementById('exploreNodesInput').value);
+    if (isNaN(maxNodes)) {
+        updateConsole('ERROR: Invalid maximum number of nodes.');
+        return;
+    }
+    
+    var params = {
+        "kmerText":kmerStartList['n0'],
+        "dataset":selectedDataset,
+        "kmerThreshold":KMER_THRESHOLD,
+        "maxNodes":maxNodes
+    };
+    
+    var handler = {
+        'callback': attacher(this, function(data) {
+            var parsedValues = JSON.parse(data);
+            var x, nID, serverNode;
+            var numApplied = 0;
+            
+            //the server uses the same child order as applyNodeResult(...), so each explored node lines up with a client node by its start k-mer
+            for (x = 0; x < parsedValues.nodes.length; x++) {
+                serverNode = parsedValues.nodes[x];
+                if (!serverNode.explored) continue;
+                for (nID in kmerStartList) {
+                    if (kmerStartList[nID] == serverNode.kmer) {
+                        if (nodeStatus[nID] == STATE_UNEXPLORED) {
+                            applyNodeResult(nID, [serverNode.path, serverNode.counts, serverNode.revCounts, serverNode.nextCounts, serverNode.revNextCounts]);
+                            numApplied += 1;
+                        }
+                        break;
+                    }
+                }
+            }
+            
+            updateConsole('Exploration finished, '+numApplied.toString()+' nodes expanded.');
+            if (parsedValues.truncated) {
+                updateConsole('Exploration stopped at the node or depth limit, unexplored nodes can still be clicked.');
+            }
+        }),
+        'error': attacher(this, function(err) {
+            console.log(err);
+            updateConsole('SERVER ERROR: '+err.toString());
+        })
+    };
+    
+    AJAX('/exploreGraph', handler, params);
+    updateConsole('Exploring from the seed (up to '+maxNodes.toString()+' nodes)...');
+}
+
 function nodeClick(clickID) {
     var validSymbols = 'ACGT';
     
@@ -230,116 +401,7 @@ function nodeClick(clickID) {
         'callback': attacher(this, function(data) {
             var parsedValues = JSON.parse(data);
             updateConsole('Response received for '+clickID);
-            
-            //we got a response, save the response values
-            pathList[clickID] = parsedValues[0];
-            countsList[clickID] = parsedValues[1];
-            revCountsList[clickID] = parsedValues[2];
-            nodeStatus[clickID] = STATE_RESULTS_READY;
-            
-            var nextCounts = parsedValues[3]
-            var revNextCounts = parsedValues[4]
-            
-            var clickIntID, nIntID;
-            
-            //this is the only way i know to change color in SVG
-            var parentModStr = "<td>"+clickID+"</td>";
-            parentModStr += "<td>"+pathList[clickID].length.toString()+"</td>";
-            parentModStr += "<td> ";
-            
-            var newColor;
-            if (clickID == "n0") newColor = '#0f0';
-            else newColor = '#000';
-            
-            //now lets add any new nodes that may be necessary
-            var foundChild = false;
-            //console.log(nextCounts);
-            for (x in nextCounts)
-            {
-                if((nextCounts[x]+revNextCounts[x]) >= KMER_THRESHOLD)
-                {
-                    foundChild = true;
-                    //we need to make a node and an edge
-                    //add the node and kmer to our graph
-                    newStart = pathList[clickID].substring(pathList[clickID].length-kmerLength+1)+validSymbols[x];
-                    var previouslyFound = false;
-                    for (nID in kmerStartList) {
-                        if(kmerStartList[nID] == newStart) {
-                            //we just need to add a backedge basically
-                            clickIntID = parseInt(clickID.substring(1));
-                            nIntID = parseInt(nID.substring(1));
-                            links.push({source: nodes[clickIntID], target: nodes[nIntID]});
-                            
-                            edgeTextValues["n"+clickIntID+"-n"+nIntID] = intToBase[x]+":"+(nextCounts[x]+revNextCounts[x]);
-                            
-                            //update the parent string
-                            parentModStr += nID+" ";
-                            
-                            //break out cause we found a back edge
-                            edgeID += 1;
-                            previouslyFound = true;
-                            break;
-                        }
-                    }
-                    
-                    if(!previouslyFound)
-                    {
-                        //add new node info and push it onto our node list
-                        kmerStartList['n'+nodeID.toString()] = newStart
-                        nodeStatus['n'+nodeID.toString()] = STATE_UNEXPLORED;
-                        parentList['n'+nodeID.toString()] = clickID;
-                        nodeColor['n'+nodeID.toString()] = '#ccc';
-                        nodes.push({id: 'n'+nodeID.toString()});
-                        
-                        //update the parent string with this new node
-                        parentModStr += "n"+nodeID.toString()+" ";
-                        
-                        //add a new row corresponding to this node
-                        var newRowStr = "<tr id='results-row-n"+nodeID.toString()+"'>";
-                        newRowStr += "<td>n"+nodeID.toString()+"</td>";
-                        newRowStr += "<td>???</td>";
-                        newRowStr += "<td>???</td>";
-                        newRowStr += "<td>???</td>";
-                        newRowStr += "<td>???</td>";
-                        newRowStr += "</tr>";
-                        
-                        $('#resultsTable tr:last').after(newRowStr);
-                        
-                        //add the link edge here
-                        clickIntID = parseInt(clickID.substring(1));
-                        links.push({source: nodes[clickIntID], target: nodes[nodeID]});
-                        
-                        edgeTextValues['n'+clickIntID+"-n"+nodeID] = intToBase[x]+":"+(nextCounts[x]+revNextCounts[x]);
-                        
-                        //increment now that we're done with the id
-                        nodeID += 1;
-                        edgeID += 1;
-                    }
-                }
-            }
-            
-            if (!foundChild) {
-                parentModStr += "---";
-                if (newColor != '#0f0') newColor = '#f00';
-            }
-            
-            //change the node color of the node that was click to red if terminal, green if the seed node, or black if non-seed and non-terminal
-            nodeColor[clickID] = newColor;
-            d3.select(".node."+clickID).style("fill", newColor);
-            updateGraph();
-            
-            parentModStr += "</td><td style='font-family: \"Courier New\", Courier, monospace;'>";
-            var z = 0;
-            var step = 50;
-            while(z < pathList[clickID].length) {
-                parentModStr += pathList[clickID].slice(z, z+step)+"<br/>";
-                z += step;
-            }
-                             
-            parentModStr += "</td>";
-            parentModStr += "<td><button id='toggle-chart-"+clickID+"' onclick='toggleCountChart(\""+clickID+"\")'>Show counts</button><br/><div id='chart-div-"+clickID+"'></div></td>";
-            
-            $("#results-row-"+clickID).html(parentModStr);
+            applyNodeResult(clickID, parsedValues);
         }),
         'error': attacher(this, function(err) {
             nodeStatus[clickID] = STATE_UNEXPLORED;